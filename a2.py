@@ -21,10 +21,1587 @@ This file contains the WasteWrangler class and some simple testing functions.
 """
 
 import datetime as dt
+import functools
+import logging
+import itertools
+import os
+import random
+import re
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import monotonic, perf_counter
 import psycopg2 as pg
 import psycopg2.extensions as pg_ext
 import psycopg2.extras as pg_extras
-from typing import Optional, TextIO
+import psycopg2.pool as pg_pool
+from typing import Callable, Iterable, Iterator, Optional, TextIO
+
+try:
+    from availability import DayAvailability
+except ImportError:
+    DayAvailability = None
+
+
+# Pooled connections idle for longer than this many seconds are pinged before
+# they are handed out again.
+_POOL_PING_AFTER = 30.0
+
+# The number of days schedule_maintenance loads bookings for at a time.
+_MAINTENANCE_HORIZON = 30
+
+# The number of rows read at a time from a server-side cursor by default.
+_STREAM_ITERSIZE = 2000
+
+# Working hours for scheduled trips, and the gap to leave around each trip.
+_SHIFT_START = dt.time(8, 0)
+_SHIFT_END = dt.time(16, 0)
+_TRIP_GAP = dt.timedelta(minutes=30)
+
+# Trucks travel at an average of 5 kph, i.e. 12 minutes per km of route.
+_TRIP_DURATION = "r.length * interval '12 minutes'"
+
+# The kinds of resources the scheduling methods lock while they book them:
+# routes, trucks, employees on trips and technicians, each for a day, and
+# trucks due for maintenance, for any day.
+_LOCK_ROUTE = 1
+_LOCK_TRUCK = 2
+_LOCK_EMPLOYEE = 3
+_LOCK_TECHNICIAN = 4
+_LOCK_OVERDUE = 5
+
+# The number of times a scheduling method plans again after finding that a
+# resource it planned with was booked just before it locked it.
+_CLAIM_ATTEMPTS = 3
+
+# The upper bounds, in seconds, of the buckets of the latency histograms kept
+# by Instrumentation. A final bucket counts every call.
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0)
+
+# The counters Instrumentation keeps for each method, besides its latency.
+_CALL_COUNTERS = ("calls", "statements", "round_trips", "rows", "commits")
+
+# The instrumented method call running on each thread, if any: its counters,
+# its method name and arguments, and the SlowQueryExplainer watching it.
+_ACTIVE_CALL = threading.local()
+
+# The statements that can be run under EXPLAIN, by their first keyword.
+_EXPLAINABLE = {"SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "EXECUTE",
+                "VALUES", "TABLE"}
+
+_LOG = logging.getLogger(__name__)
+
+# Every statement the WasteWrangler methods run, by name: the Postgres types
+# of its parameters $1, $2, ... and its text.
+_STATEMENTS: dict[str, tuple[tuple[str, ...], str]] = {}
+
+
+def _statement(name: str, types: tuple[str, ...], sql: str) -> str:
+    """Register <sql>, whose parameters have the Postgres types <types>, as
+    the statement <name> and return <name>.
+    """
+    _STATEMENTS[name] = (types, sql)
+    return name
+
+
+def _try_lock(kind: str, resource: str, day: str) -> str:
+    """Return an expression that is whether this transaction holds the
+    advisory lock on the resource <resource> of kind <kind> for day <day>,
+    after taking it unless another transaction holds it. The arguments are
+    SQL expressions.
+
+    The lock is released when the transaction ends. <day> may be NULL, for a
+    lock on <resource> for any day.
+    """
+    return ("pg_try_advisory_xact_lock(" + kind + " * 100000"
+            + " + coalesce(" + day + " - date '2000-01-01', 0), "
+            + resource + ")")
+
+
+def _busy_trips(window_start: str, window_end: str) -> str:
+    """Return a query for the trips whose [ttime, end] overlaps the window
+    between the parameters <window_start> and <window_end>.
+
+    The lower bound on ttime keeps the scan on a range of trips.
+    """
+    return """
+        SELECT t.tid, t.eid1, t.eid2
+        FROM waste_wrangler.trip t
+             JOIN waste_wrangler.route r ON r.rid = t.rid
+        WHERE t.ttime < """ + window_end + """
+          AND t.ttime > """ + window_start + """ - (
+              SELECT coalesce(max(r.length), 0) * interval '12 minutes'
+              FROM waste_wrangler.route r)
+          AND t.ttime + """ + _TRIP_DURATION + """ > """ + window_start + """
+    """
+
+
+# ---------------------------------- locks ----------------------------------- #
+
+# Lock each (kind, resource, day) of the arrays $1 to $3 that no other
+# transaction holds, and return the ones another transaction holds.
+_CLAIM = _statement("claim", ("int[]", "int[]", "date[]"), """
+    SELECT k.kind, k.resource, k.day
+    FROM unnest($1, $2, $3) k(kind, resource, day)
+    WHERE NOT """ + _try_lock("k.kind", "k.resource", "k.day") + """
+""")
+
+# ------------------------------ reference data ------------------------------ #
+
+# What scheduling a trip on a route needs: the rID, the duration and the
+# lowest-fID facility of each route, and the tIDs and truck types of the trucks
+# that can carry its waste type, in order of largest capacity and then lowest
+# tID.
+_ROUTE_CANDIDATES = """
+    SELECT r.rid, """ + _TRIP_DURATION + """,
+           (SELECT min(f.fid) FROM waste_wrangler.facility f
+            WHERE f.wastetype = r.wastetype),
+           ARRAY(SELECT tk.tid FROM waste_wrangler.truck tk
+                 JOIN waste_wrangler.trucktype tt
+                   ON tt.trucktype = tk.trucktype
+                 WHERE tt.wastetype = r.wastetype
+                 ORDER BY tk.capacity DESC, tk.tid),
+           ARRAY(SELECT tk.trucktype FROM waste_wrangler.truck tk
+                 JOIN waste_wrangler.trucktype tt
+                   ON tt.trucktype = tk.trucktype
+                 WHERE tt.wastetype = r.wastetype
+                 ORDER BY tk.capacity DESC, tk.tid)
+    FROM waste_wrangler.route r
+"""
+
+_REF_ROUTE_CANDIDATES = _statement(
+    "ref_route_candidates", ("int",), _ROUTE_CANDIDATES + """
+    WHERE r.rid = $1
+""")
+
+_ALL_ROUTE_CANDIDATES = _statement(
+    "all_route_candidates", (), _ROUTE_CANDIDATES)
+
+_REF_TRUCK = _statement("ref_truck", ("int",), """
+    SELECT trucktype FROM waste_wrangler.truck WHERE tid = $1
+""")
+
+_REF_TRUCKTYPE = _statement("ref_trucktype", ("text",), """
+    SELECT wastetype FROM waste_wrangler.trucktype WHERE trucktype = $1
+""")
+
+# The routes whose waste type truck type $1 can carry, in ascending order of
+# rID, with their durations and lowest-fID facilities.
+_REF_TRUCKTYPE_ROUTES = _statement("ref_trucktype_routes", ("text",), """
+    SELECT r.rid, """ + _TRIP_DURATION + """,
+           (SELECT min(f.fid) FROM waste_wrangler.facility f
+            WHERE f.wastetype = r.wastetype)
+    FROM waste_wrangler.route r
+    WHERE r.wastetype IN (SELECT tt.wastetype FROM waste_wrangler.trucktype tt
+                          WHERE tt.trucktype = $1)
+    ORDER BY r.rid
+""")
+
+# The kinds of entries ReferenceCache holds: the statement that loads the rows
+# of an entry from its key, and the tables they are read from.
+_REFERENCE_LOOKUPS = {
+    "route_candidates": (_REF_ROUTE_CANDIDATES,
+                         {"route", "facility", "truck", "trucktype"}),
+    "truck": (_REF_TRUCK, {"truck"}),
+    "trucktype": (_REF_TRUCKTYPE, {"trucktype"}),
+    "trucktype_routes": (_REF_TRUCKTYPE_ROUTES,
+                         {"trucktype", "route", "facility"}),
+}
+
+# Notify the channel ww_reference with the name of any reference table that
+# changes, once per statement.
+_REFERENCE_NOTIFY = """
+    CREATE OR REPLACE FUNCTION waste_wrangler.ww_reference_changed()
+    RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('ww_reference', TG_TABLE_NAME);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+""" + "".join("""
+    DROP TRIGGER IF EXISTS ww_reference_changed
+        ON waste_wrangler.""" + table + """;
+    CREATE TRIGGER ww_reference_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+        ON waste_wrangler.""" + table + """
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION waste_wrangler.ww_reference_changed();
+""" for table in ["trucktype", "truck", "route", "facility"])
+
+# ------------------------------ schedule_trip ------------------------------- #
+
+# Lock and return the first truck of $5 (whose truck types are $6) that has no
+# maintenance that day and no trip between $3 and $4, the driver of its truck
+# type with the earliest hireDate (then lowest eID) and the best remaining
+# employee who are not on a trip between $3 and $4 either, for a trip on route
+# $1 at $2, unless the route already has a trip that day. Resources locked by
+# another transaction are passed over. Each lock is only tried once the rows
+# before it have been ordered, so only the resources returned are locked.
+_TRIP_CLAIM = _statement(
+    "trip_claim",
+    ("int", "timestamp", "timestamp", "timestamp", "int[]", "text[]"),
+    """
+    WITH busy AS (""" + _busy_trips("$3", "$4") + """),
+    truck AS (
+        SELECT c.tid, c.trucktype
+        FROM (SELECT c.tid, c.trucktype
+              FROM unnest($5, $6) WITH ORDINALITY c(tid, trucktype, n)
+              WHERE c.tid NOT IN (SELECT tid FROM busy)
+                AND NOT EXISTS (SELECT 1 FROM waste_wrangler.maintenance m
+                                WHERE m.tid = c.tid AND m.mdate = $2::date)
+              ORDER BY c.n OFFSET 0) c
+        WHERE """ + _try_lock(str(_LOCK_TRUCK), "c.tid", "$2::date") + """
+        LIMIT 1
+    ),
+    crew AS (
+        SELECT e.eid, e.hiredate,
+               EXISTS (SELECT 1 FROM waste_wrangler.driver d, truck
+                       WHERE d.eid = e.eid
+                         AND d.trucktype = truck.trucktype) AS drives
+        FROM waste_wrangler.employee e
+        WHERE e.eid NOT IN (SELECT eid1 FROM busy UNION ALL
+                            SELECT eid2 FROM busy)
+    ),
+    driver AS (
+        SELECT c.eid
+        FROM (SELECT eid FROM crew WHERE drives
+              ORDER BY hiredate, eid OFFSET 0) c
+        WHERE """ + _try_lock(str(_LOCK_EMPLOYEE), "c.eid", "$2::date") + """
+        LIMIT 1
+    ),
+    partner AS (
+        SELECT c.eid
+        FROM (SELECT c.eid FROM crew c, driver
+              WHERE c.eid <> driver.eid
+              ORDER BY c.hiredate, c.eid OFFSET 0) c
+        WHERE """ + _try_lock(str(_LOCK_EMPLOYEE), "c.eid", "$2::date") + """
+        LIMIT 1
+    )
+    SELECT truck.tid, driver.eid, partner.eid
+    FROM truck, driver, partner
+    WHERE """ + _try_lock(str(_LOCK_ROUTE), "$1", "$2::date") + """
+      AND NOT EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                      WHERE t.rid = $1
+                        AND t.ttime >= $2::date AND t.ttime < $2::date + 1)
+""")
+
+# ---------------------------- schedule_trip_many ---------------------------- #
+
+# The candidates of each route in $1.
+_ROUTE_TRUCKS = _statement("route_trucks", ("int[]",), _ROUTE_CANDIDATES + """
+    WHERE r.rid = ANY($1)
+""")
+
+# Every trip under way at some point of each day in $1, with that day and the
+# end of the trip.
+_DAY_TRIPS = _statement("day_trips", ("date[]",), """
+    SELECT d.day, t.rid, t.tid, t.ttime, t.ttime + """ + _TRIP_DURATION + """,
+           t.eid1, t.eid2
+    FROM unnest($1) d(day)
+         JOIN waste_wrangler.trip t
+           ON t.ttime < d.day + 1
+          AND t.ttime > d.day - (
+              SELECT coalesce(max(r.length), 0) * interval '12 minutes'
+              FROM waste_wrangler.route r)
+         JOIN waste_wrangler.route r ON r.rid = t.rid
+    WHERE t.ttime + """ + _TRIP_DURATION + """ >= d.day
+""")
+
+_DAY_MAINTENANCE = _statement("day_maintenance", ("date[]",), """
+    SELECT tid, mdate FROM waste_wrangler.maintenance WHERE mdate = ANY($1)
+""")
+
+# Every employee in order of preference, with the truck types each can drive.
+_EMPLOYEES_DRIVING = _statement("employees_driving", (), """
+    SELECT e.eid,
+           ARRAY(SELECT d.trucktype FROM waste_wrangler.driver d
+                 WHERE d.eid = e.eid)
+    FROM waste_wrangler.employee e
+    ORDER BY e.hiredate, e.eid
+""")
+
+# ------------------------------ schedule_trips ------------------------------ #
+
+# Whether truck $1 has a trip or maintenance on $2, which of the routes in $3
+# have a trip on $2, the employees with no trip on $2 in order of preference,
+# and those of them who can drive truck type $4.
+_TRUCK_DAY_STATE = _statement(
+    "truck_day_state", ("int", "date", "int[]", "text"), """
+    WITH free AS (
+        SELECT e.eid, e.hiredate
+        FROM waste_wrangler.employee e
+        WHERE NOT EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                          WHERE (t.eid1 = e.eid OR t.eid2 = e.eid)
+                            AND t.ttime >= $2 AND t.ttime < $2 + 1)
+    )
+    SELECT EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                   WHERE t.tid = $1
+                     AND t.ttime >= $2 AND t.ttime < $2 + 1)
+           OR EXISTS (SELECT 1 FROM waste_wrangler.maintenance m
+                      WHERE m.tid = $1 AND m.mdate = $2),
+           ARRAY(SELECT DISTINCT t.rid FROM waste_wrangler.trip t
+                 WHERE t.rid = ANY($3)
+                   AND t.ttime >= $2 AND t.ttime < $2 + 1),
+           ARRAY(SELECT eid FROM free ORDER BY hiredate, eid),
+           ARRAY(SELECT f.eid FROM free f
+                 JOIN waste_wrangler.driver d ON d.eid = f.eid
+                 WHERE d.trucktype = $4)
+""")
+
+# Insert one trip per element of the arrays $1 to $6, unless any of them is on
+# a route that already has a trip that day, or its truck has maintenance that
+# day, or its truck or one of its employees is on another trip that day if $8
+# is true, or else within $7 of it. eID1 always holds the larger of the two
+# eIDs on a trip. The trips under way on the days of the new ones are read
+# once, and matched to them by route, truck and employee.
+_INSERT_TRIPS = _statement(
+    "insert_trips",
+    ("int[]", "int[]", "timestamp[]", "int[]", "int[]", "int[]", "interval",
+     "boolean"), """
+    WITH new AS (
+        SELECT n.*, n.ttime::date AS day,
+               n.ttime - $7 AS window_start,
+               n.ttime + """ + _TRIP_DURATION + """ + $7 AS window_end
+        FROM unnest($1, $2, $3, $4, $5, $6)
+             n(rid, tid, ttime, eid1, eid2, fid)
+             LEFT JOIN waste_wrangler.route r ON r.rid = n.rid
+    ),
+    near AS MATERIALIZED (
+        SELECT t.rid, t.tid, t.ttime, t.ttime + """ + _TRIP_DURATION + """
+                   AS tend, t.eid1, t.eid2
+        FROM waste_wrangler.trip t
+             JOIN waste_wrangler.route r ON r.rid = t.rid
+        WHERE t.ttime < (SELECT max(day) FROM new) + 1
+          AND t.ttime > (SELECT min(day) FROM new) - (
+              SELECT coalesce(max(r.length), 0) * interval '12 minutes'
+              FROM waste_wrangler.route r)
+    ),
+    conflicts AS (
+        SELECT n.day, n.window_start, n.window_end, t.ttime, t.tend
+        FROM new n JOIN near t ON t.tid = n.tid
+        UNION ALL
+        SELECT n.day, n.window_start, n.window_end, t.ttime, t.tend
+        FROM (SELECT n.*, e.eid FROM new n,
+                     LATERAL (VALUES (n.eid1), (n.eid2)) e(eid)) n
+             JOIN (SELECT t.*, e.eid FROM near t,
+                          LATERAL (VALUES (t.eid1), (t.eid2)) e(eid)) t
+               ON t.eid = n.eid
+    )
+    INSERT INTO waste_wrangler.trip(rid, tid, ttime, eid1, eid2, fid)
+    SELECT rid, tid, ttime, eid1, eid2, fid FROM new
+    WHERE NOT EXISTS (SELECT 1 FROM new n
+                      JOIN near t ON t.rid = n.rid
+                      WHERE t.ttime >= n.day AND t.ttime < n.day + 1)
+      AND NOT EXISTS (
+        SELECT 1 FROM conflicts c
+        WHERE CASE WHEN $8 THEN c.ttime >= c.day AND c.ttime < c.day + 1
+                   ELSE c.ttime < c.window_end AND c.tend > c.window_start
+              END
+    )
+      AND NOT EXISTS (SELECT 1 FROM new n
+                      JOIN waste_wrangler.maintenance m
+                        ON m.tid = n.tid AND m.mdate = n.day)
+""")
+
+# ------------------------------ schedule_fleet ------------------------------ #
+
+# Every truck in ascending order of tID, with the waste types it can carry and
+# whether it has a trip or maintenance on $1.
+_FLEET_TRUCKS = _statement("fleet_trucks", ("date",), """
+    SELECT tk.tid, tk.trucktype,
+           ARRAY(SELECT tt.wastetype FROM waste_wrangler.trucktype tt
+                 WHERE tt.trucktype = tk.trucktype),
+           EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                   WHERE t.tid = tk.tid
+                     AND t.ttime >= $1 AND t.ttime < $1 + 1)
+           OR EXISTS (SELECT 1 FROM waste_wrangler.maintenance m
+                      WHERE m.tid = tk.tid AND m.mdate = $1)
+    FROM waste_wrangler.truck tk
+    ORDER BY tk.tid
+""")
+
+# The routes with no trip on $1 in ascending order of rID, with their waste
+# types, durations and lowest-fID facilities.
+_FLEET_ROUTES = _statement("fleet_routes", ("date",), """
+    SELECT r.rid, r.wastetype, """ + _TRIP_DURATION + """,
+           (SELECT min(f.fid) FROM waste_wrangler.facility f
+            WHERE f.wastetype = r.wastetype)
+    FROM waste_wrangler.route r
+    WHERE NOT EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                      WHERE t.rid = r.rid
+                        AND t.ttime >= $1 AND t.ttime < $1 + 1)
+    ORDER BY r.rid
+""")
+
+# The employees with no trip on $1 in order of preference, with the truck
+# types each can drive.
+_FLEET_EMPLOYEES = _statement("fleet_employees", ("date",), """
+    SELECT e.eid,
+           ARRAY(SELECT d.trucktype FROM waste_wrangler.driver d
+                 WHERE d.eid = e.eid)
+    FROM waste_wrangler.employee e
+    WHERE NOT EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                      WHERE (t.eid1 = e.eid OR t.eid2 = e.eid)
+                        AND t.ttime >= $1 AND t.ttime < $1 + 1)
+    ORDER BY e.hiredate, e.eid
+""")
+
+# ---------------------------- update_technicians ---------------------------- #
+
+_EMPLOYEE_BY_NAME = _statement("employee_by_name", ("text",), """
+    SELECT eid FROM waste_wrangler.employee WHERE name = $1
+""")
+
+_IS_DRIVER = _statement("is_driver", ("int",), """
+    SELECT 1 FROM waste_wrangler.driver WHERE eid = $1
+""")
+
+_IS_TECHNICIAN = _statement("is_technician", ("int", "text"), """
+    SELECT 1 FROM waste_wrangler.technician WHERE eid = $1 AND trucktype = $2
+""")
+
+_INSERT_TECHNICIAN = _statement("insert_technician", ("int", "text"), """
+    INSERT INTO waste_wrangler.technician(eid, trucktype) VALUES ($1, $2)
+""")
+
+# The staging table for update_technicians in bulk mode. It lives as long as
+# the session, so the statements that use it stay prepared.
+_CREATE_QUALIFICATION_STAGING = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS qualification_staging (
+        name text NOT NULL,
+        trucktype text NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+_COPY_QUALIFICATIONS = """
+    COPY pg_temp.qualification_staging (name, trucktype) FROM STDIN
+"""
+
+# Every distinct valid (eID, truck type) entry in the staging table. Entries
+# repeated in the file count once, as the repeats are already recorded by the
+# time they are reached. The staging table is emptied as it is read, as the
+# transaction may go on within a unit of work.
+_INSERT_STAGED_TECHNICIANS = _statement("insert_staged_technicians", (), """
+    WITH q AS (
+        DELETE FROM pg_temp.qualification_staging RETURNING name, trucktype
+    )
+    INSERT INTO waste_wrangler.technician(eid, trucktype)
+    SELECT DISTINCT e.eid, q.trucktype
+    FROM q
+         JOIN waste_wrangler.employee e ON e.name = q.name
+    WHERE EXISTS (SELECT 1 FROM waste_wrangler.trucktype tt
+                  WHERE tt.trucktype = q.trucktype)
+      AND NOT EXISTS (SELECT 1 FROM waste_wrangler.driver d
+                      WHERE d.eid = e.eid)
+      AND NOT EXISTS (SELECT 1 FROM waste_wrangler.technician t
+                      WHERE t.eid = e.eid AND t.trucktype = q.trucktype)
+""")
+
+# ----------------------------- workmate_sphere ------------------------------ #
+
+# Every employee reachable from $1 through shared trips, in one round trip.
+# The distinct pairs of workmates are read once, in both directions, into an
+# edge set, and each step hash-joins the employees it reached last to that set,
+# so that the query scans trip once whatever indexes it has. UNION drops
+# employees already reached.
+_SPHERE = _statement("sphere", ("int",), """
+    WITH RECURSIVE edge(eid, workmate) AS MATERIALIZED (
+        SELECT eid1, eid2 FROM waste_wrangler.trip
+        UNION
+        SELECT eid2, eid1 FROM waste_wrangler.trip
+    ), sphere(eid) AS (
+        SELECT $1
+        UNION
+        SELECT e.workmate
+        FROM sphere s
+             JOIN edge e ON e.eid = s.eid
+    )
+    SELECT eid FROM sphere WHERE eid <> $1
+""")
+
+_WORKMATE_PAIRS = _statement("workmate_pairs", (), """
+    SELECT DISTINCT eid1, eid2 FROM waste_wrangler.trip
+""")
+
+_ALL_EMPLOYEES = _statement("all_employees", (), """
+    SELECT eid FROM waste_wrangler.employee ORDER BY eid
+""")
+
+# --------------------------- schedule_maintenance --------------------------- #
+
+# Trucks with no maintenance in the 90 days before $1 nor in the 10 days from
+# $1, with their truck types.
+_OVERDUE_TRUCKS = _statement("overdue_trucks", ("date",), """
+    SELECT tk.tid, tk.trucktype
+    FROM waste_wrangler.truck tk
+    WHERE NOT EXISTS (SELECT 1 FROM waste_wrangler.maintenance m
+                      WHERE m.tid = tk.tid
+                        AND m.mdate >= $1 - 90 AND m.mdate <= $1 + 10)
+    ORDER BY tk.tid
+""")
+
+_TECHNICIANS_FOR_TYPES = _statement("technicians_for_types", ("text[]",), """
+    SELECT trucktype, eid FROM waste_wrangler.technician
+    WHERE trucktype = ANY($1)
+    ORDER BY eid
+""")
+
+# The days from $2 to $3 on which each technician in $1 maintains a truck.
+_TECHNICIAN_DAYS = _statement(
+    "technician_days", ("int[]", "date", "date"), """
+    SELECT eid, mdate FROM waste_wrangler.maintenance
+    WHERE eid = ANY($1) AND mdate BETWEEN $2 AND $3
+""")
+
+# The days from $2 to $3 on which each truck in $1 has a trip or maintenance.
+_TRUCK_DAYS = _statement("truck_days", ("int[]", "date", "date"), """
+    SELECT tid, mdate FROM waste_wrangler.maintenance
+    WHERE tid = ANY($1) AND mdate BETWEEN $2 AND $3
+    UNION
+    SELECT tid, ttime::date FROM waste_wrangler.trip
+    WHERE tid = ANY($1) AND ttime >= $2 AND ttime < $3 + 1
+""")
+
+# Insert one maintenance per element of the arrays $1 to $3 for trucks found
+# overdue on $4, unless any of them is no longer overdue, or its truck has a
+# trip or maintenance that day, or its technician maintains another truck that
+# day.
+_INSERT_MAINTENANCE = _statement(
+    "insert_maintenance", ("int[]", "int[]", "date[]", "date"), """
+    WITH new AS (
+        SELECT * FROM unnest($1, $2, $3) n(tid, eid, mdate)
+    )
+    INSERT INTO waste_wrangler.maintenance(tid, eid, mdate)
+    SELECT * FROM new
+    WHERE NOT EXISTS (
+        SELECT 1 FROM new n JOIN waste_wrangler.maintenance m
+          ON (m.tid = n.tid
+              AND (m.mdate = n.mdate
+                   OR (m.mdate >= $4 - 90 AND m.mdate <= $4 + 10)))
+             OR (m.eid = n.eid AND m.mdate = n.mdate)
+    )
+      AND NOT EXISTS (SELECT 1 FROM new n JOIN waste_wrangler.trip t
+                        ON t.tid = n.tid
+                       AND t.ttime >= n.mdate AND t.ttime < n.mdate + 1)
+""")
+
+# ------------------------------ reroute_waste ------------------------------- #
+
+# Move the trips from $2 to $3 inclusive to each shut-down facility in $1 to
+# the facility with the lowest fID that takes the same waste type and is not
+# shut down, and return the shut-down facility of each trip moved.
+_REROUTE = _statement("reroute", ("int[]", "date", "date"), """
+    WITH alternative AS (
+        SELECT closed.fid AS closed,
+               (SELECT min(f.fid) FROM waste_wrangler.facility f
+                WHERE f.wastetype = closed.wastetype
+                  AND NOT f.fid = ANY($1)) AS fid
+        FROM waste_wrangler.facility closed
+        WHERE closed.fid = ANY($1)
+    )
+    UPDATE waste_wrangler.trip t
+    SET fid = alternative.fid
+    FROM alternative
+    WHERE t.fid = alternative.closed
+      AND alternative.fid IS NOT NULL
+      AND t.ttime >= $2 AND t.ttime < $3 + 1
+    RETURNING alternative.closed
+""")
+
+# ---------------------------- provision_indexes ----------------------------- #
+
+# The indexes behind the lookups above, as (name, table, columns): trips by
+# time and by employee or facility over a range of times, maintenance by
+# technician and day, and the reference tables by the columns they are
+# filtered on.
+_INDEXES = [
+    ("ww_trip_ttime", "trip", "ttime"),
+    ("ww_trip_eid1_ttime", "trip", "eid1, ttime"),
+    ("ww_trip_eid2_ttime", "trip", "eid2, ttime"),
+    ("ww_trip_fid_ttime", "trip", "fid, ttime"),
+    ("ww_maintenance_eid_mdate", "maintenance", "eid, mdate"),
+    ("ww_employee_name", "employee", "name"),
+    ("ww_employee_hiredate_eid", "employee", "hiredate, eid"),
+    ("ww_driver_trucktype_eid", "driver", "trucktype, eid"),
+    ("ww_technician_trucktype_eid", "technician", "trucktype, eid"),
+    ("ww_trucktype_wastetype", "trucktype", "wastetype, trucktype"),
+    ("ww_truck_trucktype", "truck", "trucktype, capacity DESC, tid"),
+    ("ww_route_wastetype_rid", "route", "wastetype, rid"),
+    ("ww_facility_wastetype_fid", "facility", "wastetype, fid"),
+]
+
+# The window each trip keeps its truck and each of its employees busy for,
+# from its start until 30 minutes after its end, kept up to date by a trigger
+# on trip. Two windows of the same truck or employee overlap exactly when
+# schedule_trip would consider them double-booked, so the exclusion
+# constraints reject such trips whoever inserts them.
+_TRIP_WINDOWS = """
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+    CREATE TABLE IF NOT EXISTS waste_wrangler.trip_window (
+        rid INT NOT NULL,
+        ttime TIMESTAMP NOT NULL,
+        tid INT NOT NULL,
+        eid INT NOT NULL,
+        first BOOLEAN NOT NULL,
+        busy TSRANGE NOT NULL,
+        EXCLUDE USING gist (eid WITH =, busy WITH &&),
+        EXCLUDE USING gist (tid WITH =, busy WITH &&) WHERE (first)
+    );
+    CREATE INDEX IF NOT EXISTS ww_trip_window_trip
+        ON waste_wrangler.trip_window (rid, ttime);
+
+    CREATE OR REPLACE FUNCTION waste_wrangler.ww_trip_window()
+    RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            DELETE FROM waste_wrangler.trip_window
+            WHERE rid = OLD.rid AND ttime = OLD.ttime;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO waste_wrangler.trip_window
+            SELECT NEW.rid, NEW.ttime, NEW.tid, e.eid, e.first,
+                   tsrange(NEW.ttime, NEW.ttime + """ + _TRIP_DURATION + """
+                                      + interval '30 minutes')
+            FROM waste_wrangler.route r,
+                 (VALUES (NEW.eid1, true), (NEW.eid2, false)) e(eid, first)
+            WHERE r.rid = NEW.rid;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS ww_trip_window ON waste_wrangler.trip;
+    CREATE TRIGGER ww_trip_window
+        AFTER INSERT OR DELETE OR UPDATE OF rid, tid, ttime, eid1, eid2
+        ON waste_wrangler.trip
+        FOR EACH ROW EXECUTE FUNCTION waste_wrangler.ww_trip_window();
+
+    TRUNCATE waste_wrangler.trip_window;
+    INSERT INTO waste_wrangler.trip_window
+    SELECT t.rid, t.ttime, t.tid, e.eid, e.first,
+           tsrange(t.ttime, t.ttime + """ + _TRIP_DURATION + """
+                            + interval '30 minutes')
+    FROM waste_wrangler.trip t
+         JOIN waste_wrangler.route r ON r.rid = t.rid,
+         LATERAL (VALUES (t.eid1, true), (t.eid2, false)) e(eid, first);
+"""
+
+
+class StatementRegistry:
+    """Runs the statements registered with _statement, preparing each one
+    once per connection with PREPARE and then running it with EXECUTE, so
+    Postgres parses and plans each query shape once per session.
+
+    === Instance Attributes ===
+    timings: for each statement name, the number of times it was prepared
+    and executed, and the total seconds spent on each.
+
+    Representation invariants:
+    - Every key of timings is a key of _STATEMENTS.
+    """
+    timings: dict[str, dict[str, float]]
+    _prepared: weakref.WeakKeyDictionary
+    _cursors: Iterator[int]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        """Initialize this registry with no statements prepared yet."""
+        self.timings = {}
+        self._prepared = weakref.WeakKeyDictionary()
+        self._cursors = itertools.count()
+        self._lock = threading.Lock()
+
+    def execute(self, cursor: pg_ext.cursor, name: str,
+                params: tuple = ()) -> None:
+        """Run the statement <name> with <params> on <cursor>, preparing it
+        on the cursor's connection first if this is its first use there.
+        """
+        connection = cursor.connection
+        with self._lock:
+            prepared = self._prepared.setdefault(connection, set())
+        if name not in prepared:
+            types, sql = _STATEMENTS[name]
+            signature = " (" + ", ".join(types) + ")" if types else ""
+            start = perf_counter()
+            cursor.execute("PREPARE ww_" + name + signature + " AS " + sql)
+            self._record(name, "prepare", perf_counter() - start)
+            prepared.add(name)
+
+        sql = "EXECUTE ww_" + name
+        if params:
+            sql += " (" + ", ".join(["%s"] * len(params)) + ")"
+        start = perf_counter()
+        cursor.execute(sql, params)
+        self._record(name, "execute", perf_counter() - start)
+
+    def stream(self, connection: pg_ext.connection, name: str,
+               params: tuple = (), itersize: int = _STREAM_ITERSIZE
+               ) -> Iterator[tuple]:
+        """Yield the rows of the statement <name> with <params>, read from a
+        server-side cursor on <connection> <itersize> rows at a time, so that
+        no more than that are held in memory however many there are.
+
+        A server-side cursor cannot run a prepared statement, so the
+        statement is declared with its parameters inlined, and planned each
+        time. The cursor is closed once the rows are consumed or the
+        generator is closed, and must be within a transaction.
+        """
+        types, sql = _STATEMENTS[name]
+        with self._lock:
+            cursor = connection.cursor("ww_stream_%d" % next(self._cursors))
+        cursor.itersize = itersize
+        try:
+            start = perf_counter()
+            cursor.execute(re.sub(
+                r"\$(\d+)",
+                lambda m: "(%(" + m[1] + ")s::" + types[int(m[1]) - 1] + ")",
+                sql.replace("%", "%%")
+            ), {str(i + 1): param for i, param in enumerate(params)})
+            self._record(name, "execute", perf_counter() - start)
+            yield from cursor
+        finally:
+            if not connection.closed:
+                cursor.close()
+
+    def report(self) -> dict[str, dict[str, float]]:
+        """Return a copy of <timings>."""
+        with self._lock:
+            return {name: dict(timing) for name, timing in self.timings.items()}
+
+    def _record(self, name: str, phase: str, seconds: float) -> None:
+        """Add one <phase> of the statement <name> taking <seconds>."""
+        with self._lock:
+            timing = self.timings.setdefault(name, {
+                "prepares": 0, "prepare_seconds": 0.0,
+                "executes": 0, "execute_seconds": 0.0
+            })
+            timing[phase + "s"] += 1
+            timing[phase + "_seconds"] += seconds
+
+
+class Instrumentation:
+    """Statistics of the calls made to the methods of a WasteWrangler, for
+    finding out where the time of a slow call went.
+
+    === Instance Attributes ===
+    methods: for each method name, the number of calls and the statements,
+    round trips, rows returned or changed, and commits they made, and the
+    total seconds they took.
+    histograms: for each method name, the number of calls whose latency fell
+    in each of the buckets bounded by _LATENCY_BUCKETS, followed by the number
+    of slower calls.
+
+    Representation invariants:
+    - methods and histograms have the same keys.
+    - Every list in histograms has len(_LATENCY_BUCKETS) + 1 elements.
+    """
+    methods: dict[str, dict[str, float]]
+    histograms: dict[str, list[int]]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        """Initialize this Instrumentation with no calls recorded."""
+        self.methods = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, counters: dict[str, int],
+               seconds: float) -> None:
+        """Add one call of <method> that made <counters> and took <seconds>.
+        """
+        with self._lock:
+            totals = self.methods.setdefault(
+                method, dict.fromkeys(_CALL_COUNTERS + ("seconds",), 0))
+            totals["calls"] += 1
+            for counter, value in counters.items():
+                totals[counter] += value
+            totals["seconds"] += seconds
+            buckets = self.histograms.setdefault(
+                method, [0] * (len(_LATENCY_BUCKETS) + 1))
+            bucket = 0
+            while (bucket < len(_LATENCY_BUCKETS)
+                   and seconds > _LATENCY_BUCKETS[bucket]):
+                bucket += 1
+            buckets[bucket] += 1
+
+    def report(self) -> dict[str, dict[str, float]]:
+        """Return a copy of <methods>."""
+        with self._lock:
+            return {name: dict(totals) for name, totals in self.methods.items()}
+
+    def openmetrics(self) -> str:
+        """Return the statistics in the OpenMetrics text format."""
+        with self._lock:
+            methods = {name: (dict(totals), list(self.histograms[name]))
+                       for name, totals in sorted(self.methods.items())}
+        lines = []
+        for counter in _CALL_COUNTERS:
+            family = "wastewrangler_" + counter
+            lines.append("# TYPE " + family + " counter")
+            for name, (totals, _) in methods.items():
+                lines.append(family + '_total{method="' + name + '"} '
+                             + str(totals[counter]))
+        family = "wastewrangler_call_duration_seconds"
+        lines.append("# TYPE " + family + " histogram")
+        lines.append("# UNIT " + family + " seconds")
+        for name, (totals, buckets) in methods.items():
+            cumulative = 0
+            for bound, count in zip(_LATENCY_BUCKETS + ("+Inf",), buckets):
+                cumulative += count
+                lines.append(family + '_bucket{method="' + name + '",le="'
+                             + str(bound) + '"} ' + str(cumulative))
+            lines.append(family + '_count{method="' + name + '"} '
+                         + str(totals["calls"]))
+            lines.append(family + '_sum{method="' + name + '"} '
+                         + repr(totals["seconds"]))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_openmetrics(self, path: str) -> None:
+        """Write the statistics in the OpenMetrics text format to the file at
+        <path>, replacing it in one step so a scraper never reads half of it.
+        """
+        with open(path + ".tmp", "w") as file:
+            file.write(self.openmetrics())
+        os.replace(path + ".tmp", path)
+
+
+class SlowQueryExplainer:
+    """Re-runs the statements of WasteWrangler methods that take longer than
+    a threshold under EXPLAIN (ANALYZE, BUFFERS), inside a savepoint that is
+    then rolled back, and logs their plans with the calling method and its
+    arguments.
+
+    Explaining is rate-limited by a token bucket, so that it can be left on:
+    at most <per_minute> statements are explained a minute on average, with
+    bursts of up to <per_minute>.
+
+    === Instance Attributes ===
+    threshold: the number of seconds a statement must take to be explained.
+    per_minute: the average number of statements explained a minute, at most.
+    explained: the number of statements explained so far.
+    skipped: the number of slow statements not explained because of the rate
+    limit.
+    """
+    threshold: float
+    per_minute: float
+    explained: int
+    skipped: int
+    _tokens: float
+    _refilled: float
+    _lock: threading.Lock
+
+    def __init__(self, threshold: float, per_minute: float) -> None:
+        """Initialize an explainer of statements slower than <threshold>
+        seconds, that explains at most <per_minute> of them a minute.
+        """
+        self.threshold = threshold
+        self.per_minute = per_minute
+        self.explained = 0
+        self.skipped = 0
+        self._tokens = per_minute
+        self._refilled = monotonic()
+        self._lock = threading.Lock()
+
+    def explain(self, connection: pg_ext.connection, query: str,
+                seconds: float, method: str, args: tuple, kwargs: dict
+                ) -> None:
+        """Log the plan of <query>, which just took <seconds> on <connection>
+        in a call of <method> with <args> and <kwargs>, unless the rate limit
+        has been reached or <query> cannot be explained.
+
+        The work <query> does the second time is rolled back, and errors are
+        logged instead of raised, so the call is not affected.
+        """
+        if query.split(None, 1)[0].upper() not in _EXPLAINABLE:
+            return
+        if not self._take_token():
+            return
+        arguments = ", ".join([repr(arg) for arg in args] + [
+            name + "=" + repr(value) for name, value in kwargs.items()])
+        cursor = connection.cursor(cursor_factory=pg_ext.cursor)
+        try:
+            cursor.execute("SAVEPOINT ww_explain")
+            try:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query)
+                plan = "\n".join(row[0] for row in cursor)
+            finally:
+                cursor.execute("ROLLBACK TO SAVEPOINT ww_explain")
+                cursor.execute("RELEASE SAVEPOINT ww_explain")
+        except pg.Error as ex:
+            _LOG.warning("could not explain slow statement in %s(%s): %s",
+                         method, arguments, ex)
+            return
+        _LOG.warning("slow statement in %s(%s) took %.3f s:\n%s\n%s",
+                     method, arguments, seconds, query, plan)
+
+    def _take_token(self) -> bool:
+        """Return True and use up a token if one is available, otherwise
+        record a skipped statement and return False.
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.per_minute, self._tokens
+                               + (now - self._refilled) * self.per_minute / 60)
+            self._refilled = now
+            if self._tokens < 1:
+                self.skipped += 1
+                return False
+            self._tokens -= 1
+            self.explained += 1
+            return True
+
+
+class _InstrumentedCursor(pg_ext.cursor):
+    """A cursor that counts its statements, their round trips and the rows
+    they touch in the instrumented method call running on its thread, and
+    hands the ones that are slow to its SlowQueryExplainer.
+    """
+
+    def execute(self, query: object, vars: object = None) -> None:
+        """Execute <query> with <vars>, counting it."""
+        counters = _begin_statement(self.connection)
+        start = perf_counter()
+        super().execute(query, vars)
+        seconds = perf_counter() - start
+        if counters is not None:
+            counters["rows"] += max(self.rowcount, 0)
+            explainer = _ACTIVE_CALL.explainer
+            if explainer is not None and seconds > explainer.threshold:
+                encoding = pg_ext.encodings[self.connection.encoding]
+                explainer.explain(self.connection, self.query.decode(encoding),
+                                  seconds, *_ACTIVE_CALL.call)
+
+    def copy_expert(self, sql: object, file: object,
+                    size: int = 8192) -> None:
+        """Run the COPY statement <sql> with <file>, counting it."""
+        counters = _begin_statement(self.connection)
+        super().copy_expert(sql, file, size)
+        if counters is not None:
+            counters["rows"] += max(self.rowcount, 0)
+
+
+def _begin_statement(connection: pg_ext.connection
+                     ) -> Optional[dict[str, int]]:
+    """Count a statement about to be sent on <connection>, and the BEGIN
+    psycopg2 sends ahead of it if no transaction is open, in the instrumented
+    method call running on this thread. Return the call's counters, or None if
+    there is no such call.
+    """
+    counters = getattr(_ACTIVE_CALL, "counters", None)
+    if counters is not None:
+        counters["statements"] += 1
+        counters["round_trips"] += 1
+        if (not connection.autocommit
+                and connection.status == pg_ext.STATUS_READY):
+            counters["round_trips"] += 1
+    return counters
+
+
+def _commit(connection: pg_ext.connection) -> None:
+    """Commit <connection>, counting the commit in the instrumented method
+    call running on this thread, if any.
+    """
+    counters = getattr(_ACTIVE_CALL, "counters", None)
+    if counters is not None:
+        counters["commits"] += 1
+        if connection.status != pg_ext.STATUS_READY:
+            counters["round_trips"] += 1
+    connection.commit()
+
+
+def _instrumented(method):
+    """Decorate the WasteWrangler method <method> so that, while the
+    WasteWrangler's <instrumentation> is enabled, its calls are recorded
+    there, and while its <slow_queries> is enabled, its slow statements are
+    explained.
+
+    Calls made by another instrumented method are counted as part of it.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation, explainer = self.instrumentation, self.slow_queries
+        if ((instrumentation is None and explainer is None)
+                or getattr(_ACTIVE_CALL, "counters", None) is not None):
+            return method(self, *args, **kwargs)
+        counters = dict.fromkeys(_CALL_COUNTERS[1:], 0)
+        _ACTIVE_CALL.counters = counters
+        _ACTIVE_CALL.call = (method.__name__, args, kwargs)
+        _ACTIVE_CALL.explainer = explainer
+        start = perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _ACTIVE_CALL.counters = None
+            _ACTIVE_CALL.call = None
+            _ACTIVE_CALL.explainer = None
+            if instrumentation is not None:
+                instrumentation.record(method.__name__, counters,
+                                       perf_counter() - start)
+    return wrapper
+
+
+def _pick_crew(employees: list[int], drivers: set[int]
+               ) -> Optional[tuple[int, int]]:
+    """Return the (driver, partner) to put on a trip, given the available
+    <employees> in order of preference and the <drivers> among them who can
+    drive the truck, or None if there is no such pair.
+
+    The driver is the most preferred employee who can drive, and the partner
+    is the most preferred of the others.
+    """
+    driver = next((eid for eid in employees if eid in drivers), None)
+    if driver is None:
+        return None
+    partner = next((eid for eid in employees if eid != driver), None)
+    if partner is None:
+        return None
+    return driver, partner
+
+
+def _plan_day(day: dt.date,
+              routes: list[tuple[int, dt.timedelta, Optional[int]]]
+              ) -> list[tuple[int, dt.datetime, int]]:
+    """Return the trips a truck makes on <day> as (rID, start, fID), given the
+    (rID, duration, fID) of the <routes> to cover in order.
+
+    Trips start at 8 a.m. and leave a gap of 30 minutes after each trip.
+    Routes with no facility are skipped, and planning stops at the first
+    route that would end after 4 p.m.
+    """
+    plan = []
+    start = dt.datetime.combine(day, _SHIFT_START)
+    shift_end = dt.datetime.combine(day, _SHIFT_END)
+    for rid, duration, fid in routes:
+        if fid is None:
+            continue
+        end = start + duration
+        if end > shift_end:
+            break
+        plan.append((rid, start, fid))
+        start = end + _TRIP_GAP
+    return plan
+
+
+def _place_trip(rid: int, time: dt.datetime,
+                route: Optional[tuple[dt.timedelta, Optional[int],
+                                      list[tuple[int, str]]]],
+                day: "DayAvailability | _DayTrips"
+                ) -> Optional[tuple[int, int, dt.datetime, int, int, int]]:
+    """Return the trip schedule_trip would make on route <rid> at <time> as
+    (rID, tID, tTime, eID, eID, fID), or None if it would fail, and book it
+    in <day>.
+
+    <route> is the route's (duration, fID, trucks in order of preference), or
+    None if there is no such route. <day> holds the trips, maintenance and
+    locks of the day of <time>, as a DayAvailability or a _DayTrips.
+    """
+    if route is None:
+        return None
+    duration, fid, trucks = route
+    end = time + duration
+    if (fid is None or not trucks
+            or time < dt.datetime.combine(day.day, _SHIFT_START)
+            or end > dt.datetime.combine(day.day, _SHIFT_END)):
+        return None
+    if rid in day.taken:
+        return None
+    truck = day.free_truck(trucks, time, end)
+    if truck is None:
+        return None
+    crew = day.free_crew(truck[1], time, end)
+    if crew is None:
+        return None
+    driver, partner = crew
+    day.book(rid, truck[0], time, end, max(driver, partner),
+             min(driver, partner))
+    return rid, truck[0], time, driver, partner, fid
+
+
+def _trip_resources(trip: tuple[int, int, dt.datetime, int, int, int]
+                    ) -> list[tuple[int, int, dt.date]]:
+    """Return the resources booked by the (rID, tID, tTime, eID, eID, fID)
+    <trip>, as (kind, id, day) to lock.
+    """
+    day = trip[2].date()
+    return [(_LOCK_ROUTE, trip[0], day), (_LOCK_TRUCK, trip[1], day),
+            (_LOCK_EMPLOYEE, trip[3], day), (_LOCK_EMPLOYEE, trip[4], day)]
+
+
+def _plan_trucks(day: dt.date, trucks: list[tuple[int, frozenset[str]]],
+                 routes: list[tuple[int, str, dt.timedelta, Optional[int]]]
+                 ) -> dict[int, list[tuple[int, dt.datetime, int]]]:
+    """Return the trips each truck in <trucks> makes on <day>, as _plan_day
+    would plan them, given the (tID, waste types) of the <trucks> in the order
+    they are scheduled and the (rID, waste type, duration, fID) of the open
+    <routes> in ascending order of rID.
+
+    Each truck takes the routes that earlier trucks did not, assuming that
+    every truck with a trip to make gets a crew.
+    """
+    taken = set()
+    plans = {}
+    for tid, wastetypes in trucks:
+        plan = _plan_day(day, [
+            (rid, duration, fid) for rid, wastetype, duration, fid in routes
+            if wastetype in wastetypes and rid not in taken
+        ])
+        taken.update(rid for rid, _, _ in plan)
+        plans[tid] = plan
+    return plans
+
+
+def _plan_fleet(date: dt.date,
+                trucks: list[tuple[int, str, list[str], bool]],
+                routes: list[tuple[int, str, dt.timedelta, Optional[int]]],
+                employees: list[tuple[int, list[str]]],
+                workers: Optional[int]
+                ) -> tuple[dict[int, int],
+                           list[tuple[int, int, dt.datetime, int, int, int]]]:
+    """Return the number of trips schedule_fleet makes for each truck on
+    <date>, and those trips as (rID, tID, tTime, eID, eID, fID).
+
+    <trucks> holds every (tID, truck type, waste types carried, busy), in
+    ascending order of tID, <routes> every (rID, waste type, duration, fID)
+    with no trip on <date>, in ascending order of rID, and <employees> every
+    (eID, truck types driven) with no trip on <date>, in order of
+    preference. Chunks of trucks are planned on a pool of <workers> processes
+    if <workers> is more than 1.
+    """
+    counts = {tid: 0 for tid, _, _, _ in trucks}
+    trucktypes = {tid: trucktype for tid, trucktype, _, _ in trucks}
+    chunks = _chunk_trucks([
+        (tid, frozenset(wastetypes))
+        for tid, _, wastetypes, busy in trucks if not busy
+    ])
+    chunk_routes = [
+        [route for route in routes
+         if any(route[1] in types for _, types in chunk)]
+        for chunk in chunks
+    ]
+    if workers is not None and workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            chunk_plans = list(executor.map(
+                _plan_trucks, [date] * len(chunks), chunks, chunk_routes
+            ))
+    else:
+        chunk_plans = list(map(_plan_trucks, [date] * len(chunks), chunks,
+                               chunk_routes))
+
+    #     Assign crews in order of tID. A truck with trips to make but no
+    #     crew leaves its routes to the trucks after it, so the rest of its
+    #     chunk is planned again without it.
+    owner = {tid: i for i, chunk in enumerate(chunks) for tid, _ in chunk}
+    drivers = {}
+    for eid, trucktypes_driven in employees:
+        for trucktype in trucktypes_driven:
+            drivers.setdefault(trucktype, set()).add(eid)
+    free = [eid for eid, _ in employees]
+    trips = []
+    for tid in sorted(owner):
+        i = owner[tid]
+        plan = chunk_plans[i][tid]
+        if not plan:
+            continue
+        crew = _pick_crew(free, drivers.get(trucktypes[tid], set()))
+        if crew is None:
+            taken = {rid for other, _ in chunks[i] if other < tid
+                     for rid, _, _ in chunk_plans[i][other]}
+            chunk_plans[i].update(_plan_trucks(
+                date,
+                [truck for truck in chunks[i] if truck[0] > tid],
+                [route for route in chunk_routes[i] if route[0] not in taken]
+            ))
+            chunk_plans[i][tid] = []
+            continue
+        free = [eid for eid in free if eid not in crew]
+        trips.extend((rid, tid, start, crew[0], crew[1], fid)
+                     for rid, start, fid in plan)
+        counts[tid] = len(plan)
+    return counts, trips
+
+
+def _chunk_trucks(trucks: list[tuple[int, frozenset[str]]]
+                  ) -> list[list[tuple[int, frozenset[str]]]]:
+    """Split the (tID, waste types) in <trucks> into chunks such that no two
+    trucks in different chunks can carry the same waste type, keeping the
+    order of <trucks> within each chunk.
+    """
+    chunks = []
+    for truck in trucks:
+        wastetypes, members = set(truck[1]), [truck]
+        rest = []
+        for chunk_types, chunk_members in chunks:
+            if chunk_types & wastetypes:
+                wastetypes |= chunk_types
+                members = chunk_members + members
+            else:
+                rest.append((chunk_types, chunk_members))
+        chunks = rest + [(wastetypes, members)]
+    return [sorted(members) for _, members in chunks]
+
+
+def _solve_maintenance(trucks: list[tuple[int, list[int]]],
+                       booked: set[tuple[int, dt.date]],
+                       busy: set[tuple[int, dt.date]],
+                       first: dt.date, last: dt.date,
+                       scheduled: list[tuple[int, int, dt.date]]
+                       ) -> list[tuple[int, list[int]]]:
+    """Schedule maintenance between <first> and <last> inclusive for each
+    (tID, qualified eIDs) in <trucks>, in order, and return the trucks that
+    could not be scheduled in that time.
+
+    Each truck gets the first day on which it is not in <busy> and one of its
+    technicians is not in <booked>, with the lowest such eID. Every
+    maintenance scheduled is appended to <scheduled> as (tID, eID, day) and
+    added to <booked> and <busy>.
+
+    Pre-condition:
+        The eIDs of each truck are in ascending order.
+    """
+    unscheduled = []
+    for tid, eids in trucks:
+        day = first
+        while day <= last:
+            if (tid, day) not in busy:
+                eid = next((e for e in eids if (e, day) not in booked), None)
+                if eid is not None:
+                    scheduled.append((tid, eid, day))
+                    booked.add((eid, day))
+                    busy.add((tid, day))
+                    break
+            day += dt.timedelta(days=1)
+        else:
+            unscheduled.append((tid, eids))
+    return unscheduled
+
+
+class _DayTrips:
+    """Where the trucks and employees are on one day, for placing trips as
+    schedule_trip would: the pure Python counterpart of DayAvailability, used
+    when NumPy is not installed, which scans the day's trips on every query.
+
+    The bookings made after a checkpoint can be undone with rollback, so
+    that the same requests can be placed again on the same day.
+
+    === Instance Attributes ===
+    day: the day.
+    gap: how long a truck and its crew must be free before and after a trip.
+    trips: the (tID, start, end, eID1, eID2) of every trip under way on <day>.
+    employees: every (eID, truck types driven), in order of preference.
+    unavailable: the trucks with maintenance on <day> or locked by another
+    transaction.
+    held: the employees locked by another transaction.
+    taken: the routes with a trip on <day>, or locked by another transaction.
+    """
+    day: dt.date
+    gap: dt.timedelta
+    trips: list[tuple[int, dt.datetime, dt.datetime, int, int]]
+    employees: list[tuple[int, set[str]]]
+    unavailable: set[int]
+    held: set[int]
+    taken: set[int]
+    _checkpoint: Optional[int]
+    _checkpoint_routes: list[int]
+
+    def __init__(self, day: dt.date, gap: dt.timedelta, tids: list[int],
+                 employees: list[tuple[int, set[str]]]) -> None:
+        """Initialize the availability on <day> of the trucks <tids> and of
+        every (eID, truck types driven) in <employees>, in order of
+        preference, with no trips yet, keeping them free for <gap> before
+        and after each trip.
+        """
+        self.day = day
+        self.gap = gap
+        self.trips = []
+        self.employees = employees
+        self.unavailable = set()
+        self.held = set()
+        self.taken = set()
+        self._checkpoint = None
+        self._checkpoint_routes = []
+
+    def book(self, rid: int, tid: int, start: dt.datetime, end: dt.datetime,
+             eid1: int, eid2: int) -> None:
+        """Record a trip on route <rid> with truck <tid> and employees <eid1>
+        and <eid2> from <start> to <end>.
+        """
+        if start.date() == self.day and rid not in self.taken:
+            self.taken.add(rid)
+            if self._checkpoint is not None:
+                self._checkpoint_routes.append(rid)
+        self.trips.append((tid, start, end, eid1, eid2))
+
+    def book_many(self, trips: list[tuple[int, int, dt.datetime, dt.datetime,
+                                          int, int]]) -> None:
+        """Record every (rID, tID, start, end, eID1, eID2) in <trips>."""
+        for trip in trips:
+            self.book(*trip)
+
+    def checkpoint(self) -> None:
+        """Start recording the trips booked from now on, so that rollback
+        can undo them.
+        """
+        self._checkpoint = len(self.trips)
+        self._checkpoint_routes = []
+
+    def rollback(self) -> None:
+        """Undo every trip booked since the last checkpoint, keeping the
+        checkpoint. Exclusions are not undone.
+        """
+        if self._checkpoint is None:
+            return
+        del self.trips[self._checkpoint:]
+        self.taken.difference_update(self._checkpoint_routes)
+        self._checkpoint_routes = []
+
+    def exclude(self, tids: set[int], eids: set[int] = frozenset(),
+                rids: set[int] = frozenset()) -> None:
+        """Make the trucks <tids> and employees <eids> unavailable for the
+        whole day, and treat the routes <rids> as taken.
+        """
+        self.unavailable |= tids
+        self.held |= eids
+        self.taken |= rids
+
+    def free_truck(self, trucks: list[tuple[int, str]], start: dt.datetime,
+                   end: dt.datetime) -> Optional[tuple[int, str]]:
+        """Return the first (tID, truck type) in <trucks> that is available
+        for a trip from <start> to <end>, or None if there is none.
+        """
+        busy = {trip[0] for trip in self._busy(start, end)}
+        return next((truck for truck in trucks
+                     if truck[0] not in busy
+                     and truck[0] not in self.unavailable), None)
+
+    def free_crew(self, trucktype: str, start: dt.datetime,
+                  end: dt.datetime) -> Optional[tuple[int, int]]:
+        """Return the (driver, partner) to put on a trip from <start> to <end>
+        with a truck of <trucktype>, as _pick_crew picks them from the
+        employees available for it, or None if there is no such pair.
+        """
+        busy = set(self.held)
+        for trip in self._busy(start, end):
+            busy.update(trip[3:])
+        crew = [(eid, driven) for eid, driven in self.employees
+                if eid not in busy]
+        return _pick_crew([eid for eid, _ in crew],
+                          {eid for eid, driven in crew if trucktype in driven})
+
+    def _busy(self, start: dt.datetime, end: dt.datetime
+              ) -> list[tuple[int, dt.datetime, dt.datetime, int, int]]:
+        """Return the trips under way within <gap> of a trip from <start> to
+        <end>.
+        """
+        return [trip for trip in self.trips
+                if trip[1] < end + self.gap and trip[2] > start - self.gap]
+
+
+class ReferenceCache:
+    """An in-process cache of the reference data that the WasteWrangler
+    methods look up: truck types, trucks, routes and facilities.
+
+    Each entry holds the rows loaded for one kind of lookup in
+    _REFERENCE_LOOKUPS and one key. Entries expire <ttl> seconds after they
+    are loaded, the least recently used are evicted once there are more than
+    <maxsize>, and invalidate drops those loaded from a table that changed.
+
+    === Instance Attributes ===
+    maxsize: the largest number of entries kept. With 0, nothing is kept and
+    every lookup goes to the database.
+    ttl: the number of seconds an entry is kept.
+    listen: whether the WasteWrangler's connections listen for notifications
+    of changes to the reference tables, which invalidate the cache.
+    hits: the number of lookups answered from the cache.
+    misses: the number of lookups that went to the database.
+    """
+    maxsize: int
+    ttl: float
+    listen: bool
+    hits: int
+    misses: int
+    _entries: OrderedDict
+    _generation: int
+    _lock: threading.Lock
+
+    def __init__(self, maxsize: int = 0, ttl: float = 0.0,
+                 listen: bool = False) -> None:
+        """Initialize an empty cache."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.listen = listen
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, key: object,
+            load: Callable[[], list[tuple]]) -> list[tuple]:
+        """Return the rows of the lookup <kind> for <key>, calling <load> to
+        read them from the database if they are not cached.
+
+        Rows loaded while the cache is being invalidated are not kept, as they
+        may already be out of date.
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end((kind, key))
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+        rows = load()
+        with self._lock:
+            if self.maxsize > 0 and generation == self._generation:
+                self._entries[(kind, key)] = (rows, now + self.ttl)
+                self._entries.move_to_end((kind, key))
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return rows
+
+    def fill(self, kind: str,
+             load: Callable[[], dict[object, list[tuple]]]) -> int:
+        """Keep the rows of the lookup <kind> for every key, calling <load>
+        to read them from the database at once, and return the number of
+        keys kept.
+
+        As in get, nothing is kept if the cache is being invalidated while
+        <load> runs. Only the last <maxsize> keys are kept.
+        """
+        now = monotonic()
+        with self._lock:
+            generation = self._generation
+        if self.maxsize <= 0:
+            return 0
+        entries = load()
+        with self._lock:
+            if generation != self._generation:
+                return 0
+            for key, rows in entries.items():
+                self._entries[(kind, key)] = (rows, now + self.ttl)
+                self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return min(len(entries), self.maxsize)
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        """Drop every entry loaded from the reference table named <table>, or
+        every entry if <table> is None.
+        """
+        with self._lock:
+            self._generation += 1
+            if table is None:
+                self._entries.clear()
+                return
+            for kind, key in list(self._entries):
+                if table in _REFERENCE_LOOKUPS[kind][1]:
+                    del self._entries[(kind, key)]
+
+
+class ComponentIndex:
+    """A union-find over employees, where two employees are in the same
+    component iff they are connected by a chain of shared trips.
+
+    Each component keeps a list of its members, so the workmate sphere of an
+    employee can be read off in time proportional to its size.
+
+    === Private Attributes ===
+    _parent: the parent of each employee in the union-find forest.
+    _members: the members of the component rooted at each root.
+
+    Representation invariants:
+    - Every employee in _parent appears in exactly one list in _members.
+    - The keys of _members are exactly the roots of _parent.
+    """
+    _parent: dict[int, int]
+    _members: dict[int, list[int]]
+
+    def __init__(self) -> None:
+        """Initialize an index with no trips in it."""
+        self._parent = {}
+        self._members = {}
+
+    def add(self, eid1: int, eid2: int) -> None:
+        """Record a trip taken together by <eid1> and <eid2>."""
+        root1, root2 = self._find(eid1), self._find(eid2)
+        if root1 == root2:
+            return
+        if len(self._members[root1]) < len(self._members[root2]):
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        self._members[root1].extend(self._members.pop(root2))
+
+    def component(self, eid: int) -> list[int]:
+        """Return every employee connected to <eid> by shared trips, including
+        <eid> itself.
+        """
+        if eid not in self._parent:
+            return [eid]
+        return self._members[self._find(eid)]
+
+    def _find(self, eid: int) -> int:
+        """Return the root of <eid>'s component, adding <eid> as a component
+        of its own if it has not been seen yet.
+        """
+        parent = self._parent
+        if eid not in parent:
+            parent[eid] = eid
+            self._members[eid] = [eid]
+            return eid
+        while parent[eid] != eid:
+            parent[eid] = parent[parent[eid]]
+            eid = parent[eid]
+        return eid
+
+
+class SphereReport:
+    """The workmate spheres of a group of employees.
+
+    === Instance Attributes ===
+    spheres: the workmate sphere of each requested eID, as workmate_sphere
+    would return it.
+    component_sizes: the number of employees in each component of the
+    workmate graph that contains a requested eID, keyed by the smallest eID in
+    that component. Employees who have never been on a trip are components of
+    size 1.
+    """
+    spheres: dict[int, list[int]]
+    component_sizes: dict[int, int]
+
+    def __init__(self) -> None:
+        """Initialize an empty report."""
+        self.spheres = {}
+        self.component_sizes = {}
+
+
+class UnitOfWork:
+    """A transaction shared by the method calls a thread makes within
+    WasteWrangler.unit_of_work.
+
+    === Instance Attributes ===
+    connection: the connection the transaction is open on.
+    calls: the number of method calls made within the unit so far.
+    failed: the number of those calls whose work was rolled back.
+    committed: whether the transaction has been committed.
+    """
+    connection: pg_ext.connection
+    calls: int
+    failed: int
+    committed: bool
+
+    def __init__(self, connection: pg_ext.connection) -> None:
+        """Initialize a unit of work on <connection>."""
+        self.connection = connection
+        self.calls = 0
+        self.failed = 0
+        self.committed = False
 
 
 class WasteWrangler:
@@ -34,18 +1611,58 @@ class WasteWrangler:
     === Instance Attributes ===
     connection: connection to a PostgreSQL database of a waste management
     service.
+    pool: pool of connections to that database, used instead of <connection>
+    when this WasteWrangler is shared between threads.
+    statements: the prepared statements this WasteWrangler runs, with their
+    parse and execute timings.
+    components: if enabled, an in-process index of the components of the
+    workmate graph, used by workmate_sphere instead of the database. It is
+    kept up to date with the trips this WasteWrangler inserts.
+    instrumentation: if enabled, statistics of the calls made to the methods
+    of this WasteWrangler.
+    slow_queries: if enabled, explains the slow statements run by the methods
+    of this WasteWrangler.
+    reference: the cache through which the methods of this WasteWrangler
+    read reference data. It keeps nothing unless enabled.
+    itersize: the number of rows read at a time by the methods that stream
+    results of unbounded size from server-side cursors.
 
     Representation invariants:
     - The database to which connection is established conforms to the schema
       in waste_wrangler_schema.ddl.
+    - At most one of connection and pool is not None.
     """
     connection: Optional[pg_ext.connection]
+    pool: Optional[pg_pool.ThreadedConnectionPool]
+    statements: StatementRegistry
+    components: Optional[ComponentIndex]
+    instrumentation: Optional[Instrumentation]
+    slow_queries: Optional[SlowQueryExplainer]
+    reference: ReferenceCache
+    itersize: int
+    _lock: threading.RLock
+    _local: threading.local
+    _slots: Optional[threading.BoundedSemaphore]
+    _last_used: dict[int, float]
+    _listening: weakref.WeakSet
 
     def __init__(self) -> None:
         """Initialize this WasteWrangler instance, with no database connection
         yet.
         """
         self.connection = None
+        self.pool = None
+        self.statements = StatementRegistry()
+        self.components = None
+        self.instrumentation = None
+        self.slow_queries = None
+        self.reference = ReferenceCache()
+        self.itersize = _STREAM_ITERSIZE
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._slots = None
+        self._last_used = {}
+        self._listening = weakref.WeakSet()
 
     def connect(self, dbname: str, username: str, password: str) -> bool:
         """Establish a connection to the database <dbname> using the
@@ -72,6 +1689,35 @@ class WasteWrangler:
         except pg.Error:
             return False
 
+    def connect_pool(self, dbname: str, username: str, password: str,
+                     minconn: int = 1, maxconn: int = 10) -> bool:
+        """Establish a pool of between <minconn> and <maxconn> connections to
+        the database <dbname> using the username <username> and password
+        <password>, and assign it to the instance attribute <pool>. In
+        addition, set the search path of every connection to waste_wrangler.
+
+        In pooled mode, each method call checks out its own connection, so
+        one WasteWrangler can serve up to <maxconn> threads concurrently.
+        Further calls wait until a connection is returned to the pool.
+
+        Return True if the pool was made successfully, False otherwise.
+        I.e., do NOT throw an error if making the connections fails.
+
+        >>> ww = WasteWrangler()
+        >>> ww.connect_pool("csc343h-marinat", "marinat", "", 2, 8)
+        True
+        """
+        try:
+            self.pool = pg_pool.ThreadedConnectionPool(
+                minconn, maxconn,
+                dbname=dbname, user=username, password=password,
+                options="-c search_path=waste_wrangler"
+            )
+            self._slots = threading.BoundedSemaphore(maxconn)
+            return True
+        except pg.Error:
+            return False
+
     def disconnect(self) -> bool:
         """Close this WasteWrangler's connection to the database.
 
@@ -87,10 +1733,13 @@ class WasteWrangler:
         try:
             if self.connection and not self.connection.closed:
                 self.connection.close()
+            if self.pool and not self.pool.closed:
+                self.pool.closeall()
             return True
         except pg.Error:
             return False
 
+    @_instrumented
     def schedule_trip(self, rid: int, time: dt.datetime) -> bool:
         """Schedule a truck and two employees to the route identified
         with <rid> at the given time stamp <time> to pick up an
@@ -137,205 +1786,94 @@ class WasteWrangler:
         tests could use any valid value for <time>.
         """
         try:
-            expect_start = time - dt.timedelta(minutes=30)
-            expect_end = time + dt.timedelta(minutes=30)
-            expect_day = time.date()
-
-            #     Get wastetype from rid
-            connection = self.connection
-            cursor = connection.cursor()
-            cursor.execute("select * from waste_wrangler.route where rid = " + str(rid))
-            data = cursor.fetchone()
-            if len(data) == 0:
-                return False
-            wastetype = data[1]
-
-            #     Get trip by rid and time period
-            connection = self.connection
-            expect_day_after = time + dt.timedelta(days=1)
-            expect_day_before = time - dt.timedelta(days=1)
-
-            cursor = connection.cursor()
-            sql = "select rid from waste_wrangler.trip where rid = '" + str(rid) + "' and ttime < '" + str(expect_day_after) + "' and ttime > '" + str(time) + "'"
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            if len(data) > 0:
-                return False
-
-            #     Get fid by wastetype
-            connection = self.connection
-            expect_day_after = time + dt.timedelta(days=1)
-            expect_day_before = time - dt.timedelta(days=1)
-
-            cursor = connection.cursor()
-            sql = "select fid from waste_wrangler.facility where wastetype = '" + str(wastetype) + "'"
-            cursor.execute(sql)
-            data = cursor.fetchone()
-            fid = data[0]
-
-            #     Get trucktypes from wastetype
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select * from waste_wrangler.trucktype where wastetype = '" + str(wastetype) + "'"
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            trucktypes = []
-            for d in data:
-                trucktypes.append(d[0])
-
-            #     Get truck id from trucktype
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select tid from waste_wrangler.truck where trucktype in ('"
-            for d in trucktypes:
-                sql = sql + d + "','"
-            sql = sql[:len(sql)-2]
-            sql = sql + ") order by capacity desc"
-
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            tid = []
-            for d in data:
-                tid.append(d[0])
-
-            #     Get ttid from tid and time period
-            ttid = 0
-            for d in tid:
-                connection = self.connection
+            with self._transaction() as connection:
+                day = time.date()
                 cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.maintenance where tid = '" + str(d) + "' and mdate < '" + str(time) + "'"
 
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                if len(data) == 0:
-                    continue
-                connection = self.connection
-                cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.trip where ttime > '" + str(expect_start) + "' and ttime <'" + str(expect_end) + "'"
-
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                if len(data) > 0 :
-                    continue
-                ttid = d
-                break
-
-            if ttid == 0:
-                return False
-
-            #     Get eid from trucktype  for  driver
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select eid from waste_wrangler.driver where trucktype in ('"
-            for d in trucktypes:
-                sql = sql + d + "','"
-            sql = sql[:len(sql)-2]
-            sql = sql + ")"
-
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            eid = []
-            for d in data:
-                eid.append(d[0])
-
-            #     Get normal employment from trucktrype
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select eid from waste_wrangler.employee where eid in ('"
-            for d in eid:
-                sql = sql + str(d) + "','"
-            sql = sql[:len(sql)-2]
-            sql = sql + ") order by hiredate, eid"
-
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            eid = []
-            for d in data:
-                eid.append(d[0])
-
-            #     Fo the filter about driver
-            eiddriver = 0
-            for d in eid:
-                connection = self.connection
-                cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.maintenance where tid = '" + str(d) + "' and mdate < '" + str(expect_day) + "'"
-
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                if len(data) == 0:
-                    continue
-                connection = self.connection
-                cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.trip where ttime > '" + str(expect_start) + "' and ttime <'" + str(expect_end) + "'"
-
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                if len(data) > 0 :
-                    continue
-                eiddriver = d
-                break
-            if eiddriver == 0:
+                #     Get the route's duration and facility and the trucks
+                #     that can carry its waste type, in one lookup
+                route = self._lookup(cursor, "route_candidates", rid)
+                if not route:
+                    return False
+                _, duration, fid, tids, trucktypes = route[0]
+                if fid is None or not tids:
+                    return False
+
+                #     The whole trip must fit within working hours
+                end = time + duration
+                shift_start = dt.datetime.combine(day, _SHIFT_START)
+                shift_end = dt.datetime.combine(day, _SHIFT_END)
+                if time < shift_start or end > shift_end:
+                    return False
+
+                #     Pick and lock the truck, driver and partner, unless the
+                #     route is taken that day, then insert the trip unless one
+                #     of them was booked just before it was locked
+                for _ in range(_CLAIM_ATTEMPTS):
+                    self.statements.execute(cursor, _TRIP_CLAIM, (
+                        rid, time, time - _TRIP_GAP, end + _TRIP_GAP, tids,
+                        trucktypes
+                    ))
+                    data = cursor.fetchone()
+                    if data is None:
+                        return False
+                    tid, driver, partner = data
+                    if self._insert_trips(cursor, [
+                        (rid, tid, time, driver, partner, fid)
+                    ]):
+                        return True
                 return False
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return False
 
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select eid from waste_wrangler.employee where eid != " + str(eiddriver) + " order by hiredate"
-
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            eid = []
-
-            for d in data:
-                eid.append(d[0])
-            #     Do the normal employment filter
+    @_instrumented
+    def schedule_trip_many(self, requests: list[tuple[int, dt.datetime]]
+                           ) -> list[bool]:
+        """Schedule a trip for each (rid, time) in <requests>, in order, with
+        the same result as calling schedule_trip for each of them.
 
-            eidpartner = 0
-            for d in eid:
-                connection = self.connection
-                cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.maintenance where tid = '" + str(d) + "' and mdate < '" + str(time) + "'"
+        The routes, trucks, trips, maintenance and employees the requests
+        depend on are loaded once, the requests are resolved against them in
+        memory, each trip picked making its truck and crew busy for the
+        requests after it, and all of the trips are inserted with one
+        statement. With NumPy installed, the trucks and employees free for
+        each request are found in minute bitmaps of each day (see
+        availability.py) rather than by scanning the day's trips.
 
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                if len(data) == 0:
-                    continue
-                connection = self.connection
-                cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.trip where ttime > '" + str(expect_start) + "' and ttime <'" + str(expect_end) + "'"
+        Return whether the trip of each request was scheduled, in order.
 
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                if len(data) > 0 :
-                    continue
-                eidpartner = d
-                break
-            if eidpartner == 0:
-                return False
-            ans = [ttid, eiddriver, eidpartner]
-
-            #     Insert into trip
-            connection = self.connection
-            cursor = connection.cursor()
-            today = time.date()
-            tomorrow = today + dt.timedelta(days=1)
-            sql = "select tid from waste_wrangler.trip where ttime > '" + str(today) + "' and ttime <'" + str(tomorrow) + "' and rid = '" + str(rid) + "'"
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            if data is None or len(data) == 0:
-                connection = self.connection
+        Your method should NOT raise an error. If an error occurs, no trips
+        are scheduled and every request fails.
+        """
+        try:
+            with self._transaction() as connection:
                 cursor = connection.cursor()
-                sql = "INSERT INTO waste_wrangler.trip(rid, tid, ttime, eid1, eid2, fid) VALUES (" + str(rid) + ", '" + str(ttid) + "' , '" + time.strftime("%Y-%m-%d %H:%M:%S") + "' , '" + str(eiddriver) + "' , '" + str(eidpartner) + "', '" + str(fid) + "')"
-                cursor.execute(sql)
-                connection.commit()
-            else:
-                return False
-            return True
+                days = sorted({time.date() for _, time in requests})
+                self.statements.execute(cursor, _ROUTE_TRUCKS, (
+                    sorted({rid for rid, _ in requests}),
+                ))
+                #     Routes of the same waste type share one list of trucks
+                routes, trucks = {}, {}
+                for rid, duration, fid, tids, trucktypes in cursor:
+                    if tuple(tids) not in trucks:
+                        trucks[tuple(tids)] = list(zip(tids, trucktypes))
+                    routes[rid] = (duration, fid, trucks[tuple(tids)])
+                for _ in range(_CLAIM_ATTEMPTS):
+                    placed = self._place_trips(cursor, requests, days, routes)
+                    new_trips = [trip for trip in placed if trip is not None]
+                    if not new_trips or self._insert_trips(cursor, new_trips):
+                        return [trip is not None for trip in placed]
+                return [False] * len(requests)
         except pg.Error as ex:
-                # You may find it helpful to uncomment this line while debugging,
-                # as it will show you all the details of the error that occurred:
-                # raise ex
-                return False
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return [False] * len(requests)
 
+    @_instrumented
     def schedule_trips(self, tid: int, date: dt.date) -> int:
         """Schedule the truck identified with <tid> for trips on <date> using
         the following approach:
@@ -368,209 +1906,129 @@ class WasteWrangler:
         While a realistic use case will provide a <date> in the near future, our
         tests could use any valid value for <date>.
         """
-        connection = self.connection
-        expect_day_after = date + dt.timedelta(days=1)
-        expect_day_before = date - dt.timedelta(days=1)
-        #    Find Tid
-        cursor = connection.cursor()
-        sql = "select tid from waste_wrangler.trip where tid = '" + str(tid) + "' and ttime < '" + str(expect_day_after) + "' and ttime > '" + str(date) + "'"
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        if len(data) > 0:
-            return 0
-        usedTid = []
-        for d in data:
-            usedTid.append(d[0])
-
-        #  Find trucktype by tid
-        connection = self.connection
-        cursor = connection.cursor()
-        sql = "select distinct(trucktype) from waste_wrangler.truck where tid = '" + str(tid) + "')" # TA: added =
-
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        trucktype = data[0]
-
-        #  Find wasteType by trucktype
-        connection = self.connection
-
-        cursor = connection.cursor()
-        sql = "select wastetype from waste_wrangler.trucktype where trucktype = '" + str(trucktype) + "'"
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        wastetypes = []
-        for d in data:
-            if d[0] not in wastetypes:
-                wastetypes.append(data[0])
-
-        #     Find Rid by wasteType
-
-        connection = self.connection
-        cursor = connection.cursor()
-        sql = "select rid from waste_wrangler.route where wastetype in ('"
-        for d in wastetypes:
-            sql = sql + d + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ")"
-        cursor.execute(sql)
-        data = cursor.fetchone()
-        if len(data) == 0:
-            return False
-        rid = data[0]
-
-        #     Find eid by truckType
-        connection = self.connection
-        cursor = connection.cursor()
-        sql = "select distinct(eid) from waste_wrangler.driver where trucktype in ('"
-        for d in trucktype:
-            sql = sql + d + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ")"
-
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        eid = []
-        for d in data:
-            eid.append(d[0])
-
-        #  Find eid who is occupied on the date
-        connection = self.connection
-        expect_day_after = date + dt.timedelta(days=1)
-        expect_day_before = date - dt.timedelta(days=1)
+        try:
+            if isinstance(date, dt.datetime):
+                date = date.date()
+            with self._transaction() as connection:
+                cursor = connection.cursor()
+                truck = self._lookup(cursor, "truck", tid)
+                if not truck:
+                    return 0
+                trucktype = truck[0][0]
+                routes = self._lookup(cursor, "trucktype_routes", trucktype)
+
+                for _ in range(_CLAIM_ATTEMPTS):
+                    #     Load whether the truck is busy, which of its routes
+                    #     are taken and who is free that day in one query
+                    self.statements.execute(cursor, _TRUCK_DAY_STATE, (
+                        tid, date, [route[0] for route in routes], trucktype
+                    ))
+                    busy, taken, employees, drivers = cursor.fetchone()
+                    if busy:
+                        return 0
+                    taken = set(taken)
+
+                    #     Plan the day and lock the truck, the routes and the
+                    #     crew, planning again without any locked elsewhere
+                    while True:
+                        plan = _plan_day(date, [route for route in routes
+                                                if route[0] not in taken])
+                        if not plan:
+                            return 0
+                        crew = _pick_crew(employees, set(drivers))
+                        if crew is None:
+                            return 0
+                        trips = [(rid, tid, start, crew[0], crew[1], fid)
+                                 for rid, start, fid in plan]
+                        held = self._claim(cursor, [
+                            resource for trip in trips
+                            for resource in _trip_resources(trip)
+                        ])
+                        if (_LOCK_TRUCK, tid, date) in held:
+                            return 0
+                        if not held:
+                            break
+                        taken |= {rid for kind, rid, _ in held
+                                  if kind == _LOCK_ROUTE}
+                        employees = [eid for eid in employees
+                                     if (_LOCK_EMPLOYEE, eid, date) not in held]
 
-        cursor = connection.cursor()
-        sql = "select rid from waste_wrangler.trip where eid1 in ('"
-        for d in eid:
-            sql = sql + str(d) + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ") or eid2 in ('"
-        for d in eid:
-            sql = sql + str(d) + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ") and ttime < '" + str(expect_day_after) + "' and ttime > '" + str(expect_day_before) + "'"
-
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        ocEid = []
-        for d in data :
-            ocEid.append(d[0])
-
-         #  Find available drivers
-        filtedDriver = []
-        for d in eid:
-            if d in ocEid:
-                continue
-            filtedDriver.append(d)
+                    if self._insert_trips(cursor, trips, True):
+                        return len(plan)
+                return 0
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
 
-        connection = self.connection
-        cursor = connection.cursor()
-        sql = "select eid from waste_wrangler.employee where eid not in ('"
-        for d in filtedDriver:
-            sql = sql + str(d) + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ")"
-
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        eid = []
-        for d in data:
-            eid.append(d[0])
-
-        #     Find occupied employees
-        connection = self.connection
-        expect_day_after = date + dt.timedelta(days=1)
-        expect_day_before = date - dt.timedelta(days=1)
+    @_instrumented
+    def schedule_fleet(self, date: dt.date,
+                       workers: Optional[int] = None) -> dict[int, int]:
+        """Schedule every truck for trips on <date>, with the same result as
+        calling schedule_trips for each truck in ascending order of tID.
 
-        cursor = connection.cursor()
-        sql = "select rid from waste_wrangler.trip where eid1 in ('"
-        for d in eid:
-            sql = sql + str(d) + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ") or eid2 in ('"
-        for d in eid:
-            sql = sql + str(d) + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ") and ttime < '" + str(expect_day_after) + "' and ttime > '" + str(expect_day_before) + "'"
-
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        ocEid = []
-        for d in data:
-            ocEid.append(d[0])
-
-        #     Find available employees
-        filtedEid = []
-        for d in eid:
-            if d in ocEid:
-                continue
-            filtedEid.append(d)
+        The trucks, routes and employees are loaded once and shared between
+        the trucks in memory. Trucks that cannot carry any of the same waste
+        types never compete for routes, so their trips are planned in
+        separate chunks, spread over a pool of <workers> processes if
+        <workers> is more than 1. Crews are then assigned in order of tID, and
+        all of the trips are inserted in a single transaction.
 
-        #     Find FID
-        connection = self.connection
-        expect_day_after = date + dt.timedelta(days=1)
-        expect_day_before = date - dt.timedelta(days=1)
+        Return the number of trips scheduled for each truck.
 
-        cursor = connection.cursor()
-        sql = "select fid from waste_wrangler.facility where wastetype ('"
-        for d in wastetypes:
-            sql = sql + d + "','"
-        sql = sql[:len(sql)-2]
-        sql = sql + ")"
-        data = cursor.fetchone()
-        fid = data[0]
-
-        #     Insert Trip
-        ans = 0
-        num = 0
-        now = date
-        offwork =  date.date() + dt.timedelta(hours=16)
-        if len(filtedDriver) <= len(filtedEid):
-            num = len(filtedDriver)
-            for i in range(0, num):
-                connection = self.connection
-                cursor = connection.cursor()
-                sql = "INSERT INTO waste_wrangler.trip(rid, tid, ttime, eid1, eid2, fid) VALUES (" + str(rid) + ", '" + str(tid) + "' , '" + now.strftime("%Y-%m-%d %H:%M:%S") + "' , '" + str(filtedDriver[i]) + "' , '" + str(filtedEid[i]) + "', '" + str(fid) + "')"
-                try:
-                    cursor.execute(sql)
-                    connection.commit()
-                except pg.Error as ex:
-                    continue
-                ans += 1
-                now = now + dt.timedelta(minutes=30)
-                if now > offwork:
-                    return ans
-        else:
-            num = len(filtedEid) + (len(filtedDriver) - len(filtedEid)) // 2
-            for i in range(0, len(filtedEid)):
-                connection = self.connection
-                cursor = connection.cursor()
-                sql = "INSERT INTO waste_wrangler.trip(rid, tid, ttime, eid1, eid2, fid) VALUES (" + str(rid) + ", '" + str(tid) + "' , '" + now.strftime("%Y-%m-%d %H:%M:%S") + "' , '" + str(filtedDriver[i]) + "' , '" + str(filtedEid[i]) + "', '" + str(fid) + "')"
-                try:
-                    cursor.execute(sql)
-                    connection.commit()
-                except pg.Error as ex:
-                    continue
-                ans += 1
-                now = now + dt.timedelta(minutes=30)
-                if now > offwork:
-                    return ans
-            for i in range (len(filtedEid), len(filtedDriver)):
-                connection = self.connection
+        Your method should NOT raise an error. If an error occurs, no trips
+        are scheduled and an empty dict is returned.
+        """
+        try:
+            if isinstance(date, dt.datetime):
+                date = date.date()
+            with self._transaction() as connection:
                 cursor = connection.cursor()
-                sql = "INSERT INTO waste_wrangler.trip(rid, tid, ttime, eid1, eid2, fid) VALUES (" + str(rid) + ", '" + str(tid) + "' , '" + now.strftime("%Y-%m-%d %H:%M:%S") + "' , '" + str(filtedDriver[i]) + "' , '" + str(filtedDriver[i]) + "', '" + str(fid) + "')"
-                try:
-                    cursor.execute(sql)
-                    connection.commit()
-                except pg.Error as ex:
-                    continue
-                ans += 1
-                now = now + dt.timedelta(minutes=30)
-                if now > offwork:
-                    return ans
-
-        return num
+                for _ in range(_CLAIM_ATTEMPTS):
+                    self.statements.execute(cursor, _FLEET_TRUCKS, (date,))
+                    trucks = cursor.fetchall()
+                    self.statements.execute(cursor, _FLEET_ROUTES, (date,))
+                    routes = cursor.fetchall()
+                    self.statements.execute(cursor, _FLEET_EMPLOYEES, (date,))
+                    employees = cursor.fetchall()
+
+                    #     Plan the fleet and lock the trucks, routes and crews
+                    #     of its trips, planning again without any locked
+                    #     elsewhere
+                    while True:
+                        counts, trips = _plan_fleet(date, trucks, routes,
+                                                    employees, workers)
+                        held = self._claim(cursor, [
+                            resource for trip in trips
+                            for resource in _trip_resources(trip)
+                        ])
+                        if not held:
+                            break
+                        trucks = [
+                            (tid, trucktype, wastetypes,
+                             busy or (_LOCK_TRUCK, tid, date) in held)
+                            for tid, trucktype, wastetypes, busy in trucks
+                        ]
+                        routes = [route for route in routes
+                                  if (_LOCK_ROUTE, route[0], date) not in held]
+                        employees = [
+                            employee for employee in employees
+                            if (_LOCK_EMPLOYEE, employee[0], date) not in held
+                        ]
+
+                    if not trips or self._insert_trips(cursor, trips, True):
+                        return counts
+                return {}
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return {}
 
-    def update_technicians(self, qualifications_file: TextIO) -> int:
+    @_instrumented
+    def update_technicians(self, qualifications_file: TextIO,
+                           bulk: bool = False) -> int:
         """Given the open file <qualifications_file> that follows the format
         described on the handout, update the database to reflect that the
         recorded technicians can now work on the corresponding given truck type.
@@ -592,76 +2050,54 @@ class WasteWrangler:
 
         Hint: We have provided a helper _read_qualifications_file that you
             might find helpful for completing this method.
+
+        If <bulk> is True, the file is streamed into a temporary staging table
+        with COPY, validated with set-based joins and applied with a single
+        INSERT, which is much faster for large files.
         """
+        if bulk:
+            return self._update_technicians_bulk(qualifications_file)
         try:
-            file = qualifications_file
-            ans = 0
-            n = 0
-            eid = 0
-            while (line := file.readline().rstrip()):
-                if n % 2 == 0:
-                    n += 1
-                    name = line
-                    d = name.split(" ")
+            with self._transaction() as connection:
+                cursor = connection.cursor()
+                ans = 0
+                for fname, lname, trucktype in \
+                        self._read_qualifications_file(qualifications_file):
                     #             Find eid
-                    connection = self.connection
-                    cursor = connection.cursor()
-                    selectedName = d[len(d)-2] + " " + d[len(d)-1]
-                    sql = "select eid from waste_wrangler.employee where name = '" + str(selectedName) + "'"
-
-                    cursor.execute(sql)
+                    self.statements.execute(cursor, _EMPLOYEE_BY_NAME,
+                                            (fname + " " + lname,))
                     data = cursor.fetchone()
-                    if len(data) == 0:
+                    if data is None:
                         continue
                     eid = data[0]
-                    #             Filter Driver
-                    connection = self.connection
-                    cursor = connection.cursor()
-                    selectedName = d[len(d)-2] + " " + d[len(d)-1]
-                    sql = "select eid from waste_wrangler.driver where eid = '" + str(eid) + "'"
-
-                    cursor.execute(sql)
-                    data = cursor.fetchone()
 
-                    if data is not None :
-                        eid = 0
-                else:
-                    n+=1
-                    if eid == 0:
+                    #             Filter Driver
+                    self.statements.execute(cursor, _IS_DRIVER, (eid,))
+                    if cursor.fetchone() is not None:
                         continue
 
-                    connection = self.connection
-
-                    cursor = connection.cursor()
-                    sql = "select * from waste_wrangler.trucktype where trucktype = '" + str(line) + "'"
-                    cursor.execute(sql)
-                    data = cursor.fetchall()
-                    if len(data) == 0:
+                    #             Filter unknown truck types
+                    if not self._lookup(cursor, "trucktype", trucktype):
                         continue
+
                     #   Filter current pairs
-                    connection = self.connection
-                    cursor = connection.cursor()
-                    sql = "select * from waste_wrangler.technician where eid = '" + str(eid) + "' and trucktype = '" + str(line) + "'"
-                    cursor.execute(sql)
-                    data = cursor.fetchall()
-                    if len(data) != 0:
+                    self.statements.execute(cursor, _IS_TECHNICIAN,
+                                            (eid, trucktype))
+                    if cursor.fetchone() is not None:
                         continue
-                    #             Insert Data
-                    connection = self.connection
-                    cursor = connection.cursor()
-                    sql = "INSERT INTO waste_wrangler.technician(eid, trucktype) VALUES (" + str(eid) + ", '" + str(line) + "')"
-                    cursor.execute(sql)
-                    connection.commit()
 
-                    eid = 0
+                    #             Insert Data
+                    self.statements.execute(cursor, _INSERT_TECHNICIAN,
+                                            (eid, trucktype))
                     ans += 1
-            return ans
+                return ans
         except pg.Error as ex:
-                # You may find it helpful to uncomment this line while debugging,
-                # as it will show you all the details of the error that occurred:
-                # raise ex
-                return 0
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
 
+    @_instrumented
     def workmate_sphere(self, eid: int) -> list[int]:
         """Return the workmate sphere of the driver identified by <eid>, as a
         list of eIDs.
@@ -680,44 +2116,22 @@ class WasteWrangler:
         should simply return an empty list.
         """
         try:
-            eid_list = []
-            eid_list.append(eid)
-            ans = [eid]
-            while True:
-             # Find the current sphere
-                connection = self.connection
+            if self.components is not None:
+                with self._lock:
+                    return [d for d in self.components.component(eid)
+                            if d != eid]
 
+            with self._transaction() as connection:
                 cursor = connection.cursor()
-                sql = "select eid1, eid2 from waste_wrangler.trip where eid1 in ('"
-                for d in eid_list:
-                    sql = sql + str(d) + "','"
-                sql = sql[:len(sql)-2]
-                sql = sql + ") or eid2 in ('"
-                for d in eid_list:
-                    sql = sql + str(d) + "','"
-                sql = sql[:len(sql)-2]
-                sql = sql + ")"
-
-                cursor.execute(sql)
-                data = cursor.fetchall()
-
-                cur = []
-                for d in data:
-                    if d[0] not in eid_list and d[0] not in ans:
-                        ans.append(d[0])
-                        cur.append(d[0])
-                    if d[1] not in eid_list and d[1] not in ans:
-                        ans.append(d[1])
-                        cur.append(d[1])
-                eid_list = cur
-                if len(eid_list) == 0:
-                    return ans[1:]
+                self.statements.execute(cursor, _SPHERE, (eid,))
+                return [d[0] for d in cursor.fetchall()]
         except pg.Error as ex:
             # You may find it helpful to uncomment this line while debugging,
             # as it will show you all the details of the error that occurred:
             # raise ex
             return []
 
+    @_instrumented
     def schedule_maintenance(self, date: dt.date) -> int:
         """For each truck whose most recent maintenance before <date> happened
         over 90 days before <date>, and for which there is no scheduled
@@ -735,6 +2149,9 @@ class WasteWrangler:
         If there is more than one technician available on a given day, choose
         the one with the lowest eID.
 
+        Trucks that have never been maintained are treated as overdue, and
+        trucks with no qualified technician are skipped.
+
         Return the number of trucks that were successfully scheduled for
         maintenance.
 
@@ -744,195 +2161,697 @@ class WasteWrangler:
         tests could use any valid value for <date>.
         """
         try:
-            expect_day_before = date - dt.timedelta(days=90)
-            expect_day_after_start = date + dt.timedelta(days=1)
-            expect_day_after_to = date + dt.timedelta(days=10)
+            with self._transaction() as connection:
+                cursor = connection.cursor()
+                for _ in range(_CLAIM_ATTEMPTS):
+                    self.statements.execute(cursor, _OVERDUE_TRUCKS, (date,))
+                    trucks = cursor.fetchall()
+
+                    #     Leave out the trucks another transaction is
+                    #     scheduling maintenance for
+                    held = self._claim(cursor, [(_LOCK_OVERDUE, tid, None)
+                                                for tid, _ in trucks])
+                    trucks = [(tid, trucktype) for tid, trucktype in trucks
+                              if (_LOCK_OVERDUE, tid, None) not in held]
+
+                    #     Find the qualified technicians for each truck type,
+                    #     in ascending order of eID
+                    self.statements.execute(cursor, _TECHNICIANS_FOR_TYPES, (
+                        list({trucktype for _, trucktype in trucks}),
+                    ))
+                    technicians = {}
+                    for trucktype, eid in cursor.fetchall():
+                        technicians.setdefault(trucktype, []).append(eid)
+                    trucks = [(tid, technicians[trucktype])
+                              for tid, trucktype in trucks
+                              if trucktype in technicians]
+
+                    #     Schedule the trucks and lock the days they take,
+                    #     scheduling again without any locked elsewhere
+                    held_booked, held_busy = set(), set()
+                    while True:
+                        scheduled = self._schedule_maintenance_days(
+                            cursor, date, trucks, held_booked, held_busy)
+                        held = self._claim(cursor, [
+                            resource for tid, eid, day in scheduled
+                            for resource in [(_LOCK_TRUCK, tid, day),
+                                             (_LOCK_TECHNICIAN, eid, day)]
+                        ])
+                        if not held:
+                            break
+                        held_booked |= {(eid, day) for kind, eid, day in held
+                                        if kind == _LOCK_TECHNICIAN}
+                        held_busy |= {(tid, day) for kind, tid, day in held
+                                      if kind == _LOCK_TRUCK}
+
+                    if not scheduled:
+                        return 0
+                    self.statements.execute(cursor, _INSERT_MAINTENANCE, tuple(
+                        list(column) for column in zip(*scheduled)
+                    ) + (date,))
+                    if cursor.rowcount == len(scheduled):
+                        return len(scheduled)
+                return 0
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
 
-            #     Find the tid from date period
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select tid from waste_wrangler.maintenance where mdate < '" + str(expect_day_before) + "'"
+    @_instrumented
+    def reroute_waste(self, fid: int, date: dt.date) -> int:
+        """Reroute the trips to <fid> on day <date> to another facility that
+        takes the same type of waste. If there are many such facilities, pick
+        the one with the smallest fID (that is not <fid>).
 
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            tid = []
-            for d in data:
-                if d[0] not in tid:
-                    tid.append(d[0])
+        Return the number of re-routed trips.
 
-            #     Find the filter of tid
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select tid from waste_wrangler.maintenance where mdate > '" + str(expect_day_after_start) + "' and mdate < '" + str(expect_day_after_to) + "'"
+        Don't worry about too many trips arriving at the same time to the same
+        facility. Each facility has ample receiving facility.
 
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            noTid = []
-            for d in data:
-                if d not in noTid:
-                    noTid.append(d)
+        Your method should NOT return an error. If an error occurs, your method
+        should simply return 0 i.e., no trips have been re-routed.
 
-            #     Find the selective tids
-            if len(noTid) != 0:
-                connection = self.connection
+        While a realistic use case will provide a <date> in the near future, our
+        tests could use any valid value for <date>.
+
+        Assume this happens before any of the trips have reached <fid>.
+        """
+        try:
+            with self._transaction() as connection:
                 cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.truck where tid Not in ('"
-                for d in noTid:
-                    sql = sql + str(d) + "','"
-                sql = sql[:len(sql)-2]
-                sql = sql + ")"
-
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                for d in data:
-                    if d not in tid:
-                        tid.append(d)
+                self.statements.execute(cursor, _REROUTE, ([fid], date, date))
+                return cursor.rowcount
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
 
-            else:
-                connection = self.connection
+    @_instrumented
+    def reroute_waste_many(self, fids: list[int], start: dt.date,
+                           end: dt.date) -> dict[int, int]:
+        """Reroute the trips to each facility in <fids> from <start> to <end>
+        inclusive, as reroute_waste does, after all of those facilities had an
+        emergency shutdown.
+
+        The trips to each facility go to the facility with the smallest fID
+        that takes the same type of waste and is not in <fids>. All of the
+        trips are rerouted in a single transaction.
+
+        Return the number of re-routed trips for each facility in <fids>.
+
+        Your method should NOT return an error. If an error occurs, your method
+        should simply return 0 for every facility i.e., no trips have been
+        re-routed.
+        """
+        counts = {fid: 0 for fid in fids}
+        try:
+            with self._transaction() as connection:
                 cursor = connection.cursor()
-                sql = "select tid from waste_wrangler.truck "
+                self.statements.execute(cursor, _REROUTE,
+                                        (list(fids), start, end))
+                for closed, in cursor.fetchall():
+                    counts[closed] += 1
+            return counts
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return {fid: 0 for fid in fids}
 
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                for d in data:
-                    if d[0] not in tid:
-                        tid.append(d[0])
+    @_instrumented
+    def workmate_sphere_many(self, eids: Optional[list[int]] = None
+                             ) -> SphereReport:
+        """Return the workmate spheres of every employee in <eids>, or of
+        every employee in the database if <eids> is None.
 
-            tid.sort()
+        All spheres are computed from a single pass over the trips, rather
+        than one traversal per employee. If <components> is enabled, it is
+        used instead and the trips are not read at all.
 
-            for d in tid:
-                currentid=d
-                #         Find trucktype from tid
-                connection = self.connection
+        Your method should NOT return an error. If an error occurs, your method
+        should simply return an empty report.
+        """
+        try:
+            with self._transaction() as connection:
                 cursor = connection.cursor()
-                sql = "select distinct(trucktype) from waste_wrangler.truck where tid = '" + str(d) + "'"
+                if eids is None:
+                    self.statements.execute(cursor, _ALL_EMPLOYEES)
+                    eids = [d[0] for d in cursor.fetchall()]
+                with self._lock:
+                    components = self.components
+                if components is None:
+                    components = self._load_components(connection)
+
+            report = SphereReport()
+            with self._lock:
+                for eid in eids:
+                    members = components.component(eid)
+                    report.spheres[eid] = [d for d in members if d != eid]
+                    report.component_sizes[min(members)] = len(members)
+            return report
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return SphereReport()
 
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                trucktypes = [data[0][0]]
+    @_instrumented
+    def enable_component_index(self) -> bool:
+        """Build <components> from every trip in the database, so that
+        workmate_sphere no longer needs to query the database.
 
-                #         Find eid from trucktype
+        Only trips inserted through this WasteWrangler are added to the index
+        afterwards; call this method again to pick up trips inserted by
+        anyone else.
 
-                connection = self.connection
+        Return True iff the index was built successfully.
+        """
+        try:
+            with self._transaction() as connection:
+                components = self._load_components(connection)
+            with self._lock:
+                self.components = components
+            return True
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return False
+
+    def disable_component_index(self) -> None:
+        """Drop <components>, so that workmate_sphere queries the database
+        again.
+        """
+        with self._lock:
+            self.components = None
+
+    def enable_instrumentation(self) -> Instrumentation:
+        """Start recording the calls made to the methods of this
+        WasteWrangler in a new <instrumentation>, and return it.
+        """
+        self.instrumentation = Instrumentation()
+        return self.instrumentation
+
+    def disable_instrumentation(self) -> None:
+        """Stop recording the calls made to the methods of this
+        WasteWrangler.
+        """
+        self.instrumentation = None
+
+    def enable_slow_query_explain(self, threshold: float = 0.5,
+                                  per_minute: float = 6.0
+                                  ) -> SlowQueryExplainer:
+        """Start logging the plans of the statements run by the methods of
+        this WasteWrangler that take longer than <threshold> seconds, at most
+        <per_minute> of them a minute, and return the new <slow_queries>.
+        """
+        self.slow_queries = SlowQueryExplainer(threshold, per_minute)
+        return self.slow_queries
+
+    def disable_slow_query_explain(self) -> None:
+        """Stop explaining slow statements."""
+        self.slow_queries = None
+
+    def enable_reference_cache(self, maxsize: int = 1024, ttl: float = 300.0,
+                               listen: bool = False) -> bool:
+        """Start keeping up to <maxsize> entries of reference data in a new
+        <reference> cache, for <ttl> seconds each.
+
+        If <listen> is True, also install triggers that notify the channel
+        ww_reference of every change to a reference table, and have the
+        connections of this WasteWrangler listen on it, so that the entries
+        loaded from a table are dropped as soon as it changes. Otherwise,
+        call reference.invalidate after changing a reference table.
+
+        Return True iff the cache was enabled successfully.
+        """
+        reference = ReferenceCache(maxsize, ttl, listen)
+        if listen:
+            try:
+                with self._transaction() as connection:
+                    connection.cursor().execute(_REFERENCE_NOTIFY)
+            except pg.Error as ex:
+                # You may find it helpful to uncomment this line while
+                # debugging, as it will show you all the details of the error
+                # that occurred:
+                # raise ex
+                return False
+        self.reference = reference
+        return True
+
+    def disable_reference_cache(self) -> None:
+        """Stop caching reference data, so that every lookup goes to the
+        database again.
+        """
+        self.reference = ReferenceCache()
+
+    def preload_route_candidates(self) -> int:
+        """Load what schedule_trip looks up for every route into <reference>
+        with one statement: its duration, its facility and the trucks that
+        can carry its waste type. schedule_trip then finds them there without
+        a round trip, until they expire or a route, facility, truck or truck
+        type changes.
+
+        Return the number of routes loaded, or 0 if reference data is not
+        cached or an error occurs.
+        """
+        try:
+            with self._transaction() as connection:
                 cursor = connection.cursor()
-                sql = "select distinct(eid) from waste_wrangler.technician where trucktype in ('"
-                for d in trucktypes:
-                    sql = sql + str(d) + "','"
-                sql = sql[:len(sql)-2]
-                sql = sql + ")"
-
-                cursor.execute(sql)
-                data = cursor.fetchall()
-                eid = []
-                for d in data:
-                    if d[0] not in eid:
-                        eid.append(d[0])
-                eid.sort()
-
-                chooseEid = ""
-                currentTime = date
-
-                while (True):
-            #             Check which date is the earliest date
-                    currentTime = currentTime + dt.timedelta(days=1)
-                    n = 0
-                    # for each eid, choose whether they are used or not and choose the earliest date to use. then insert into database
-                    for chooseEid in eid:
-                        connection = self.connection
-                        cursor = connection.cursor()
-                        sql = "select eid from waste_wrangler.maintenance where mdate = '" + currentTime.strftime("%Y-%m-%d") + "' and eid = '" + str(chooseEid) + "'"
-
-                        cursor.execute(sql)
-                        data = cursor.fetchall()
-                        if len(data) == 0:
-                            connection = self.connection
-                            cursor = connection.cursor()
-                            sql = "INSERT INTO waste_wrangler.maintenance(tid, eid, mdate) VALUES (" + str(currentid) + ", '" + str(chooseEid) + "', '" + currentTime.strftime("%Y-%m-%d") + "')"
-                            cursor.execute(sql)
-                            connection.commit()
-                            n = 1
-                            break
-                    if n == 0:
-                        continue
-                    else:
-                        break
 
-            return len(tid)
+                def load() -> dict[object, list[tuple]]:
+                    self.statements.execute(cursor, _ALL_ROUTE_CANDIDATES)
+                    return {row[0]: [row] for row in cursor.fetchall()}
+                return self.reference.fill("route_candidates", load)
         except pg.Error as ex:
             # You may find it helpful to uncomment this line while debugging,
             # as it will show you all the details of the error that occurred:
             # raise ex
             return 0
 
-    def reroute_waste(self, fid: int, date: dt.date) -> int:
-        """Reroute the trips to <fid> on day <date> to another facility that
-        takes the same type of waste. If there are many such facilities, pick
-        the one with the smallest fID (that is not <fid>).
+    def provision_indexes(self, exclusion: bool = False) -> bool:
+        """Create the indexes that the availability checks and lookups of
+        this WasteWrangler rely on, if they do not exist yet, and refresh the
+        planner statistics of their tables.
+
+        If <exclusion> is True, also make the database reject trips that
+        double-book a truck or an employee: each trip's busy window is kept
+        in the table trip_window by a trigger, under btree_gist exclusion
+        constraints. A method whose trip is rejected returns as if it had
+        found no truck or crew. Windows are not recomputed when the length of
+        a route changes.
+
+        Return True iff everything was created. If anything fails, e.g. the
+        existing trips already double-book someone or btree_gist is not
+        available, nothing is changed.
+        """
+        try:
+            with self._transaction() as connection:
+                cursor = connection.cursor()
+                for name, table, columns in _INDEXES:
+                    cursor.execute("CREATE INDEX IF NOT EXISTS " + name
+                                   + " ON waste_wrangler." + table
+                                   + " (" + columns + ")")
+                if exclusion:
+                    cursor.execute(_TRIP_WINDOWS)
+                for table in sorted({table for _, table, _ in _INDEXES}):
+                    cursor.execute("ANALYZE waste_wrangler." + table)
+            return True
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return False
 
-        Return the number of re-routed trips.
+    @contextmanager
+    def unit_of_work(self) -> Iterator[UnitOfWork]:
+        """Run the method calls made by this thread within the block in one
+        transaction, committed once when the block exits, and yield it.
 
-        Don't worry about too many trips arriving at the same time to the same
-        facility. Each facility has ample receiving facility.
+        Each call still succeeds or fails as a whole: it runs in a savepoint,
+        and if it fails, only its own work is rolled back and the unit goes
+        on. Trips inserted within the unit are added to <components> once the
+        unit has been committed. A unit_of_work entered within another one
+        joins it.
 
-        Your method should NOT return an error. If an error occurs, your method
-        should simply return 0 i.e., no trips have been re-routed.
+        While the unit is open, it holds one connection: with a single
+        connection, the calls of other threads wait until it is committed.
 
-        While a realistic use case will provide a <date> in the near future, our
-        tests could use any valid value for <date>.
+        If the block raises, everything done within it is rolled back and the
+        error is raised again. If the commit fails, nothing is committed and
+        the unit's <committed> stays False; no error is raised.
 
-        Assume this happens before any of the trips have reached <fid>.
+        >>> ww = WasteWrangler()
+        >>> ww.connect("csc343h-marinat", "marinat", "")
+        True
+        >>> with ww.unit_of_work() as unit:
+        ...     ww.schedule_trip(1, dt.datetime(2023, 5, 4, 8, 0))
+        ...     ww.schedule_trips(2, dt.date(2023, 5, 4))
+        True
+        3
+        >>> unit.committed
+        True
         """
-        try:
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select wastetype from waste_wrangler.facility where fid = '" + str(fid) + "'"
-
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            wasteType = data[0][0]
+        unit = getattr(self._local, "unit", None)
+        if unit is not None:
+            yield unit
+            return
+
+        self._local.new_pairs = []
+        with self._session() as connection:
+            unit = UnitOfWork(connection)
+            self._local.unit = unit
+            try:
+                yield unit
+            except BaseException:
+                self._listening.discard(connection)
+                if not connection.closed:
+                    connection.rollback()
+                raise
+            finally:
+                self._local.unit = None
+            try:
+                _commit(connection)
+                unit.committed = True
+            except pg.Error as ex:
+                # You may find it helpful to uncomment this line while
+                # debugging, as it will show you all the details of the error
+                # that occurred:
+                # raise ex
+                self._listening.discard(connection)
+                if not connection.closed:
+                    connection.rollback()
+        if unit.committed:
+            self._apply_new_pairs()
+        else:
+            self._local.new_pairs = []
 
-            cur = date + dt.timedelta(days=1)
-            #     Find fid from wastetype
-            connection = self.connection
-            cursor = connection.cursor()
-            sql = "select fid from waste_wrangler.facility where wastetype = '" + str(wasteType) + "'"
-
-            cursor.execute(sql)
-            data = cursor.fetchall()
-            fids = []
-            for d in data:
-                if d[0] not in fids and d[0] != fid:
-                    fids.append(d[0])
-            if len(fids) == 0:
-                return 0
+    # =========================== Helper methods ============================= #
 
-            # Find fid
+    def _update_technicians_bulk(self, qualifications_file: TextIO) -> int:
+        """Helper for update_technicians in bulk mode."""
+        try:
+            with self._transaction() as connection:
+                cursor = connection.cursor()
+                cursor.execute(_CREATE_QUALIFICATION_STAGING)
+                cursor.copy_expert(_COPY_QUALIFICATIONS, _CopyStream(
+                    (fname + " " + lname, trucktype) for fname, lname, trucktype
+                    in self._iter_qualifications_file(qualifications_file)
+                ))
+                self.statements.execute(cursor, _INSERT_STAGED_TECHNICIANS)
+                return cursor.rowcount
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
 
-            connection = self.connection
-            expect_day_after = date + dt.timedelta(days=1)
-            expect_day_before = date - dt.timedelta(days=1)
+    @contextmanager
+    def _transaction(self, isolation: Optional[str] = None
+                     ) -> Iterator[pg_ext.connection]:
+        """Check out a connection for one method call and yield it.
+
+        The work done on the connection is committed if the block exits
+        normally and rolled back if it raises. Within a unit_of_work, the
+        block runs in a savepoint of the unit's transaction instead, and only
+        its own work is rolled back if it raises.
+
+        Outside a unit_of_work, the transaction runs with the characteristics
+        <isolation>, such as "REPEATABLE READ, READ ONLY", if they are given,
+        set before anything else runs on the connection. Within one, they are
+        ignored, as the unit's transaction has already begun.
+
+        Trips recorded with _trip_added are applied to <components> once the
+        transaction has been committed, and notifications of changes to the
+        reference tables received on the connection are applied to
+        <reference> before the block runs.
+        """
+        unit = getattr(self._local, "unit", None)
+        if unit is not None:
+            connection = unit.connection
+            unit.calls += 1
+            pairs = len(self._local.new_pairs)
             cursor = connection.cursor()
-            sql = "select * from waste_wrangler.trip where fid = '" + str(fid) + "' and ttime > '" + str(date) + "' and ttime < '" + str(expect_day_after) + "'"
-            cursor.execute(sql)
-            data = cursor.fetchall()
-
-            if len(data) != 0:
-                # Update data
-                sql = "UPDATE waste_wrangler.trip set fid = " + str(fids[0]) + " where rid = " + str(data[0][1]) + " and ttime = '" + data[0][2].strftime("%Y-%m-%d %H:%M:%S") + "'"
+            try:
+                cursor.execute("SAVEPOINT ww_call")
+                self._listen(connection)
+                yield connection
+                cursor.execute("RELEASE SAVEPOINT ww_call")
+            except BaseException:
+                unit.failed += 1
+                del self._local.new_pairs[pairs:]
+                #     Rolling back to the savepoint also undoes a LISTEN
+                #     issued within it.
+                self._listening.discard(connection)
+                if not connection.closed:
+                    cursor.execute("ROLLBACK TO SAVEPOINT ww_call")
+                raise
+            return
+
+        self._local.new_pairs = []
+        with self._session() as connection:
+            try:
+                if isolation is not None:
+                    connection.cursor().execute(
+                        "SET TRANSACTION ISOLATION LEVEL " + isolation)
+                self._listen(connection)
+                yield connection
+                _commit(connection)
+            except BaseException:
+                self._listening.discard(connection)
+                if not connection.closed:
+                    connection.rollback()
+                raise
+        self._apply_new_pairs()
+
+    @contextmanager
+    def _session(self) -> Iterator[pg_ext.connection]:
+        """Check out a connection and yield it, to be left with no open
+        transaction by the block.
+
+        With a single connection, blocks run on different threads are
+        serialized; with a pool, each block gets its own connection and
+        returns it to the pool afterwards.
+        """
+        if self.pool is None:
+            with self._lock:
                 connection = self.connection
-                cursor = connection.cursor()
-                cursor.execute(sql)
-                connection.commit()
-
-            return len(data)
-        except pg.Error as ex:
-                # You may find it helpful to uncomment this line while debugging,
-                # as it will show you all the details of the error that occurred:
-                # raise ex
-                return 0
+                if (self.instrumentation is not None
+                        or self.slow_queries is not None):
+                    connection.cursor_factory = _InstrumentedCursor
+                yield connection
+            return
+
+        with self._slots:
+            connection = self._checkout()
+            if (self.instrumentation is not None
+                    or self.slow_queries is not None):
+                connection.cursor_factory = _InstrumentedCursor
+            try:
+                yield connection
+            finally:
+                self._last_used[id(connection)] = monotonic()
+                self.pool.putconn(connection, close=bool(connection.closed))
+
+    def _lookup(self, cursor: pg_ext.cursor, kind: str,
+                key: object) -> list[tuple]:
+        """Return the rows of the reference data lookup <kind> for <key>, from
+        <reference> or else read using <cursor>.
+        """
+        def load() -> list[tuple]:
+            self.statements.execute(cursor, _REFERENCE_LOOKUPS[kind][0],
+                                    (key,))
+            return cursor.fetchall()
+        return self.reference.get(kind, key, load)
+
+    def _listen(self, connection: pg_ext.connection) -> None:
+        """If <reference> listens for changes, make sure <connection> listens
+        on ww_reference, and invalidate <reference> for every notification
+        <connection> has received.
+
+        LISTEN takes effect when the transaction on <connection> commits.
+        """
+        reference = self.reference
+        if not reference.listen:
+            return
+        if connection not in self._listening:
+            connection.cursor().execute("LISTEN ww_reference")
+            self._listening.add(connection)
+        connection.poll()
+        while connection.notifies:
+            reference.invalidate(connection.notifies.pop(0).payload)
+
+    def _load_components(self, connection: pg_ext.connection
+                         ) -> ComponentIndex:
+        """Return a ComponentIndex of every distinct pair of employees who
+        have been on a trip together, streamed from <connection> <itersize>
+        pairs at a time.
+        """
+        components = ComponentIndex()
+        for eid1, eid2 in self.statements.stream(
+                connection, _WORKMATE_PAIRS, (), self.itersize):
+            components.add(eid1, eid2)
+        return components
+
+    def _schedule_maintenance_days(self, cursor: pg_ext.cursor,
+                                   date: dt.date,
+                                   trucks: list[tuple[int, list[int]]],
+                                   booked: set[tuple[int, dt.date]],
+                                   busy: set[tuple[int, dt.date]]
+                                   ) -> list[tuple[int, int, dt.date]]:
+        """Helper for schedule_maintenance. Return the (tID, eID, day) of the
+        maintenance scheduled after <date> for each (tID, qualified eIDs) in
+        <trucks>, as _solve_maintenance schedules it, reading the bookings
+        using <cursor>. The (eID, day) in <booked> and (tID, day) in <busy>
+        are treated as booked too.
+
+        The trucks are assigned one horizon of days at a time, loading the
+        bookings for each horizon as it is reached.
+        """
+        eids = list({eid for _, eids in trucks for eid in eids})
+        booked, busy, scheduled = set(booked), set(busy), []
+        first = date + dt.timedelta(days=1)
+        while trucks:
+            last = first + dt.timedelta(days=_MAINTENANCE_HORIZON - 1)
+            self.statements.execute(cursor, _TECHNICIAN_DAYS,
+                                    (eids, first, last))
+            booked.update(cursor.fetchall())
+            self.statements.execute(cursor, _TRUCK_DAYS, (
+                [tid for tid, _ in trucks], first, last
+            ))
+            busy.update(cursor.fetchall())
+            trucks = _solve_maintenance(trucks, booked, busy, first, last,
+                                        scheduled)
+            first = last + dt.timedelta(days=1)
+        return scheduled
+
+    def _place_trips(self, cursor: pg_ext.cursor,
+                     requests: list[tuple[int, dt.datetime]],
+                     days: list[dt.date],
+                     routes: dict[int, tuple[dt.timedelta, Optional[int],
+                                             list[tuple[int, str]]]]
+                     ) -> list[Optional[tuple[int, int, dt.datetime,
+                                              int, int, int]]]:
+        """Helper for schedule_trip_many. Return the trip placed for each of
+        <requests> on <days>, with the given <routes>, as _place_trip would
+        place it, or None, after locking the resources of the trips using
+        <cursor>.
+
+        Each day is built once. Resources locked by another transaction are
+        excluded from their day, the trips placed since it was built are
+        undone, and the requests placed again without them.
+        """
+        self.statements.execute(cursor, _DAY_TRIPS, (days,))
+        trips = {day: [] for day in days}
+        for day, *trip in cursor:
+            trips[day].append(tuple(trip))
+        self.statements.execute(cursor, _DAY_MAINTENANCE, (days,))
+        maintained = {day: set() for day in days}
+        for tid, day in cursor:
+            maintained[day].add(tid)
+        self.statements.execute(cursor, _EMPLOYEES_DRIVING)
+        employees = [(eid, set(driven)) for eid, driven in cursor]
+        candidates = {id(route[2]): route[2] for route in routes.values()}
+        tids = sorted({tid for trucks in candidates.values()
+                       for tid, _ in trucks})
+
+        availability = {}
+        for day in days:
+            availability[day] = (DayAvailability or _DayTrips)(
+                day, _TRIP_GAP, tids, employees)
+            availability[day].book_many(trips[day])
+            availability[day].exclude(maintained[day])
+            availability[day].checkpoint()
+        while True:
+            placed = [
+                _place_trip(rid, time, routes.get(rid),
+                            availability[time.date()])
+                for rid, time in requests
+            ]
+            newly_held = self._claim(cursor, [
+                resource for trip in placed if trip is not None
+                for resource in _trip_resources(trip)
+            ])
+            if not newly_held:
+                return placed
+            for day in days:
+                availability[day].rollback()
+            for kind, resource, day in newly_held:
+                availability[day].exclude(
+                    {resource} if kind == _LOCK_TRUCK else set(),
+                    {resource} if kind == _LOCK_EMPLOYEE else set(),
+                    {resource} if kind == _LOCK_ROUTE else set()
+                )
+
+    def _insert_trips(self, cursor: pg_ext.cursor,
+                      trips: list[tuple[int, int, dt.datetime, int, int, int]],
+                      whole_day: bool = False) -> bool:
+        """Insert every (rID, tID, tTime, eID, eID, fID) in <trips> with one
+        statement, using <cursor>, unless any of them conflicts with a trip
+        or maintenance recorded since it was planned. Return whether they
+        were inserted.
+
+        A trip conflicts with another on its route that day, and with one
+        that shares its truck or an employee that day if <whole_day> is True,
+        or else within _TRIP_GAP of it.
+        """
+        self.statements.execute(cursor, _INSERT_TRIPS, (
+            [trip[0] for trip in trips], [trip[1] for trip in trips],
+            [trip[2] for trip in trips],
+            [max(trip[3], trip[4]) for trip in trips],
+            [min(trip[3], trip[4]) for trip in trips],
+            [trip[5] for trip in trips], _TRIP_GAP, whole_day
+        ))
+        if cursor.rowcount < len(trips):
+            return False
+        for trip in trips:
+            self._trip_added(trip[3], trip[4])
+        return True
+
+    def _claim(self, cursor: pg_ext.cursor,
+               resources: Iterable[tuple[int, int, Optional[dt.date]]]
+               ) -> set[tuple[int, int, Optional[dt.date]]]:
+        """Lock each (kind, resource, day) in <resources> that no other
+        transaction holds until the end of the transaction, using <cursor>,
+        and return the ones another transaction holds.
+        """
+        resources = list(set(resources))
+        if not resources:
+            return set()
+        self.statements.execute(cursor, _CLAIM, (
+            [kind for kind, _, _ in resources],
+            [resource for _, resource, _ in resources],
+            [day for _, _, day in resources]
+        ))
+        return set(cursor.fetchall())
+
+    def _trip_added(self, eid1: int, eid2: int) -> None:
+        """Record that the current transaction inserted a trip taken together
+        by <eid1> and <eid2>.
+        """
+        if self.components is not None:
+            self._local.new_pairs.append((eid1, eid2))
 
-    # =========================== Helper methods ============================= #
+    def _apply_new_pairs(self) -> None:
+        """Add the trips recorded by _trip_added in the transaction that was
+        just committed to <components>.
+        """
+        pairs, self._local.new_pairs = self._local.new_pairs, []
+        if pairs:
+            with self._lock:
+                if self.components is not None:
+                    for eid1, eid2 in pairs:
+                        self.components.add(eid1, eid2)
+
+    def _checkout(self) -> pg_ext.connection:
+        """Return a healthy connection from <pool>.
+
+        Connections that were closed or lost track of their transaction are
+        discarded, and connections idle for longer than _POOL_PING_AFTER
+        seconds must answer a trivial query before they are reused.
+        """
+        while True:
+            connection = self.pool.getconn()
+            status = connection.get_transaction_status()
+            healthy = (not connection.closed
+                       and status != pg_ext.TRANSACTION_STATUS_UNKNOWN)
+            now = monotonic()
+            idle = now - self._last_used.get(id(connection), now)
+            try:
+                if healthy and status != pg_ext.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                if healthy and idle > _POOL_PING_AFTER:
+                    cursor = connection.cursor()
+                    cursor.execute("SELECT 1")
+                    connection.rollback()
+            except pg.Error:
+                healthy = False
+            if healthy:
+                return connection
+            self._last_used.pop(id(connection), None)
+            self.pool.putconn(connection, close=True)
 
     @staticmethod
     def _read_qualifications_file(file: TextIO) -> list[list[str, str, str]]:
@@ -962,6 +2881,60 @@ class WasteWrangler:
 
         return result
 
+    @staticmethod
+    def _iter_qualifications_file(file: TextIO
+                                  ) -> Iterator[tuple[str, str, str]]:
+        """Like _read_qualifications_file, but yield each entry of <file> as
+        it is read instead of building a list of all of them.
+
+        Pre-condition:
+            <file> follows the format given on the A2 handout.
+        """
+        name = None
+        for line in file:
+            if not line.strip():
+                continue
+            if name is None:
+                name = line.split()[-2:]
+            else:
+                yield name[0], name[-1], line.strip()
+                name = None
+
+
+class _CopyStream:
+    """A read-only file whose contents are the rows of an iterable, in the
+    text format of COPY ... FROM STDIN, produced only as they are read.
+    """
+    _rows: Iterator[tuple]
+    _buffer: str
+
+    def __init__(self, rows: Iterable[tuple]) -> None:
+        """Initialize a stream of the given <rows>."""
+        self._rows = iter(rows)
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        """Return up to <size> characters of the stream, or all of the rest of
+        it if <size> is negative.
+        """
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += "\t".join(_copy_value(v) for v in row) + "\n"
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _copy_value(value: object) -> str:
+    """Return <value> as a column in the text format of COPY."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
 
 def setup(dbname: str, username: str, password: str, file_path: str) -> None:
     """Set up the testing environment for the database <dbname> using the
@@ -1100,6 +3073,1277 @@ def test_preliminary() -> None:
         ww.disconnect()
 
 
+# The database the tests below load generated data into, and the username and
+# password they connect with. Everything in the database is replaced.
+# TODO: Change these to connect to your own database.
+_TEST_DBNAME = 'postgres'
+_TEST_USER = ''
+_TEST_PASSWORD = ''
+
+
+def _load_test_data(size_name: str, seed: int = 11
+                    ) -> tuple["datagen.DatasetSize", dict[str, list[tuple]]]:
+    """Replace the contents of the test database with a dataset of the size
+    named <size_name> generated from <seed>, and return its size and data.
+
+    Note: make sure that the schema file is in the same directory (folder) as
+    your a2.py file.
+    """
+    import datagen
+    size = datagen.SIZES[size_name]
+    data = datagen.generate(size, seed)
+    datagen.load(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD, data)
+    return size, data
+
+
+def _read_schedule() -> dict[str, list[tuple]]:
+    """Return every row of the Trip and Maintenance relations of the test
+    database, in order.
+    """
+    connection = pg.connect(dbname=_TEST_DBNAME, user=_TEST_USER,
+                            password=_TEST_PASSWORD)
+    try:
+        cursor = connection.cursor()
+        schedule = {}
+        for table in ('trip', 'maintenance'):
+            cursor.execute('SELECT * FROM waste_wrangler.' + table)
+            schedule[table] = sorted(cursor.fetchall(), key=repr)
+        return schedule
+    finally:
+        connection.close()
+
+
+def _run_calls(calls: list[tuple[str, tuple]]) -> list:
+    """Return the result of calling each (method name, arguments) in <calls>,
+    in order, on a WasteWrangler connected to the test database.
+    """
+    ww = WasteWrangler()
+    try:
+        assert ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD), \
+            "[Connected] Expected True | Got False."
+        return [getattr(ww, method)(*args) for method, args in calls]
+    finally:
+        ww.disconnect()
+
+
+def test_schedule_fleet() -> None:
+    """Test that schedule_fleet schedules the same trips as calling
+    schedule_trips for each truck in ascending order of tID.
+    """
+    size, data = _load_test_data('small')
+    days = [size.end + dt.timedelta(days=i) for i in range(-2, 3)]
+    tids = sorted(row[0] for row in data['truck'])
+
+    expected = _run_calls([('schedule_trips', (tid, day))
+                           for day in days for tid in tids])
+    expected_schedule = _read_schedule()
+    assert any(expected), "[Schedule Fleet] Expected some trips"
+
+    for workers in (None, 2):
+        _load_test_data('small')
+        fleet = _run_calls([('schedule_fleet', (day, workers))
+                            for day in days])
+        scheduled = [fleet[i].get(tid, 0)
+                     for i in range(len(days)) for tid in tids]
+        assert scheduled == expected, \
+            f"[Schedule Fleet] Expected {expected}, Got {scheduled}"
+        schedule = _read_schedule()
+        assert schedule == expected_schedule, \
+            "[Schedule Fleet] Expected the trips of schedule_trips"
+
+
+def test_schedule_trip_many() -> None:
+    """Test that schedule_trip_many schedules the same trips as calling
+    schedule_trip for each request in order, with the NumPy availability and
+    without it.
+    """
+    global DayAvailability
+    size, data = _load_test_data('small')
+    rand = random.Random(5)
+    days = [size.end + dt.timedelta(days=i) for i in range(-3, 3)]
+    requests = [
+        (rand.randint(0, size.routes + 1), dt.datetime.combine(
+            rand.choice(days),
+            dt.time(rand.randint(6, 16), rand.choice([0, 20, 30]),
+                    rand.choice([0, 0, 0, 15]))))
+        for _ in range(300)
+    ]
+
+    expected = _run_calls([('schedule_trip', request)
+                           for request in requests])
+    expected_schedule = _read_schedule()
+    assert any(expected) and not all(expected), \
+        "[Schedule Trip Many] Expected some requests to succeed and some " \
+        "to fail"
+
+    numpy_availability = DayAvailability
+    try:
+        for availability in (numpy_availability, None):
+            DayAvailability = availability
+            _load_test_data('small')
+            [scheduled] = _run_calls([('schedule_trip_many', (requests,))])
+            assert scheduled == expected, \
+                f"[Schedule Trip Many] Expected {expected}, Got {scheduled}"
+            schedule = _read_schedule()
+            assert schedule == expected_schedule, \
+                "[Schedule Trip Many] Expected the trips of schedule_trip"
+    finally:
+        DayAvailability = numpy_availability
+
+
+def test_concurrent_scheduling() -> None:
+    """Test that WasteWranglers in several processes, scheduling trips and
+    maintenance on the same few days at once, never book a route, truck,
+    employee or technician twice.
+    """
+    import benchmark
+    size, data = _load_test_data('small')
+    requests = benchmark._contended(data, size, 11, 400)
+    workers = 4
+    with ProcessPoolExecutor(workers) as executor:
+        served = list(executor.map(
+            benchmark._stress_worker, [_TEST_DBNAME] * workers,
+            [_TEST_USER] * workers, [_TEST_PASSWORD] * workers,
+            [requests[i::workers] for i in range(workers)]
+        ))
+    scheduled = sum(count for _, _, count in served)
+    assert scheduled > 0, "[Concurrent Scheduling] Expected some trips"
+
+    double_bookings = benchmark._double_bookings(_TEST_DBNAME, _TEST_USER,
+                                                 _TEST_PASSWORD)
+    assert not any(double_bookings.values()), \
+        f"[Concurrent Scheduling] Expected no double bookings, " \
+        f"Got {double_bookings}"
+
+
+def test_async_contention() -> None:
+    """Test that concurrent calls of the AsyncWasteWrangler scheduling
+    methods that compete for the same day place their trips on the resources
+    left free by each other, rather than giving up, without double bookings.
+    """
+    import asyncio
+    import benchmark
+    from async_wrangler import AsyncWasteWrangler
+    size, data = _load_test_data('small')
+    day = size.end + dt.timedelta(days=1)
+    tids = sorted(row[0] for row in data['truck'])
+    rand = random.Random(5)
+    trips = [(rand.choice(data['route'])[0], dt.datetime.combine(
+        day, dt.time(rand.randint(8, 14), rand.choice([0, 30]))))
+        for _ in range(60)]
+
+    async def schedule(calls: list[tuple[str, tuple]]) -> list:
+        aw = AsyncWasteWrangler()
+        assert await aw.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD,
+                                2, 10), "[Connected] Expected True | Got False."
+        try:
+            return await asyncio.gather(*(getattr(aw, method)(*args)
+                                          for method, args in calls))
+        finally:
+            await aw.disconnect()
+
+    for method, args in (('schedule_trips', [(tid, day) for tid in tids]),
+                         ('schedule_trip', trips)):
+        calls = [(method, arguments) for arguments in args]
+        _load_test_data('small')
+        serial = sum(_run_calls(calls))
+        _load_test_data('small')
+        concurrent = sum(asyncio.run(schedule(calls)))
+        #     Locks taken for plans that were dropped are only released when
+        #     their transaction ends, so a few calls may miss resources that
+        #     end up free.
+        assert concurrent >= serial * 3 // 4, \
+            f"[Async Contention] Expected about {serial} from {method}, " \
+            f"Got {concurrent}"
+
+        double_bookings = benchmark._double_bookings(
+            _TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        assert not any(double_bookings.values()), \
+            f"[Async Contention] Expected no double bookings, " \
+            f"Got {double_bookings}"
+
+
+def test_day_availability() -> None:
+    """Test that DayAvailability answers as _DayTrips does, for trips on and
+    off the minute, and that rolling back the trips booked since a
+    checkpoint leaves it as it was built.
+    """
+    if DayAvailability is None:
+        return
+    rand = random.Random(5)
+    day = dt.date(2023, 5, 4)
+    tids = list(range(1, 30))
+    employees = [(eid, {'A', 'B'} if eid % 3 else {'A'})
+                 for eid in range(1, 40)]
+
+    def trip() -> tuple[int, int, dt.datetime, dt.datetime, int, int]:
+        start = dt.datetime.combine(day, dt.time(
+            rand.randint(0, 22), rand.choice([0, 15, 30]),
+            rand.choice([0, 0, 10])))
+        end = start + dt.timedelta(minutes=rand.randint(10, 200))
+        return (rand.randint(1, 50), rand.choice(tids), start, end,
+                rand.choice(employees)[0], rand.choice(employees)[0])
+
+    for _ in range(20):
+        trips = [trip() for _ in range(40)]
+        extra = [trip() for _ in range(40)]
+        built, rolled_back, pure = (
+            availability(day, _TRIP_GAP, tids, employees)
+            for availability in (DayAvailability, DayAvailability, _DayTrips)
+        )
+        for availability in (built, rolled_back, pure):
+            availability.book_many(trips)
+            availability.exclude({tids[0]}, {employees[0][0]}, {50})
+        rolled_back.checkpoint()
+        rolled_back.book_many(extra)
+        rolled_back.rollback()
+        rolled_back.book_many(extra[:5])
+        rolled_back.rollback()
+        assert rolled_back.taken == built.taken == pure.taken, \
+            f"[Day Availability] Expected routes {built.taken}, " \
+            f"Got {rolled_back.taken}"
+
+        for _ in range(50):
+            start = dt.datetime.combine(day, dt.time(rand.randint(1, 21),
+                                                     rand.choice([0, 30])))
+            end = start + dt.timedelta(minutes=90)
+            trucks = [(tid, 'A') for tid in rand.sample(tids, 8)]
+            expected = (pure.free_truck(trucks, start, end),
+                        pure.free_crew('B', start, end))
+            for availability in (built, rolled_back):
+                found = (availability.free_truck(trucks, start, end),
+                         availability.free_crew('B', start, end))
+                assert found == expected, \
+                    f"[Day Availability] Expected {expected}, Got {found}"
+
+
+def test_simulation() -> None:
+    """Test that a Simulation of a snapshot returns the same results as the
+    scheduling methods called on the database, without changing it.
+    """
+    import simulator
+    size, data = _load_test_data('small')
+    rand = random.Random(5)
+    days = [size.end + dt.timedelta(days=i) for i in range(-10, 10)]
+    calls = []
+    for _ in range(200):
+        kind = rand.random()
+        day = rand.choice(days)
+        if kind < 0.5:
+            calls.append(('schedule_trip', (
+                rand.randint(1, size.routes + 1), dt.datetime.combine(
+                    day, dt.time(rand.randint(7, 16), rand.choice([0, 30])))
+            )))
+        elif kind < 0.75:
+            calls.append(('schedule_trips',
+                          (rand.randint(1, size.trucks + 1), day)))
+        elif kind < 0.9:
+            calls.append(('schedule_maintenance', (day,)))
+        else:
+            calls.append(('reroute_waste',
+                          (rand.randint(1, size.facilities + 1), day)))
+
+    before = _read_schedule()
+    ww = WasteWrangler()
+    try:
+        ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        snapshot = simulator.take_snapshot(ww, min(days))
+    finally:
+        ww.disconnect()
+    assert snapshot is not None, "[Take Snapshot] Expected a Snapshot"
+    simulated = simulator.Simulation(snapshot).run(calls)
+    assert _read_schedule() == before, \
+        "[Simulation] Expected the database to be unchanged"
+
+    expected = _run_calls(calls)
+    assert any(expected), "[Simulation] Expected some calls to succeed"
+    assert simulated == expected, \
+        f"[Simulation] Expected {expected}, Got {simulated}"
+
+
+def _load_sparse_test_data(trips: int = 40
+                           ) -> tuple["datagen.DatasetSize",
+                                      dict[str, list[tuple]]]:
+    """Replace the contents of the test database with a small generated
+    dataset that keeps only its first <trips> trips, so that the workmate
+    graph has many components, and return its size and data.
+    """
+    import datagen
+    size, data = _load_test_data('small')
+    data = dict(data, trip=data['trip'][:trips])
+    datagen.load(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD, data)
+    return size, data
+
+
+def test_component_index() -> None:
+    """Test that workmate_sphere answers from the component index as it does
+    from the recursive query, before and after trips are scheduled, and that
+    the trips of a unit_of_work that is rolled back are left out of the
+    index.
+    """
+    size, data = _load_sparse_test_data()
+    eids = [row[0] for row in data['employee']] + [10 ** 6]
+    day = size.start + dt.timedelta(days=7)
+    queried, indexed = WasteWrangler(), WasteWrangler()
+    try:
+        queried.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        indexed.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        assert indexed.enable_component_index(), \
+            "[Component Index] Expected True, Got False"
+
+        def check(step: str) -> dict[int, list[int]]:
+            expected = {eid: sorted(queried.workmate_sphere(eid))
+                        for eid in eids}
+            spheres = {eid: sorted(indexed.workmate_sphere(eid))
+                       for eid in eids}
+            assert spheres == expected, \
+                f"[Component Index] Expected the spheres of the recursive " \
+                f"query {step}"
+            return spheres
+
+        before = check("before scheduling")
+        assert len({tuple(sorted(sphere + [eid]))
+                    for eid, sphere in before.items()}) > 10, \
+            "[Component Index] Expected many components"
+
+        try:
+            with indexed.unit_of_work():
+                for tid in range(1, size.trucks + 1):
+                    indexed.schedule_trips(tid, day)
+                raise KeyError
+        except KeyError:
+            pass
+        assert check("after a unit was rolled back") == before, \
+            "[Component Index] Expected the rolled back trips to be ignored"
+
+        for rid in range(1, size.routes + 1, 3):
+            indexed.schedule_trip(rid, dt.datetime.combine(day,
+                                                           dt.time(9, 0)))
+        with indexed.unit_of_work():
+            for tid in range(1, size.trucks + 1, 2):
+                indexed.schedule_trips(tid, day + dt.timedelta(days=1))
+        assert check("after scheduling trips") != before, \
+            "[Component Index] Expected the new trips to join components"
+    finally:
+        queried.disconnect()
+        indexed.disconnect()
+
+
+def test_workmate_sphere_many() -> None:
+    """Test that workmate_sphere_many reports the spheres workmate_sphere
+    returns and the sizes of their components, for a list of eIDs and for
+    every employee, with the component index and without it.
+    """
+    _, data = _load_sparse_test_data()
+    eids = [row[0] for row in data['employee']]
+    ww = WasteWrangler()
+    try:
+        ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        expected = {eid: sorted(ww.workmate_sphere(eid))
+                    for eid in eids + [10 ** 6]}
+        for indexed in (False, True):
+            if indexed:
+                ww.enable_component_index()
+            for requested in (eids[::7] + [10 ** 6], None):
+                report = ww.workmate_sphere_many(requested)
+                spheres = {eid: sorted(sphere)
+                           for eid, sphere in report.spheres.items()}
+                wanted = {eid: expected[eid]
+                          for eid in (requested or eids)}
+                assert spheres == wanted, \
+                    f"[Workmate Sphere Many] Expected the spheres of " \
+                    f"workmate_sphere, Got {spheres}"
+                sizes = {min(sphere + [eid]): len(sphere) + 1
+                         for eid, sphere in wanted.items()}
+                assert report.component_sizes == sizes, \
+                    f"[Workmate Sphere Many] Expected sizes {sizes}, " \
+                    f"Got {report.component_sizes}"
+    finally:
+        ww.disconnect()
+
+
+def _read_technicians() -> list[tuple]:
+    """Return every row of the Technician relation of the test database, in
+    order.
+    """
+    connection = pg.connect(dbname=_TEST_DBNAME, user=_TEST_USER,
+                            password=_TEST_PASSWORD)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT * FROM waste_wrangler.technician '
+                       'ORDER BY eid, trucktype')
+        return cursor.fetchall()
+    finally:
+        connection.close()
+
+
+def test_update_technicians_bulk() -> None:
+    """Test that update_technicians counts and records the same valid entries
+    in bulk mode as it does entry by entry, for files with unknown names and
+    truck types, titles, drivers and repeated entries, alone and within a
+    unit_of_work.
+    """
+    import io
+    import datagen
+    _, data = _load_test_data('small')
+    files = []
+    for seed in (1, 2):
+        qualifications = io.StringIO()
+        datagen.write_qualifications(data, qualifications, 400, seed)
+        files.append(qualifications.getvalue())
+    expected = None
+    for bulk in (False, True):
+        _load_test_data('small')
+        ww = WasteWrangler()
+        try:
+            ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+            counts = [ww.update_technicians(io.StringIO(files[0]), bulk)]
+            with ww.unit_of_work():
+                counts.extend(ww.update_technicians(io.StringIO(file), bulk)
+                              for file in files)
+        finally:
+            ww.disconnect()
+        if expected is None:
+            expected = counts, _read_technicians()
+            assert 0 < counts[0] < 400 and counts[1] == 0, \
+                f"[Update Technicians] Expected some invalid entries, " \
+                f"Got {counts}"
+        else:
+            assert counts == expected[0], \
+                f"[Update Technicians] Expected {expected[0]}, Got {counts}"
+            assert _read_technicians() == expected[1], \
+                "[Update Technicians] Expected the technicians recorded " \
+                "entry by entry"
+
+
+def _maintenance_day_by_day(date: dt.date) -> list[tuple[int, int, dt.date]]:
+    """Return the (tID, eID, day) of the maintenance schedule_maintenance
+    should schedule after <date> in the test database, found by walking
+    forward one day at a time for each overdue truck, in ascending order of
+    tID, as the docstring of schedule_maintenance describes.
+    """
+    connection = pg.connect(dbname=_TEST_DBNAME, user=_TEST_USER,
+                            password=_TEST_PASSWORD)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SET search_path TO waste_wrangler')
+        cursor.execute('SELECT tid, trucktype FROM truck ORDER BY tid')
+        trucks = cursor.fetchall()
+        scheduled = []
+        for tid, trucktype in trucks:
+            cursor.execute('SELECT count(*) FROM maintenance WHERE tid = %s '
+                           'AND mdate BETWEEN %s AND %s',
+                           (tid, date - dt.timedelta(days=90),
+                            date + dt.timedelta(days=10)))
+            if cursor.fetchone()[0] > 0:
+                continue
+            cursor.execute('SELECT eid FROM technician WHERE trucktype = %s '
+                           'ORDER BY eid', (trucktype,))
+            technicians = [row[0] for row in cursor.fetchall()]
+            if not technicians:
+                continue
+            day = date
+            while True:
+                day += dt.timedelta(days=1)
+                cursor.execute('SELECT count(*) FROM maintenance '
+                               'WHERE tid = %s AND mdate = %s', (tid, day))
+                busy = cursor.fetchone()[0]
+                cursor.execute('SELECT count(*) FROM trip '
+                               'WHERE tid = %s AND ttime::date = %s',
+                               (tid, day))
+                busy += cursor.fetchone()[0]
+                if busy or any(m[0] == tid and m[2] == day
+                               for m in scheduled):
+                    continue
+                cursor.execute('SELECT eid FROM maintenance WHERE mdate = %s',
+                               (day,))
+                booked = {row[0] for row in cursor.fetchall()}
+                booked |= {m[1] for m in scheduled if m[2] == day}
+                eid = next((e for e in technicians if e not in booked), None)
+                if eid is not None:
+                    scheduled.append((tid, eid, day))
+                    break
+        return scheduled
+    finally:
+        connection.close()
+
+
+def test_schedule_maintenance() -> None:
+    """Test that schedule_maintenance schedules the maintenance found by
+    walking forward one day at a time for each overdue truck.
+    """
+    size, _ = _load_test_data('small')
+    dates = [size.start - dt.timedelta(days=5), size.end,
+             size.start + dt.timedelta(days=100),
+             size.start + dt.timedelta(days=104),
+             size.start + dt.timedelta(days=200)]
+    total = 0
+    for date in dates:
+        expected = _maintenance_day_by_day(date)
+        before = set(_read_schedule()['maintenance'])
+        scheduled = _run_calls([('schedule_maintenance', (date,))])[0]
+        added = sorted(set(_read_schedule()['maintenance']) - before)
+        assert scheduled == len(expected), \
+            f"[Schedule Maintenance] Expected {len(expected)} on {date}, " \
+            f"Got {scheduled}"
+        assert added == sorted(expected), \
+            f"[Schedule Maintenance] Expected {sorted(expected)} on " \
+            f"{date}, Got {added}"
+        total += scheduled
+    assert total > 0, "[Schedule Maintenance] Expected some maintenance"
+
+
+def _rerouted(trips: list[tuple], facilities: list[tuple], fids: list[int],
+              start: dt.date, end: dt.date
+              ) -> tuple[list[tuple], dict[int, int]]:
+    """Return the Trip relation <trips> after the trips to each facility in
+    <fids> from <start> to <end> inclusive are moved to the facility in
+    <facilities> with the smallest fID that takes the same waste type and is
+    not in <fids>, in order, and the number of trips moved from each
+    facility.
+    """
+    wastetypes = {fid: wastetype for fid, _, wastetype in facilities}
+    alternatives = {
+        fid: min((other for other, wastetype in wastetypes.items()
+                  if wastetype == wastetypes.get(fid)
+                  and other not in fids), default=None)
+        for fid in fids
+    }
+    moved, counts = [], {fid: 0 for fid in fids}
+    for trip in trips:
+        fid = trip[-1]
+        if (fid in alternatives and alternatives[fid] is not None
+                and start <= trip[2].date() <= end):
+            counts[fid] += 1
+            trip = trip[:-1] + (alternatives[fid],)
+        moved.append(trip)
+    return sorted(moved, key=repr), counts
+
+
+def test_reroute_waste() -> None:
+    """Test that reroute_waste and reroute_waste_many move the trips to the
+    closed facilities to the right ones, and that rerouting one facility for
+    one day with reroute_waste_many is the same as with reroute_waste.
+    """
+    size, data = _load_test_data('small')
+    facilities = data['facility']
+    rand = random.Random(5)
+    days = [size.end - dt.timedelta(days=i) for i in range(20)]
+    total = 0
+    for _ in range(10):
+        fids = rand.sample([row[0] for row in facilities], 3) + [10 ** 6]
+        start = rand.choice(days)
+        end = start + dt.timedelta(days=rand.randint(0, 3))
+        trips, counts = _rerouted(_read_schedule()['trip'], facilities, fids,
+                                  start, end)
+        rerouted = _run_calls([('reroute_waste_many', (fids, start, end))])
+        assert rerouted == [counts], \
+            f"[Reroute Waste Many] Expected {counts}, Got {rerouted[0]}"
+        assert _read_schedule()['trip'] == trips, \
+            "[Reroute Waste Many] Expected the trips to be moved"
+        total += sum(counts.values())
+    assert total > 0, "[Reroute Waste Many] Expected some trips to be moved"
+
+    for _ in range(5):
+        fid = rand.choice(facilities)[0]
+        day = rand.choice(days)
+        _load_test_data('small')
+        trips, counts = _rerouted(_read_schedule()['trip'], facilities,
+                                  [fid], day, day)
+        for call in (('reroute_waste', (fid, day)),
+                     ('reroute_waste_many', ([fid], day, day))):
+            _load_test_data('small')
+            [rerouted] = _run_calls([call])
+            if call[0] == 'reroute_waste':
+                rerouted = {fid: rerouted}
+            assert rerouted == counts, \
+                f"[Reroute Waste] Expected {counts}, Got {rerouted}"
+            assert _read_schedule()['trip'] == trips, \
+                "[Reroute Waste] Expected the trips to be moved"
+
+
+def _execute_elsewhere(sql: str) -> None:
+    """Run <sql> on the test database in a session of its own and commit it.
+    """
+    connection = pg.connect(dbname=_TEST_DBNAME, user=_TEST_USER,
+                            password=_TEST_PASSWORD)
+    try:
+        connection.cursor().execute(sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def test_preload_route_candidates() -> None:
+    """Test that schedule_trip gives the same results with no reference
+    cache, with a cold one and with one filled by preload_route_candidates,
+    when another session changes routes halfway through.
+    """
+    size, _ = _load_test_data('small')
+    rand = random.Random(5)
+    days = [size.end + dt.timedelta(days=i) for i in range(-3, 3)]
+    requests = [
+        (rand.randint(0, size.routes + 1), dt.datetime.combine(
+            rand.choice(days),
+            dt.time(rand.randint(7, 15), rand.choice([0, 30]))))
+        for _ in range(300)
+    ]
+    expected = None
+    for mode in ('none', 'cold', 'preloaded'):
+        _load_test_data('small')
+        ww = WasteWrangler()
+        try:
+            ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+            if mode != 'none':
+                assert ww.enable_reference_cache(listen=True), \
+                    "[Reference Cache] Expected True, Got False"
+            if mode == 'preloaded':
+                loaded = ww.preload_route_candidates()
+                assert loaded == size.routes, \
+                    f"[Preload Route Candidates] Expected {size.routes}, " \
+                    f"Got {loaded}"
+            results = [ww.schedule_trip(*request)
+                       for request in requests[:150]]
+            if mode == 'preloaded':
+                unknown = len({rid for rid, _ in requests[:150]
+                               if not 1 <= rid <= size.routes})
+                assert ww.reference.misses == unknown, \
+                    f"[Preload Route Candidates] Expected {unknown} " \
+                    f"misses, Got {ww.reference.misses}"
+            _execute_elsewhere('UPDATE waste_wrangler.route '
+                               'SET length = length * 3 WHERE rid % 4 = 0')
+            results += [ww.schedule_trip(*request)
+                        for request in requests[150:]]
+        finally:
+            ww.disconnect()
+        if expected is None:
+            expected = results, _read_schedule()
+            assert any(results), \
+                "[Preload Route Candidates] Expected some trips"
+        else:
+            assert results == expected[0], \
+                f"[Preload Route Candidates] Expected {expected[0]} with " \
+                f"the {mode} cache, Got {results}"
+            assert _read_schedule() == expected[1], \
+                f"[Preload Route Candidates] Expected the trips scheduled " \
+                f"without a cache, with the {mode} cache"
+
+
+def test_instrumentation() -> None:
+    """Test that Instrumentation counts the calls of each method, sorts their
+    latencies into the histogram buckets and exports them in the OpenMetrics
+    text format, and that the statements, round trips and commits of the
+    WasteWrangler methods are counted.
+    """
+    import tempfile
+    instrumentation = Instrumentation()
+    counters = {'statements': 2, 'round_trips': 4, 'rows': 1, 'commits': 1}
+    for seconds in (2 ** -10, 2 ** -8, 100.0):
+        instrumentation.record('schedule_trip', counters, seconds)
+    report = instrumentation.report()
+    expected = {'schedule_trip': {'calls': 3, 'statements': 6,
+                                  'round_trips': 12, 'rows': 3, 'commits': 3,
+                                  'seconds': 2 ** -10 + 2 ** -8 + 100.0}}
+    assert report == expected, \
+        f"[Instrumentation] Expected {expected}, Got {report}"
+    buckets = [1, 0, 1] + [0] * (len(_LATENCY_BUCKETS) - 3) + [1]
+    assert instrumentation.histograms['schedule_trip'] == buckets, \
+        f"[Instrumentation] Expected buckets {buckets}, " \
+        f"Got {instrumentation.histograms['schedule_trip']}"
+
+    lines = []
+    for counter, total in (('calls', 3), ('statements', 6),
+                           ('round_trips', 12), ('rows', 3), ('commits', 3)):
+        lines += [f'# TYPE wastewrangler_{counter} counter',
+                  f'wastewrangler_{counter}_total{{method="schedule_trip"}} '
+                  f'{total}']
+    lines += ['# TYPE wastewrangler_call_duration_seconds histogram',
+              '# UNIT wastewrangler_call_duration_seconds seconds']
+    cumulative = [1, 1] + [2] * (len(_LATENCY_BUCKETS) - 2) + [3]
+    for bound, count in zip(_LATENCY_BUCKETS + ('+Inf',), cumulative):
+        lines.append('wastewrangler_call_duration_seconds_bucket'
+                     f'{{method="schedule_trip",le="{bound}"}} {count}')
+    lines += ['wastewrangler_call_duration_seconds_count'
+              '{method="schedule_trip"} 3',
+              'wastewrangler_call_duration_seconds_sum'
+              '{method="schedule_trip"} 100.0048828125', '# EOF']
+    text = '\n'.join(lines) + '\n'
+    assert instrumentation.openmetrics() == text, \
+        f"[Instrumentation] Expected:\n{text}Got:\n" \
+        f"{instrumentation.openmetrics()}"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'wastewrangler.prom')
+        instrumentation.write_openmetrics(path)
+        with open(path) as file:
+            assert file.read() == text, \
+                "[Instrumentation] Expected the file to hold the text"
+        assert os.listdir(directory) == ['wastewrangler.prom'], \
+            f"[Instrumentation] Expected one file, " \
+            f"Got {os.listdir(directory)}"
+
+    size, _ = _load_test_data('small')
+    day = size.end + dt.timedelta(days=1)
+    ww = WasteWrangler()
+    try:
+        ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        instrumentation = ww.enable_instrumentation()
+        for rid in (1, 2, 3, 10 ** 6):
+            ww.schedule_trip(rid, dt.datetime.combine(day, dt.time(9, 0)))
+        ww.workmate_sphere(3)
+        with ww.unit_of_work():
+            ww.schedule_trips(5, day)
+            ww.schedule_trips(6, day)
+    finally:
+        ww.disconnect()
+    report = instrumentation.report()
+    for method, calls in (('schedule_trip', 4), ('workmate_sphere', 1)):
+        totals = report[method]
+        assert totals['calls'] == totals['commits'] == calls, \
+            f"[Instrumentation] Expected {calls} calls and commits of " \
+            f"{method}, Got {totals}"
+        #     Each call also sends a BEGIN ahead of its first statement
+        assert (totals['round_trips']
+                == totals['statements'] + calls + totals['commits']), \
+            f"[Instrumentation] Expected the round trips of {method} to " \
+            f"add up, Got {totals}"
+    totals = report['schedule_trips']
+    assert totals['calls'] == 2 and totals['commits'] == 0 \
+        and totals['rows'] > 0, \
+        f"[Instrumentation] Expected 2 uncommitted calls of " \
+        f"schedule_trips in a unit, Got {totals}"
+
+
+def test_slow_query_explainer() -> None:
+    """Test that the statements of a call slower than the threshold are
+    logged with their plans, that explaining them under EXPLAIN ANALYZE
+    leaves the same rows as not explaining them, and that explaining is
+    rate-limited.
+    """
+    class Plans(logging.Handler):
+        """Keeps the messages logged."""
+        messages: list[str]
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record: logging.LogRecord) -> None:
+            self.messages.append(record.getMessage())
+
+    size, _ = _load_test_data('small')
+    day = size.end + dt.timedelta(days=1)
+    calls = [('schedule_trip', (rid, dt.datetime.combine(day, dt.time(9, 0))))
+             for rid in range(1, 11)] + [('schedule_trips', (5, day)),
+                                         ('schedule_maintenance', (day,))]
+    expected = _run_calls(calls), _read_schedule()
+
+    _load_test_data('small')
+    plans = Plans()
+    _LOG.addHandler(plans)
+    ww = WasteWrangler()
+    try:
+        ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        explainer = ww.enable_slow_query_explain(0.0, 1000.0)
+        results = [getattr(ww, method)(*args) for method, args in calls]
+        assert results == expected[0], \
+            f"[Slow Query Explainer] Expected {expected[0]}, Got {results}"
+        assert _read_schedule() == expected[1], \
+            "[Slow Query Explainer] Expected the explained statements to " \
+            "change nothing"
+        assert explainer.explained == len(plans.messages) > len(calls) \
+            and explainer.skipped == 0, \
+            f"[Slow Query Explainer] Expected every statement explained, " \
+            f"Got {explainer.explained} explained and " \
+            f"{explainer.skipped} skipped"
+        inserts = [message for message in plans.messages
+                   if message.startswith('slow statement in schedule_trip(')
+                   and 'Insert on trip' in message
+                   and 'actual time=' in message]
+        assert inserts, "[Slow Query Explainer] Expected the plan of an " \
+                        "insert of schedule_trip"
+
+        explainer = ww.enable_slow_query_explain(0.0, 2.0)
+        ww.schedule_trips(6, day)
+        assert explainer.explained == 2 and explainer.skipped > 0, \
+            f"[Slow Query Explainer] Expected 2 explained and some " \
+            f"skipped, Got {explainer.explained} and {explainer.skipped}"
+        #     A token comes back every 30 seconds at 2 a minute
+        explainer._refilled -= 30
+        ww.workmate_sphere(5)
+        assert explainer.explained == 3, \
+            f"[Slow Query Explainer] Expected 3 explained after 30 s, " \
+            f"Got {explainer.explained}"
+    finally:
+        _LOG.removeHandler(plans)
+        ww.disconnect()
+
+
+def _test_indexes() -> set[str]:
+    """Return the names of the indexes on the tables of the test database
+    that provision_indexes creates.
+    """
+    connection = pg.connect(dbname=_TEST_DBNAME, user=_TEST_USER,
+                            password=_TEST_PASSWORD)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT indexname FROM pg_indexes "
+                       "WHERE schemaname = 'waste_wrangler' "
+                       "AND indexname LIKE 'ww\\_%'")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        connection.close()
+
+
+def _btree_gist_available() -> bool:
+    """Return whether the btree_gist extension can be installed in the test
+    database.
+    """
+    connection = pg.connect(dbname=_TEST_DBNAME, user=_TEST_USER,
+                            password=_TEST_PASSWORD)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT count(*) FROM pg_available_extensions "
+                       "WHERE name = 'btree_gist'")
+        return cursor.fetchone()[0] > 0
+    finally:
+        connection.close()
+
+
+def test_provision_indexes() -> None:
+    """Test that provision_indexes creates its indexes and can be run again,
+    and that with <exclusion> the database rejects a trip that double-books
+    a truck, or nothing is changed if btree_gist is not available or the
+    trips already double-book someone.
+    """
+    size, data = _load_test_data('small')
+    names = {name for name, _, _ in _INDEXES}
+    trip = data['trip'][0]
+    other = trip[0] % size.routes + 1
+    double_booking = (
+        f"INSERT INTO waste_wrangler.trip VALUES ({other}, {trip[1]}, "
+        f"'{trip[2] + dt.timedelta(minutes=1)}', {trip[3]}, "
+        f"{max(trip[4], trip[5])}, {min(trip[4], trip[5])}, {trip[6]})")
+    ww = WasteWrangler()
+    try:
+        ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        for _ in range(2):
+            assert ww.provision_indexes(), \
+                "[Provision Indexes] Expected True, Got False"
+            assert _test_indexes() == names, \
+                f"[Provision Indexes] Expected {names}, Got {_test_indexes()}"
+
+        excluded = ww.provision_indexes(exclusion=True)
+        if not _btree_gist_available():
+            assert not excluded and _test_indexes() == names, \
+                "[Provision Indexes] Expected False and nothing changed " \
+                "without btree_gist"
+            return
+        assert excluded and ww.provision_indexes(exclusion=True), \
+            "[Provision Indexes] Expected True twice, Got False"
+        try:
+            _execute_elsewhere(double_booking)
+            raise AssertionError("[Provision Indexes] Expected the double "
+                                 "booking to be rejected")
+        except pg.IntegrityError:
+            pass
+        day = size.end + dt.timedelta(days=1)
+        assert ww.schedule_trip(1, dt.datetime.combine(day, dt.time(9, 0))), \
+            "[Provision Indexes] Expected a trip to be scheduled"
+    finally:
+        ww.disconnect()
+
+    _load_test_data('small')
+    _execute_elsewhere(double_booking)
+    ww = WasteWrangler()
+    try:
+        ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        assert not ww.provision_indexes(exclusion=True), \
+            "[Provision Indexes] Expected False with a double booking"
+        assert not _test_indexes(), \
+            "[Provision Indexes] Expected nothing to be changed"
+    finally:
+        ww.disconnect()
+
+
+def test_stream() -> None:
+    """Test that StatementRegistry.stream yields the rows execute returns for
+    the same statement and parameters, including NULL, array, text with a
+    pattern and two-digit parameters, and that it closes its cursor.
+    """
+    import simulator
+    size, data = _load_test_data('small')
+    pattern = _statement('test_stream_pattern', ('text', 'int[]') + (
+        'int',) * 8, """
+        SELECT eid, name FROM waste_wrangler.employee
+        WHERE ($1 IS NULL OR name LIKE $1 || '%') AND eid = ANY($2)
+          AND eid <= $10
+    """)
+    eids = [row[0] for row in data['employee']]
+    tids = [row[0] for row in data['truck']]
+    cases = [
+        (simulator._SNAPSHOT_TRIPS, (None,)),
+        (simulator._SNAPSHOT_TRIPS, (size.end - dt.timedelta(days=5),)),
+        (simulator._SNAPSHOT_MAINTENANCE, (None,)),
+        (simulator._SNAPSHOT_MAINTENANCE, (size.end,)),
+        (_WORKMATE_PAIRS, ()),
+        (_TRUCK_DAYS, (tids[::3], size.end - dt.timedelta(days=9),
+                       size.end)),
+        (_TECHNICIANS_FOR_TYPES, (['T1', 'T2'],)),
+        (pattern, ('Lee', eids) + (0,) * 7 + (100,)),
+        (pattern, (None, eids) + (0,) * 7 + (100,)),
+    ]
+    ww = WasteWrangler()
+    try:
+        ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        with ww._transaction() as connection:
+            cursor = connection.cursor()
+            for name, params in cases:
+                ww.statements.execute(cursor, name, params)
+                expected = sorted(cursor.fetchall(), key=repr)
+                streamed = sorted(ww.statements.stream(connection, name,
+                                                       params, 7), key=repr)
+                assert expected and streamed == expected, \
+                    f"[Stream] Expected the {len(expected)} rows of {name} " \
+                    f"with {params}, Got {len(streamed)}"
+
+            rows = ww.statements.stream(connection, _WORKMATE_PAIRS, (), 7)
+            next(rows)
+            rows.close()
+            cursor.execute('SELECT count(*) FROM pg_cursors')
+            assert cursor.fetchone()[0] == 0, \
+                "[Stream] Expected every server-side cursor to be closed"
+    finally:
+        ww.disconnect()
+
+
+def test_listen_after_failed_call() -> None:
+    """Test that a connection whose LISTEN is rolled back with a failed call
+    in a unit_of_work listens again, so that the reference cache still drops
+    the entries of a route changed by another session.
+    """
+    size, _ = _load_test_data('small')
+    day = dt.datetime.combine(size.end, dt.time(9, 0))
+    ww = WasteWrangler()
+    try:
+        assert ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        assert ww.enable_reference_cache(listen=True)
+        with ww.unit_of_work() as unit:
+            result = ww.reroute_waste(1, 'not a date')
+            assert result == 0, \
+                f"[Listen After Failed Call] Expected 0, Got {result}"
+            ww.schedule_trip(1, day)
+        assert unit.committed and unit.failed == 1, \
+            f"[Listen After Failed Call] Expected 1 failed call, " \
+            f"Got {unit.failed}"
+        misses = ww.reference.misses
+        ww.schedule_trip(1, day)
+        assert ww.reference.misses == misses, \
+            f"[Listen After Failed Call] Expected {misses} misses, " \
+            f"Got {ww.reference.misses}"
+        _execute_elsewhere('UPDATE waste_wrangler.route '
+                           'SET length = length * 2 WHERE rid = 1')
+        ww.schedule_trip(1, day)
+        assert ww.reference.misses > misses, \
+            f"[Listen After Failed Call] Expected more than {misses} " \
+            f"misses, Got {ww.reference.misses}"
+    finally:
+        ww.disconnect()
+
+
+def test_unit_of_work() -> None:
+    """Test that the calls within a unit_of_work are committed together,
+    that a failed call rolls back only its own work, that a nested unit joins
+    the outer one, and that a block that raises rolls back everything.
+    """
+    size, data = _load_test_data('small')
+    day = size.end + dt.timedelta(days=1)
+    tids = sorted(row[0] for row in data['truck'])[:4]
+    calls = [('schedule_trips', (tid, day)) for tid in tids[:2]] + [
+        ('schedule_trip', (1, dt.datetime.combine(day, dt.time(14, 0)))),
+        ('schedule_trips', (tids[2], day)),
+    ]
+    expected = _run_calls(calls)
+    expected_schedule = _read_schedule()
+    assert any(expected), "[Unit Of Work] Expected some trips"
+
+    size, _ = _load_test_data('small')
+    before = _read_schedule()
+    ww = WasteWrangler()
+    try:
+        assert ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        with ww.unit_of_work() as unit:
+            results = [getattr(ww, method)(*args)
+                       for method, args in calls[:2]]
+            try:
+                with ww._transaction() as connection:
+                    cursor = connection.cursor()
+                    cursor.execute("DELETE FROM waste_wrangler.trip")
+                    cursor.execute("SELECT 1 / 0")
+            except pg.Error:
+                pass
+            with ww.unit_of_work() as inner:
+                assert inner is unit, \
+                    "[Unit Of Work] Expected the nested unit to join"
+                results += [getattr(ww, method)(*args)
+                            for method, args in calls[2:]]
+            assert not unit.committed and _read_schedule() == before, \
+                "[Unit Of Work] Expected nothing committed within the unit"
+        assert results == expected, \
+            f"[Unit Of Work] Expected {expected}, Got {results}"
+        assert _read_schedule() == expected_schedule, \
+            "[Unit Of Work] Expected the schedule of the same calls " \
+            "made one by one"
+        assert (unit.committed, unit.calls, unit.failed) == (True, 5, 1), \
+            f"[Unit Of Work] Expected (True, 5, 1), Got " \
+            f"{(unit.committed, unit.calls, unit.failed)}"
+
+        try:
+            with ww.unit_of_work() as unit:
+                ww.schedule_trips(tids[3], day)
+                raise RuntimeError("abandoned")
+        except RuntimeError:
+            pass
+        assert not unit.committed and unit.failed == 0, \
+            f"[Unit Of Work] Expected an uncommitted unit, Got " \
+            f"{unit.committed} with {unit.failed} failed calls"
+        assert _read_schedule() == expected_schedule, \
+            "[Unit Of Work] Expected everything in the unit rolled back"
+    finally:
+        ww.disconnect()
+
+
+# Let every queued job's lease, or backoff, run out.
+_EXPIRE_JOBS = """
+    UPDATE waste_wrangler.ww_job
+    SET run_after = localtimestamp - interval '1 second'
+    WHERE state = 'queued'
+"""
+
+
+def _job_due(jid: int) -> dt.datetime:
+    """Return when the job <jid> of the test database is due to be claimed.
+    """
+    connection = pg.connect(dbname=_TEST_DBNAME, user=_TEST_USER,
+                            password=_TEST_PASSWORD)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT run_after FROM waste_wrangler.ww_job "
+                       "WHERE jid = %s", (jid,))
+        return cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_job_queue() -> None:
+    """Test that jobs run by a JobWorker give the same results as the same
+    calls made directly, that arguments survive being stored, that a batch
+    with a job that cannot be enqueued is rejected as a whole, and that jobs
+    that raise or are rolled back are retried with exponential backoff.
+    """
+    import json
+    from job_queue import JobQueue, JobWorker, _decode_args, _encode
+
+    size, data = _load_test_data('small')
+    day = size.end + dt.timedelta(days=1)
+    tids = sorted(row[0] for row in data['truck'])[:4]
+    calls = [('schedule_trips', (tid, day)) for tid in tids] + [
+        ('schedule_trip', (1, dt.datetime.combine(day, dt.time(15, 30)))),
+        ('reroute_waste', (1, day)),
+        ('schedule_maintenance', (day,)),
+    ]
+    for method, args in calls:
+        stored = json.loads(json.dumps(args, default=_encode))
+        decoded = _decode_args(method, stored)
+        assert decoded == args, \
+            f"[Job Arguments] Expected {args}, Got {decoded}"
+    for bad in [lambda: _encode(object()),
+                lambda: _decode_args('update_technicians', [])]:
+        try:
+            bad()
+            assert False, "[Job Arguments] Expected an error"
+        except (TypeError, ValueError):
+            pass
+
+    expected = _run_calls(calls)
+    expected_schedule = _read_schedule()
+    assert any(expected), "[Job Queue] Expected some trips"
+
+    _load_test_data('small')
+    ww = WasteWrangler()
+    try:
+        assert ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        queue = JobQueue(ww)
+        assert queue.provision() and queue.provision()
+        for batch in [calls[:1] + [('update_technicians', ())],
+                      calls[:1] + [('schedule_trips', (1, {day}))]]:
+            jids = queue.enqueue_many(batch)
+            assert jids == [0, 0], \
+                f"[Enqueue Many] Expected [0, 0], Got {jids}"
+        assert queue.report() == {}, \
+            f"[Enqueue Many] Expected no jobs, Got {queue.report()}"
+
+        jids = queue.enqueue_many(calls)
+        assert all(jids) and jids == sorted(jids), \
+            f"[Enqueue Many] Expected increasing jIDs, Got {jids}"
+        worker = JobWorker(ww, name='worker', batch=3)
+        attempted = worker.run(idle_timeout=0.2, poll_interval=0.01)
+        jobs = [queue.job(jid) for jid in jids]
+        results = [job.result for job in jobs]
+        assert results == expected, \
+            f"[Job Queue] Expected {expected}, Got {results}"
+        assert _read_schedule() == expected_schedule, \
+            "[Job Queue] Expected the schedule of the same calls " \
+            "made directly"
+        assert (attempted, worker.processed, worker.failed) \
+            == (len(calls), len(calls), 0), \
+            f"[Job Queue] Expected {len(calls)} jobs attempted, Got " \
+            f"{(attempted, worker.processed, worker.failed)}"
+        assert all(job.state == 'done' and job.attempts == 1
+                   and job.worker == 'worker' and job.args == args
+                   for job, (_, args) in zip(jobs, calls)), \
+            "[Job Queue] Expected every job done on its first attempt"
+
+        #     A worker whose calls raise, and a call rolled back after a
+        #     database error, are both retried with exponential backoff
+        worker = JobWorker(ww, name='raising', backoff=100.0)
+        ww.schedule_trips = lambda tid, date: 1 / 0
+        raising = queue.enqueue('schedule_trips', tids[0], day)
+        overflow = queue.enqueue('reroute_waste', 2 ** 40, day)
+        errors = {raising: 'ZeroDivisionError: division by zero',
+                  overflow: 'rolled back after a database error'}
+        for attempt in range(1, 4):
+            assert worker.run_once() == 1 and worker.run_once() == 1, \
+                f"[Job Backoff] Expected 2 jobs run on attempt {attempt}"
+            for jid, error in errors.items():
+                job = queue.job(jid)
+                state = 'queued' if attempt < 3 else 'failed'
+                assert (job.state, job.attempts, job.error) \
+                    == (state, attempt, error), \
+                    f"[Job Backoff] Expected {(state, attempt, error)}, " \
+                    f"Got {(job.state, job.attempts, job.error)}"
+                delay = _job_due(jid) - job.finished
+                seconds = 100.0 * 2 ** (attempt - 1)
+                assert abs(delay.total_seconds() - seconds) < 1, \
+                    f"[Job Backoff] Expected {seconds} seconds, Got {delay}"
+            assert worker.run_once() == 0, \
+                "[Job Backoff] Expected no job due during its backoff"
+            _execute_elsewhere(_EXPIRE_JOBS)
+        assert (worker.processed, worker.failed) == (6, 6), \
+            f"[Job Backoff] Expected (6, 6), Got " \
+            f"{(worker.processed, worker.failed)}"
+        assert worker.run_once() == 0, \
+            "[Job Backoff] Expected no job retried after its last attempt"
+        assert _read_schedule() == expected_schedule, \
+            "[Job Backoff] Expected failed jobs to change nothing"
+    finally:
+        ww.disconnect()
+
+
+def test_job_leases() -> None:
+    """Test that a job claimed by a worker that never commits is claimed by
+    another once its lease runs out, or fails if that was its last attempt,
+    and that a worker whose lease ran out does not run a job claimed again
+    since.
+    """
+    from job_queue import _CLAIM_LEASE, JobQueue, JobWorker
+
+    @contextmanager
+    def lost_connection() -> Iterator[UnitOfWork]:
+        raise pg.OperationalError("server closed the connection")
+        yield
+
+    size, data = _load_test_data('small')
+    day = size.end + dt.timedelta(days=1)
+    tids = sorted(row[0] for row in data['truck'])[:2]
+    expected = _run_calls([('schedule_trips', (tid, day)) for tid in tids])
+    expected_schedule = _read_schedule()
+
+    _load_test_data('small')
+    ww, late = WasteWrangler(), WasteWrangler()
+    try:
+        assert ww.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        assert late.connect(_TEST_DBNAME, _TEST_USER, _TEST_PASSWORD)
+        queue = JobQueue(ww)
+        assert queue.provision()
+        worker = JobWorker(ww, name='worker')
+
+        #     A worker that claims jobs and never commits them
+        dead = JobWorker(late, name='dead', batch=2)
+        late.unit_of_work = lost_connection
+        first = queue.enqueue('schedule_trips', tids[0], day)
+        last = queue.enqueue('schedule_trips', tids[1], day,
+                             max_attempts=1)
+        assert dead.run_once() == 0 and dead.processed == 0, \
+            "[Job Leases] Expected nothing committed by the dead worker"
+        for jid in [first, last]:
+            job = queue.job(jid)
+            assert (job.state, job.attempts, job.worker) \
+                == ('queued', 1, 'dead'), \
+                f"[Job Leases] Expected ('queued', 1, 'dead'), Got " \
+                f"{(job.state, job.attempts, job.worker)}"
+        lease = _job_due(first) - queue.job(first).started
+        assert abs((lease - _CLAIM_LEASE).total_seconds()) < 1, \
+            f"[Job Leases] Expected a lease of {_CLAIM_LEASE}, Got {lease}"
+        assert worker.run_once() == 0, \
+            "[Job Leases] Expected no job claimed during its lease"
+
+        _execute_elsewhere(_EXPIRE_JOBS)
+        assert worker.run_once() == 1, \
+            "[Job Leases] Expected the first job claimed again"
+        job = queue.job(first)
+        assert (job.state, job.attempts, job.worker, job.result) \
+            == ('done', 2, 'worker', expected[0]), \
+            f"[Job Leases] Expected ('done', 2, 'worker', " \
+            f"{expected[0]}), Got " \
+            f"{(job.state, job.attempts, job.worker, job.result)}"
+        assert worker.run_once() == 0, \
+            "[Job Leases] Expected the last job not attempted again"
+        job = queue.job(last)
+        assert (job.state, job.attempts, job.error) \
+            == ('failed', 1, 'abandoned on its last attempt'), \
+            f"[Job Leases] Expected the last attempt abandoned, Got " \
+            f"{(job.state, job.attempts, job.error)}"
+
+        #     A worker that locks its claimed job only after its lease ran
+        #     out and another worker claimed the job again
+        real_unit_of_work = ww.unit_of_work
+
+        @contextmanager
+        def overtaken() -> Iterator[UnitOfWork]:
+            _execute_elsewhere(_EXPIRE_JOBS)
+            assert dead.run_once() == 0, \
+                "[Job Leases] Expected nothing committed by the dead worker"
+            with real_unit_of_work() as unit:
+                yield unit
+
+        ww.unit_of_work = overtaken
+        slow = JobWorker(ww, name='slow')
+        jid = queue.enqueue('schedule_trips', tids[1], day)
+        assert slow.run_once() == 0 and slow.processed == 0, \
+            "[Job Leases] Expected the overtaken worker to run nothing"
+        del ww.unit_of_work
+        job = queue.job(jid)
+        assert (job.state, job.attempts, job.worker) \
+            == ('queued', 2, 'dead'), \
+            f"[Job Leases] Expected ('queued', 2, 'dead'), Got " \
+            f"{(job.state, job.attempts, job.worker)}"
+
+        _execute_elsewhere(_EXPIRE_JOBS)
+        assert worker.run_once() == 1, \
+            "[Job Leases] Expected the job claimed a third time"
+        job = queue.job(jid)
+        assert (job.state, job.attempts, job.worker, job.result) \
+            == ('done', 3, 'worker', expected[1]), \
+            f"[Job Leases] Expected ('done', 3, 'worker', " \
+            f"{expected[1]}), Got " \
+            f"{(job.state, job.attempts, job.worker, job.result)}"
+        assert _read_schedule() == expected_schedule, \
+            "[Job Leases] Expected every job run exactly once"
+    finally:
+        ww.disconnect()
+        late.disconnect()
+
+
 if __name__ == '__main__':
     # Un comment-out the next two lines if you would like to run the doctest
     # examples (see ">>>" in the methods connect and disconnect)
@@ -1109,3 +4353,23 @@ if __name__ == '__main__':
     # TODO: Put your testing code here, or call testing functions such as
     #   this one:
     test_preliminary()
+    test_schedule_fleet()
+    test_schedule_trip_many()
+    test_concurrent_scheduling()
+    test_async_contention()
+    test_day_availability()
+    test_simulation()
+    test_component_index()
+    test_workmate_sphere_many()
+    test_update_technicians_bulk()
+    test_schedule_maintenance()
+    test_reroute_waste()
+    test_preload_route_candidates()
+    test_instrumentation()
+    test_slow_query_explainer()
+    test_provision_indexes()
+    test_stream()
+    test_listen_after_failed_call()
+    test_unit_of_work()
+    test_job_queue()
+    test_job_leases()
@@ -0,0 +1,708 @@
+"""An asyncio counterpart of WasteWrangler
+
+=== Module Description ===
+
+This file contains the AsyncWasteWrangler class, which offers the methods of
+WasteWrangler as coroutines so that they do not block an event loop, and the
+AsyncConnectionPool it runs them on.
+
+Connections are psycopg2 connections in asynchronous mode, driven by the
+event loop, so no other database driver is needed. Such connections are
+always in autocommit mode: every method reads what it needs with statements
+that are independent of each other, running them concurrently on different
+connections of the pool, and then makes all of its changes with a single
+statement, which is atomic on its own.
+
+The scheduling methods lock the resources they book as WasteWrangler does,
+in a short transaction on one connection around that statement: resources
+another transaction holds are passed over and the plan is made again without
+them, and the statement checks again that none of them was booked since it
+was read. If one was, the method reads again on that connection, keeping the
+locks it has taken, and plans again, at most _CLAIM_ATTEMPTS times. A method
+never waits for another connection of the pool while it holds one for a
+transaction, so that callers holding every connection cannot wait on each
+other.
+"""
+
+import asyncio
+import datetime as dt
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import AsyncIterator, Optional, TextIO
+
+import psycopg2 as pg
+import psycopg2.extensions as pg_ext
+
+from a2 import (WasteWrangler, _CLAIM, _CLAIM_ATTEMPTS, _INSERT_MAINTENANCE,
+                _INSERT_TRIPS, _LOCK_EMPLOYEE, _LOCK_OVERDUE, _LOCK_ROUTE,
+                _LOCK_TECHNICIAN, _LOCK_TRUCK, _MAINTENANCE_HORIZON,
+                _OVERDUE_TRUCKS, _POOL_PING_AFTER, _REF_ROUTE_CANDIDATES,
+                _REROUTE, _SHIFT_END, _SHIFT_START, _SPHERE, _STATEMENTS,
+                _TECHNICIAN_DAYS, _TRIP_CLAIM, _TRIP_DURATION, _TRIP_GAP,
+                _TRUCK_DAYS, _pick_crew, _plan_day, _solve_maintenance,
+                _statement, _trip_resources)
+
+
+# ------------------------------ schedule_trips ------------------------------ #
+
+# The truck type of truck $1, and whether it has a trip or maintenance on $2.
+_TRUCK_DAY = _statement("truck_day", ("int", "date"), """
+    SELECT tk.trucktype,
+           EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                   WHERE t.tid = tk.tid
+                     AND t.ttime >= $2 AND t.ttime < $2 + 1)
+           OR EXISTS (SELECT 1 FROM waste_wrangler.maintenance m
+                      WHERE m.tid = tk.tid AND m.mdate = $2)
+    FROM waste_wrangler.truck tk
+    WHERE tk.tid = $1
+""")
+
+# The routes with no trip on $2 that truck $1 can carry, in ascending order of
+# rID, with their durations and lowest-fID facilities.
+_TRUCK_OPEN_ROUTES = _statement("truck_open_routes", ("int", "date"), """
+    SELECT r.rid, """ + _TRIP_DURATION + """,
+           (SELECT min(f.fid) FROM waste_wrangler.facility f
+            WHERE f.wastetype = r.wastetype)
+    FROM waste_wrangler.route r
+    WHERE r.wastetype IN (SELECT tt.wastetype
+                          FROM waste_wrangler.trucktype tt
+                               JOIN waste_wrangler.truck tk
+                               ON tk.trucktype = tt.trucktype
+                          WHERE tk.tid = $1)
+      AND NOT EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                      WHERE t.rid = r.rid
+                        AND t.ttime >= $2 AND t.ttime < $2 + 1)
+    ORDER BY r.rid
+""")
+
+# The employees with no trip on $2 in order of preference, and whether each
+# can drive truck $1.
+_TRUCK_FREE_EMPLOYEES = _statement("truck_free_employees", ("int", "date"), """
+    SELECT e.eid,
+           EXISTS (SELECT 1 FROM waste_wrangler.driver d
+                        JOIN waste_wrangler.truck tk
+                        ON tk.trucktype = d.trucktype
+                   WHERE d.eid = e.eid AND tk.tid = $1)
+    FROM waste_wrangler.employee e
+    WHERE NOT EXISTS (SELECT 1 FROM waste_wrangler.trip t
+                      WHERE (t.eid1 = e.eid OR t.eid2 = e.eid)
+                        AND t.ttime >= $2 AND t.ttime < $2 + 1)
+    ORDER BY e.hiredate, e.eid
+""")
+
+# ---------------------------- update_technicians ---------------------------- #
+
+# The eID of each employee named in $1, and whether they are a driver.
+_EMPLOYEES_BY_NAMES = _statement("employees_by_names", ("text[]",), """
+    SELECT e.name, e.eid,
+           EXISTS (SELECT 1 FROM waste_wrangler.driver d WHERE d.eid = e.eid)
+    FROM waste_wrangler.employee e
+    WHERE e.name = ANY($1)
+""")
+
+_TRUCK_TYPES_IN = _statement("truck_types_in", ("text[]",), """
+    SELECT DISTINCT trucktype FROM waste_wrangler.trucktype
+    WHERE trucktype = ANY($1)
+""")
+
+# The truck types each employee named in $1 is already a technician for.
+_TECHNICIANS_BY_NAMES = _statement("technicians_by_names", ("text[]",), """
+    SELECT t.eid, t.trucktype
+    FROM waste_wrangler.technician t
+         JOIN waste_wrangler.employee e ON e.eid = t.eid
+    WHERE e.name = ANY($1)
+""")
+
+_INSERT_TECHNICIANS = _statement("insert_technicians", ("int[]", "text[]"), """
+    INSERT INTO waste_wrangler.technician(eid, trucktype)
+    SELECT * FROM unnest($1, $2)
+""")
+
+# --------------------------- schedule_maintenance --------------------------- #
+
+# The technicians qualified for the truck type of each truck _OVERDUE_TRUCKS
+# returns for $1, in ascending order of eID.
+_OVERDUE_TECHNICIANS = _statement("overdue_technicians", ("date",), """
+    SELECT t.trucktype, t.eid
+    FROM waste_wrangler.technician t
+    WHERE t.trucktype IN (
+        SELECT tk.trucktype FROM waste_wrangler.truck tk
+        WHERE NOT EXISTS (SELECT 1 FROM waste_wrangler.maintenance m
+                          WHERE m.tid = tk.tid
+                            AND m.mdate >= $1 - 90 AND m.mdate <= $1 + 10))
+    ORDER BY t.eid
+""")
+
+
+async def _wait(connection: pg_ext.connection) -> None:
+    """Wait until the asynchronous <connection> has finished connecting or
+    running its current statement, without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        state = connection.poll()
+        if state == pg_ext.POLL_OK:
+            return
+        ready = loop.create_future()
+        fileno = connection.fileno()
+        if state == pg_ext.POLL_READ:
+            loop.add_reader(fileno, _resolve, ready)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fileno)
+        elif state == pg_ext.POLL_WRITE:
+            loop.add_writer(fileno, _resolve, ready)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fileno)
+        else:
+            raise pg.OperationalError("unexpected poll state " + str(state))
+
+
+def _resolve(future: asyncio.Future) -> None:
+    """Mark <future> as done, unless it already is."""
+    if not future.done():
+        future.set_result(None)
+
+
+class _AsyncConnection:
+    """A psycopg2 connection in asynchronous mode, with the statements
+    registered with _statement that have been prepared on it.
+
+    === Instance Attributes ===
+    raw: the psycopg2 connection.
+    prepared: the names of the statements prepared on <raw>.
+    last_used: the monotonic time at which <raw> was last returned to its
+    pool.
+    """
+    raw: pg_ext.connection
+    prepared: set[str]
+    last_used: float
+
+    def __init__(self, raw: pg_ext.connection) -> None:
+        """Initialize a connection wrapping the connected <raw>."""
+        self.raw = raw
+        self.prepared = set()
+        self.last_used = monotonic()
+
+    async def execute(self, sql: str, params: tuple = ()) -> pg_ext.cursor:
+        """Run <sql> with <params> and return a cursor over its result."""
+        cursor = self.raw.cursor()
+        cursor.execute(sql, params)
+        await _wait(self.raw)
+        return cursor
+
+    async def run(self, name: str, params: tuple = ()) -> pg_ext.cursor:
+        """Run the statement <name> with <params>, preparing it first if this
+        is its first use on this connection, and return a cursor over its
+        result.
+        """
+        if name not in self.prepared:
+            types, sql = _STATEMENTS[name]
+            signature = " (" + ", ".join(types) + ")" if types else ""
+            await self.execute("PREPARE ww_" + name + signature + " AS " + sql)
+            self.prepared.add(name)
+        sql = "EXECUTE ww_" + name
+        if params:
+            sql += " (" + ", ".join(["%s"] * len(params)) + ")"
+        return await self.execute(sql, params)
+
+    def healthy(self) -> bool:
+        """Return whether this connection can be handed out again."""
+        return not self.raw.closed and not self.raw.isexecuting()
+
+
+class AsyncConnectionPool:
+    """A pool of between <minconn> and <maxconn> asynchronous connections.
+
+    Callers wait for a connection when all <maxconn> are in use. Connections
+    are opened as they are needed, and those idle for longer than
+    _POOL_PING_AFTER seconds must answer a trivial query before they are
+    reused.
+
+    === Instance Attributes ===
+    minconn: the number of connections opened up front.
+    maxconn: the largest number of connections open at once.
+    closed: whether the pool was closed. Connections returned to a closed
+    pool are closed rather than kept.
+
+    Representation invariants:
+    - len(_idle) <= maxconn
+    - _idle == [] if closed
+    """
+    minconn: int
+    maxconn: int
+    closed: bool
+    _kwargs: dict[str, str]
+    _idle: list[_AsyncConnection]
+    _slots: asyncio.Semaphore
+
+    def __init__(self, minconn: int, maxconn: int, **kwargs: str) -> None:
+        """Initialize a pool of connections made with the keyword arguments
+        <kwargs> of psycopg2.connect.
+        """
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.closed = False
+        self._kwargs = kwargs
+        self._idle = []
+        self._slots = asyncio.Semaphore(maxconn)
+
+    async def open(self) -> None:
+        """Open the first <minconn> connections."""
+        self._idle = list(await asyncio.gather(
+            *[self._connect() for _ in range(self.minconn)]))
+
+    async def close(self) -> None:
+        """Close every idle connection, and every connection checked out
+        when it is returned.
+        """
+        self.closed = True
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.raw.close()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[_AsyncConnection]:
+        """Check out a connection and yield it, returning it to the pool
+        afterwards unless it was broken or the pool was closed.
+
+        Raise pg.InterfaceError if the pool is closed.
+        """
+        if self.closed:
+            raise pg.InterfaceError("connection pool is closed")
+        async with self._slots:
+            connection = await self._checkout()
+            try:
+                yield connection
+            finally:
+                if connection.healthy() and not self.closed:
+                    connection.last_used = monotonic()
+                    self._idle.append(connection)
+                else:
+                    connection.raw.close()
+
+    async def run(self, name: str, params: tuple = ()) -> pg_ext.cursor:
+        """Run the statement <name> with <params> on any connection and
+        return a cursor over its result.
+        """
+        async with self.acquire() as connection:
+            return await connection.run(name, params)
+
+    async def _connect(self) -> _AsyncConnection:
+        """Return a new connection."""
+        raw = pg.connect(async_=True, **self._kwargs)
+        await _wait(raw)
+        return _AsyncConnection(raw)
+
+    async def _checkout(self) -> _AsyncConnection:
+        """Return a healthy idle connection, or a new one if there is none."""
+        while self._idle:
+            connection = self._idle.pop()
+            if not connection.healthy():
+                continue
+            if monotonic() - connection.last_used <= _POOL_PING_AFTER:
+                return connection
+            try:
+                await connection.execute("SELECT 1")
+                return connection
+            except pg.Error:
+                connection.raw.close()
+        return await self._connect()
+
+
+class AsyncWasteWrangler:
+    """A class that can work with data conforming to the schema in
+    waste_wrangler_schema.ddl from asyncio code, with the same results as
+    WasteWrangler.
+
+    === Instance Attributes ===
+    pool: pool of asynchronous connections to a PostgreSQL database of a
+    waste management service.
+
+    Representation invariants:
+    - The database to which pool connects conforms to the schema in
+      waste_wrangler_schema.ddl.
+    """
+    pool: Optional[AsyncConnectionPool]
+
+    def __init__(self) -> None:
+        """Initialize this AsyncWasteWrangler instance, with no database
+        connection yet.
+        """
+        self.pool = None
+
+    async def connect(self, dbname: str, username: str, password: str,
+                      minconn: int = 1, maxconn: int = 10) -> bool:
+        """Establish a pool of between <minconn> and <maxconn> connections to
+        the database <dbname> using the username <username> and password
+        <password>, and assign it to the instance attribute <pool>. In
+        addition, set the search path of every connection to waste_wrangler.
+
+        Return True if the pool was made successfully, False otherwise.
+        """
+        try:
+            pool = AsyncConnectionPool(
+                minconn, maxconn, dbname=dbname, user=username,
+                password=password, options="-c search_path=waste_wrangler"
+            )
+            await pool.open()
+            self.pool = pool
+            return True
+        except pg.Error:
+            return False
+
+    async def disconnect(self) -> bool:
+        """Close the connections of this AsyncWasteWrangler's pool: the idle
+        ones now, and those in use when they are returned.
+
+        Return True iff they were closed successfully.
+        """
+        try:
+            if self.pool is not None:
+                await self.pool.close()
+            return True
+        except pg.Error:
+            return False
+
+    async def schedule_trip(self, rid: int, time: dt.datetime) -> bool:
+        """Schedule a truck and two employees to the route identified with
+        <rid> at <time>, as WasteWrangler.schedule_trip does.
+
+        The truck and the crew are picked and locked with one statement, as
+        in WasteWrangler.schedule_trip, so that concurrent callers pass over
+        each other's picks rather than colliding on them.
+        """
+        try:
+            day = time.date()
+            route = await self._fetchall(_REF_ROUTE_CANDIDATES, (rid,))
+            if not route:
+                return False
+            _, duration, fid, tids, trucktypes = route[0]
+            if fid is None or not tids:
+                return False
+            end = time + duration
+            shift_start = dt.datetime.combine(day, _SHIFT_START)
+            shift_end = dt.datetime.combine(day, _SHIFT_END)
+            if time < shift_start or end > shift_end:
+                return False
+
+            async with self._transaction() as connection:
+                for _ in range(_CLAIM_ATTEMPTS):
+                    cursor = await connection.run(_TRIP_CLAIM, (
+                        rid, time, time - _TRIP_GAP, end + _TRIP_GAP, tids,
+                        trucktypes
+                    ))
+                    data = cursor.fetchone()
+                    if data is None:
+                        return False
+                    tid, driver, partner = data
+                    if await self._insert_trips(connection, [
+                        (rid, tid, time, driver, partner, fid)
+                    ], False):
+                        return True
+                return False
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return False
+
+    async def schedule_trips(self, tid: int, date: dt.date) -> int:
+        """Schedule the truck identified with <tid> for trips on <date>, as
+        WasteWrangler.schedule_trips does.
+
+        The truck, its open routes and the free employees are looked up
+        concurrently. The day is then planned and its resources locked, and
+        planned again without any that another transaction holds.
+        """
+        try:
+            if isinstance(date, dt.datetime):
+                date = date.date()
+            lookups = [(_TRUCK_DAY, (tid, date)),
+                       (_TRUCK_OPEN_ROUTES, (tid, date)),
+                       (_TRUCK_FREE_EMPLOYEES, (tid, date))]
+            truck, routes, employees = await self._fetch_each(lookups)
+            async with self._transaction() as connection:
+                for attempt in range(_CLAIM_ATTEMPTS):
+                    #     Read again on this connection, keeping the locks
+                    #     taken so far, if the last plan was booked
+                    if attempt > 0:
+                        truck, routes, employees = await self._fetch_each(
+                            lookups, connection)
+                    if not truck or truck[0][1]:
+                        return 0
+                    drivers = {eid for eid, drives in employees if drives}
+                    employees = [eid for eid, _ in employees]
+
+                    while True:
+                        plan = _plan_day(date, routes)
+                        if not plan:
+                            return 0
+                        crew = _pick_crew(employees, drivers)
+                        if crew is None:
+                            return 0
+                        trips = [(rid, tid, start, crew[0], crew[1], fid)
+                                 for rid, start, fid in plan]
+                        held = await self._claim(connection, [
+                            resource for trip in trips
+                            for resource in _trip_resources(trip)
+                        ])
+                        if (_LOCK_TRUCK, tid, date) in held:
+                            return 0
+                        if not held:
+                            break
+                        routes = [route for route in routes
+                                  if (_LOCK_ROUTE, route[0], date) not in held]
+                        employees = [eid for eid in employees
+                                     if (_LOCK_EMPLOYEE, eid, date) not in held]
+
+                    if await self._insert_trips(connection, trips, True):
+                        return len(plan)
+                return 0
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
+
+    async def update_technicians(self, qualifications_file: TextIO) -> int:
+        """Update the database with the qualifications in the open file
+        <qualifications_file>, as WasteWrangler.update_technicians does, and
+        return the number of valid entries.
+
+        The employees, truck types and existing technicians named in the file
+        are looked up concurrently, and the valid entries are inserted with a
+        single statement.
+        """
+        try:
+            entries = [(fname + " " + lname, trucktype)
+                       for fname, lname, trucktype in
+                       WasteWrangler._read_qualifications_file(
+                           qualifications_file)]
+            names = list({name for name, _ in entries})
+            employees, trucktypes, technicians = await asyncio.gather(
+                self._fetchall(_EMPLOYEES_BY_NAMES, (names,)),
+                self._fetchall(_TRUCK_TYPES_IN, (
+                    list({trucktype for _, trucktype in entries}),)),
+                self._fetchall(_TECHNICIANS_BY_NAMES, (names,))
+            )
+            eids = {name: eid for name, eid, driver in employees
+                    if not driver}
+            trucktypes = {trucktype for trucktype, in trucktypes}
+            technicians = set(technicians)
+
+            added = []
+            for name, trucktype in entries:
+                eid = eids.get(name)
+                if (eid is None or trucktype not in trucktypes
+                        or (eid, trucktype) in technicians):
+                    continue
+                technicians.add((eid, trucktype))
+                added.append((eid, trucktype))
+            if added:
+                await self.pool.run(_INSERT_TECHNICIANS, (
+                    [eid for eid, _ in added],
+                    [trucktype for _, trucktype in added]
+                ))
+            return len(added)
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
+
+    async def workmate_sphere(self, eid: int) -> list[int]:
+        """Return the workmate sphere of the driver identified by <eid>, as
+        WasteWrangler.workmate_sphere does.
+        """
+        try:
+            return [d for d, in await self._fetchall(_SPHERE, (eid,))]
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return []
+
+    async def schedule_maintenance(self, date: dt.date) -> int:
+        """Schedule maintenance for the overdue trucks on <date>, as
+        WasteWrangler.schedule_maintenance does, and return the number of
+        trucks scheduled.
+
+        The overdue trucks and their technicians are looked up concurrently.
+        The days they take are then scheduled and locked, and scheduled again
+        without any that another transaction holds.
+        """
+        try:
+            lookups = [(_OVERDUE_TRUCKS, (date,)),
+                       (_OVERDUE_TECHNICIANS, (date,))]
+            trucks, qualified = await self._fetch_each(lookups)
+            async with self._transaction() as connection:
+                for attempt in range(_CLAIM_ATTEMPTS):
+                    #     Read again on this connection, keeping the locks
+                    #     taken so far, if the last schedule was booked
+                    if attempt > 0:
+                        trucks, qualified = await self._fetch_each(
+                            lookups, connection)
+                    technicians = {}
+                    for trucktype, eid in qualified:
+                        technicians.setdefault(trucktype, []).append(eid)
+                    trucks = [(tid, technicians[trucktype])
+                              for tid, trucktype in trucks
+                              if trucktype in technicians]
+
+                    #     Leave out the trucks another transaction is
+                    #     scheduling maintenance for
+                    held = await self._claim(connection, [
+                        (_LOCK_OVERDUE, tid, None) for tid, _ in trucks
+                    ])
+                    trucks = [(tid, eids) for tid, eids in trucks
+                              if (_LOCK_OVERDUE, tid, None) not in held]
+
+                    held_booked, held_busy = set(), set()
+                    while True:
+                        scheduled = await self._schedule_maintenance_days(
+                            connection, date, trucks, held_booked, held_busy)
+                        held = await self._claim(connection, [
+                            resource for tid, eid, day in scheduled
+                            for resource in [(_LOCK_TRUCK, tid, day),
+                                             (_LOCK_TECHNICIAN, eid, day)]
+                        ])
+                        if not held:
+                            break
+                        held_booked |= {(eid, day) for kind, eid, day in held
+                                        if kind == _LOCK_TECHNICIAN}
+                        held_busy |= {(tid, day) for kind, tid, day in held
+                                      if kind == _LOCK_TRUCK}
+
+                    if not scheduled:
+                        return 0
+                    cursor = await connection.run(_INSERT_MAINTENANCE, tuple(
+                        list(column) for column in zip(*scheduled)
+                    ) + (date,))
+                    if cursor.rowcount == len(scheduled):
+                        return len(scheduled)
+                return 0
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
+
+    async def reroute_waste(self, fid: int, date: dt.date) -> int:
+        """Reroute the trips to <fid> on day <date>, as
+        WasteWrangler.reroute_waste does, and return the number of re-routed
+        trips.
+        """
+        try:
+            cursor = await self.pool.run(_REROUTE, ([fid], date, date))
+            return cursor.rowcount
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
+
+    # =========================== Helper methods ============================= #
+
+    async def _fetchall(self, name: str, params: tuple) -> list[tuple]:
+        """Return every row of the statement <name> run with <params>."""
+        cursor = await self.pool.run(name, params)
+        return cursor.fetchall()
+
+    async def _fetch_each(self, lookups: list[tuple[str, tuple]],
+                          connection: Optional[_AsyncConnection] = None
+                          ) -> list[list[tuple]]:
+        """Return every row of each statement run with its parameters in
+        <lookups>, in order, running them concurrently on the pool, or one
+        after another on <connection> if it is given.
+        """
+        if connection is None:
+            return list(await asyncio.gather(
+                *[self._fetchall(name, params) for name, params in lookups]))
+        return [(await connection.run(name, params)).fetchall()
+                for name, params in lookups]
+
+    @asynccontextmanager
+    async def _transaction(self) -> AsyncIterator[_AsyncConnection]:
+        """Check out a connection and yield it in a transaction, which is
+        committed when the block ends and rolled back if it raises.
+
+        The advisory locks taken in the transaction are released when it
+        ends. Nothing in the block may wait for another connection of
+        <pool>.
+        """
+        async with self.pool.acquire() as connection:
+            await connection.execute("BEGIN")
+            try:
+                yield connection
+            except BaseException:
+                if connection.healthy():
+                    await connection.execute("ROLLBACK")
+                raise
+            await connection.execute("COMMIT")
+
+    async def _claim(self, connection: _AsyncConnection,
+                     resources: list[tuple[int, int, Optional[dt.date]]]
+                     ) -> set[tuple[int, int, Optional[dt.date]]]:
+        """Lock each (kind, resource, day) in <resources> that no other
+        transaction holds until the end of the transaction on <connection>,
+        as WasteWrangler._claim does, and return the ones another transaction
+        holds.
+        """
+        resources = list(set(resources))
+        if not resources:
+            return set()
+        cursor = await connection.run(_CLAIM, (
+            [kind for kind, _, _ in resources],
+            [resource for _, resource, _ in resources],
+            [day for _, _, day in resources]
+        ))
+        return set(cursor.fetchall())
+
+    async def _insert_trips(
+            self, connection: _AsyncConnection,
+            trips: list[tuple[int, int, dt.datetime, int, int, int]],
+            whole_day: bool
+    ) -> bool:
+        """Insert every (rID, tID, tTime, eID, eID, fID) in <trips> with one
+        statement on <connection>, as WasteWrangler._insert_trips does, and
+        return whether they were inserted.
+        """
+        cursor = await connection.run(_INSERT_TRIPS, (
+            [trip[0] for trip in trips], [trip[1] for trip in trips],
+            [trip[2] for trip in trips],
+            [max(trip[3], trip[4]) for trip in trips],
+            [min(trip[3], trip[4]) for trip in trips],
+            [trip[5] for trip in trips], _TRIP_GAP, whole_day
+        ))
+        return cursor.rowcount == len(trips)
+
+    async def _schedule_maintenance_days(
+            self, connection: _AsyncConnection, date: dt.date,
+            trucks: list[tuple[int, list[int]]],
+            booked: set[tuple[int, dt.date]], busy: set[tuple[int, dt.date]]
+    ) -> list[tuple[int, int, dt.date]]:
+        """Helper for schedule_maintenance. Return the (tID, eID, day) of the
+        maintenance scheduled after <date> for each (tID, qualified eIDs) in
+        <trucks>, as WasteWrangler._schedule_maintenance_days does, reading
+        the bookings on <connection>.
+        """
+        eids = list({eid for _, eids in trucks for eid in eids})
+        booked, busy, scheduled = set(booked), set(busy), []
+        first = date + dt.timedelta(days=1)
+        while trucks:
+            last = first + dt.timedelta(days=_MAINTENANCE_HORIZON - 1)
+            cursor = await connection.run(_TECHNICIAN_DAYS,
+                                          (eids, first, last))
+            booked.update(cursor.fetchall())
+            cursor = await connection.run(_TRUCK_DAYS, (
+                [tid for tid, _ in trucks], first, last
+            ))
+            busy.update(cursor.fetchall())
+            trucks = _solve_maintenance(trucks, booked, busy, first, last,
+                                        scheduled)
+            first = last + dt.timedelta(days=1)
+        return scheduled
@@ -0,0 +1,308 @@
+"""Minute-by-minute availability of trucks and employees
+
+=== Module Description ===
+
+This file contains the DayAvailability class, which holds how many minutes of
+each minute of one day each truck and employee has been on a trip, as NumPy
+running counts, and answers whether each of many candidates is free during a
+window with a few vectorized operations.
+
+WasteWrangler.schedule_trip_many places its trips with it when NumPy is
+installed, and with the equivalent, pure Python _DayTrips of a2.py otherwise.
+"""
+
+import datetime as dt
+from typing import Optional
+
+import numpy as np
+
+# The number of minutes in a day, and of microseconds in a minute.
+_MINUTES = 24 * 60
+_MINUTE = 60 * 10 ** 6
+
+# The number of rows of counts _MinuteCounts starts with.
+_FIRST_ROWS = 8
+
+
+def _minutes(delta: dt.timedelta) -> tuple[int, int]:
+    """Return <delta> in minutes, rounded down and rounded up."""
+    micro = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return micro // _MINUTE, -(-micro // _MINUTE)
+
+
+class _MinuteCounts:
+    """The running count of the minutes of one day that each of a fixed list
+    of trucks or employees is on a trip, kept only for those that have been
+    on one.
+
+    Counts wrap around at 2 ** 16, so the number of minutes booked in a window
+    is the difference of two counts modulo 2 ** 16, which is never 0 for a
+    window with any, as no day has that many.
+
+    === Instance Attributes ===
+    rows: the row of <counts> of each truck or employee, by position in the
+    list, or 0 for those that have not been on a trip.
+    counts: for each row, the number of minutes booked before each minute
+    of the day, from 0 to _MINUTES. Row 0 is all 0.
+    used: the number of rows of <counts> in use, including row 0.
+    """
+    rows: np.ndarray
+    counts: np.ndarray
+    used: int
+
+    def __init__(self, size: int) -> None:
+        """Initialize the counts of a list of <size> trucks or employees,
+        none of whom has been on a trip.
+        """
+        self.rows = np.zeros(size, np.int32)
+        self.counts = np.zeros((_FIRST_ROWS, _MINUTES + 1), np.uint16)
+        self.used = 1
+
+    def add(self, position: int, first: int, last: int, sign: int) -> None:
+        """Book the minutes from <first> up to <last> for the truck or
+        employee at <position> if <sign> is 1, or release them if it is -1.
+        """
+        row = self.rows[position]
+        if row == 0:
+            if self.used == len(self.counts):
+                self.counts = np.concatenate(
+                    [self.counts, np.zeros_like(self.counts)])
+            row = self.rows[position] = self.used
+            self.used += 1
+        counts = self.counts[row]
+        steps = np.arange(1, last - first + 1, dtype=np.uint16)
+        if sign > 0:
+            counts[first + 1:last + 1] += steps
+            counts[last + 1:] += np.uint16(last - first)
+        else:
+            counts[first + 1:last + 1] -= steps
+            counts[last + 1:] -= np.uint16(last - first)
+
+    def busy(self, positions: Optional[np.ndarray], first: int, last: int
+             ) -> np.ndarray:
+        """Return whether each truck or employee at <positions>, or every one
+        if <positions> is None, has a minute booked from <first> up to <last>.
+        """
+        rows = self.rows if positions is None else self.rows[positions]
+        return self.counts[rows, last] != self.counts[rows, first]
+
+
+class DayAvailability:
+    """Where the trucks and employees are on one day, for placing trips as
+    schedule_trip would.
+
+    Each trip adds the minutes it is under way to the running counts of its
+    truck and of its employees, so that whether a candidate is busy during a
+    window takes one subtraction, done for every candidate at once. Counts
+    are only kept for the trucks and employees that have been on a trip that
+    day, and the others are free. A trip that does not start and end on the
+    minute is kept aside and checked exactly.
+
+    The bookings made after a checkpoint can be undone with rollback, so
+    that the same requests can be placed again on the same day.
+
+    === Instance Attributes ===
+    day: the day.
+    gap: how long a truck and its crew must be free before and after a trip.
+    unavailable: for each truck, whether it has maintenance on <day> or is
+    locked by another transaction.
+    held: for each employee, whether they are locked by another transaction.
+    taken: the routes with a trip on <day>, or locked by another transaction.
+    """
+    day: dt.date
+    gap: dt.timedelta
+    unavailable: np.ndarray
+    held: np.ndarray
+    taken: set[int]
+    _midnight: dt.datetime
+    _truck_positions: dict[int, int]
+    _eids: list[int]
+    _employee_positions: dict[int, int]
+    _drivers: dict[str, np.ndarray]
+    _trucks: _MinuteCounts
+    _employees: _MinuteCounts
+    _irregular: list[tuple[int, dt.datetime, dt.datetime, int, int]]
+    _candidates: dict[int, tuple[list[tuple[int, str]], np.ndarray]]
+    _journal: Optional[list[tuple[Optional[int], list[int], int, int]]]
+    _journal_irregular: int
+    _journal_routes: list[int]
+
+    def __init__(self, day: dt.date, gap: dt.timedelta, tids: list[int],
+                 employees: list[tuple[int, set[str]]]) -> None:
+        """Initialize the availability on <day> of the trucks <tids> and of
+        every (eID, truck types driven) in <employees>, in order of
+        preference, with no trips yet, keeping them free for <gap> before
+        and after each trip.
+        """
+        self.day = day
+        self.gap = gap
+        self._midnight = dt.datetime.combine(day, dt.time())
+        self._truck_positions = {tid: i for i, tid in enumerate(tids)}
+        self._eids = [eid for eid, _ in employees]
+        self._employee_positions = {eid: i for i, eid in enumerate(self._eids)}
+        self._drivers = {}
+        for i, (_, driven) in enumerate(employees):
+            for trucktype in driven:
+                if trucktype not in self._drivers:
+                    self._drivers[trucktype] = np.zeros(len(employees), bool)
+                self._drivers[trucktype][i] = True
+        self._trucks = _MinuteCounts(len(tids))
+        self._employees = _MinuteCounts(len(employees))
+        self.unavailable = np.zeros(len(tids), bool)
+        self.held = np.zeros(len(employees), bool)
+        self.taken = set()
+        self._irregular = []
+        self._candidates = {}
+        self._journal = None
+        self._journal_irregular = 0
+        self._journal_routes = []
+
+    def book(self, rid: int, tid: int, start: dt.datetime, end: dt.datetime,
+             eid1: int, eid2: int) -> None:
+        """Record a trip on route <rid> with truck <tid> and employees <eid1>
+        and <eid2> from <start> to <end>.
+        """
+        if start.date() == self.day and rid not in self.taken:
+            self.taken.add(rid)
+            if self._journal is not None:
+                self._journal_routes.append(rid)
+        first, first_up = _minutes(start - self._midnight)
+        last_down, last = _minutes(end - self._midnight)
+        if first != first_up or last != last_down:
+            self._irregular.append((tid, start, end, eid1, eid2))
+            return
+        first, last = max(first, 0), min(last, _MINUTES)
+        if first >= last:
+            return
+        truck = self._truck_positions.get(tid)
+        employees = [self._employee_positions[eid] for eid in (eid1, eid2)
+                     if eid in self._employee_positions]
+        self._add(truck, employees, first, last, 1)
+        if self._journal is not None:
+            self._journal.append((truck, employees, first, last))
+
+    def book_many(self, trips: list[tuple[int, int, dt.datetime, dt.datetime,
+                                          int, int]]) -> None:
+        """Record every (rID, tID, start, end, eID1, eID2) in <trips>."""
+        for trip in trips:
+            self.book(*trip)
+
+    def checkpoint(self) -> None:
+        """Start recording the trips booked from now on, so that rollback
+        can undo them.
+        """
+        self._journal = []
+        self._journal_irregular = len(self._irregular)
+        self._journal_routes = []
+
+    def rollback(self) -> None:
+        """Undo every trip booked since the last checkpoint, keeping the
+        checkpoint. Exclusions are not undone.
+        """
+        if self._journal is None:
+            return
+        for truck, employees, first, last in self._journal:
+            self._add(truck, employees, first, last, -1)
+        del self._irregular[self._journal_irregular:]
+        self.taken.difference_update(self._journal_routes)
+        self.checkpoint()
+
+    def exclude(self, tids: set[int], eids: set[int] = frozenset(),
+                rids: set[int] = frozenset()) -> None:
+        """Make the trucks <tids> and employees <eids> unavailable for the
+        whole day, and treat the routes <rids> as taken.
+        """
+        for tid in tids:
+            if tid in self._truck_positions:
+                self.unavailable[self._truck_positions[tid]] = True
+        for eid in eids:
+            if eid in self._employee_positions:
+                self.held[self._employee_positions[eid]] = True
+        self.taken |= rids
+
+    def free_truck(self, trucks: list[tuple[int, str]], start: dt.datetime,
+                   end: dt.datetime) -> Optional[tuple[int, str]]:
+        """Return the first (tID, truck type) in <trucks> that is available
+        for a trip from <start> to <end>, or None if there is none.
+
+        Pre-condition:
+            Every tID in <trucks> was given to the initializer, and the
+            window around the trip lies within <day>.
+        """
+        if not trucks:
+            return None
+        cached = self._candidates.get(id(trucks))
+        if cached is None or cached[0] is not trucks:
+            cached = (trucks, np.fromiter(
+                (self._truck_positions[tid] for tid, _ in trucks), np.intp,
+                len(trucks)))
+            self._candidates[id(trucks)] = cached
+        positions = cached[1]
+        first, last = self._window(start, end)
+        busy = (self._trucks.busy(positions, first, last)
+                | self.unavailable[positions])
+        irregular = self._irregular_busy(start, end, False)
+        if irregular:
+            busy |= np.fromiter((tid in irregular for tid, _ in trucks),
+                                bool, len(trucks))
+        i = int(np.argmin(busy))
+        return None if busy[i] else trucks[i]
+
+    def free_crew(self, trucktype: str, start: dt.datetime,
+                  end: dt.datetime) -> Optional[tuple[int, int]]:
+        """Return the (driver, partner) to put on a trip from <start> to <end>
+        with a truck of <trucktype>, as _pick_crew picks them from the
+        employees available for it, or None if there is no such pair.
+
+        Pre-condition:
+            The window around the trip lies within <day>.
+        """
+        first, last = self._window(start, end)
+        free = ~(self._employees.busy(None, first, last) | self.held)
+        for eid in self._irregular_busy(start, end, True):
+            free[self._employee_positions[eid]] = False
+        drivers = self._drivers.get(trucktype)
+        if drivers is None:
+            return None
+        able = free & drivers
+        driver = int(np.argmax(able))
+        if not able[driver]:
+            return None
+        free[driver] = False
+        partner = int(np.argmax(free))
+        if not free[partner]:
+            return None
+        return self._eids[driver], self._eids[partner]
+
+    def _add(self, truck: Optional[int], employees: list[int], first: int,
+             last: int, sign: int) -> None:
+        """Book the minutes from <first> up to <last> for the truck at
+        position <truck>, if any, and the employees at <employees> if <sign>
+        is 1, or release them if it is -1.
+        """
+        if truck is not None:
+            self._trucks.add(truck, first, last, sign)
+        for employee in employees:
+            self._employees.add(employee, first, last, sign)
+
+    def _window(self, start: dt.datetime, end: dt.datetime
+                ) -> tuple[int, int]:
+        """Return the first minute and the minute after the last one that
+        must be free for a trip from <start> to <end>.
+        """
+        first, _ = _minutes(start - self.gap - self._midnight)
+        _, last = _minutes(end + self.gap - self._midnight)
+        return max(first, 0), min(last, _MINUTES)
+
+    def _irregular_busy(self, start: dt.datetime, end: dt.datetime,
+                        employees: bool) -> set[int]:
+        """Return the eIDs of the employees if <employees> is True, or else
+        the tIDs of the trucks, on a trip kept aside by book that is under way
+        within <gap> of a trip from <start> to <end>.
+        """
+        busy = set()
+        for tid, trip_start, trip_end, eid1, eid2 in self._irregular:
+            if (trip_start < end + self.gap
+                    and trip_end > start - self.gap):
+                busy.update((eid1, eid2) if employees else (tid,))
+        return busy
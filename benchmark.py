@@ -0,0 +1,762 @@
+"""Benchmarks of the WasteWrangler methods
+
+=== Module Description ===
+
+This file contains a harness that loads generated datasets of several sizes
+(see datagen.py) and measures, for each WasteWrangler method at each size, the
+latency of a call, the number of round trips it makes to the server and the
+number of rows its statements touch. The results are written as JSON, e.g.
+
+    python benchmark.py csc343h-marinat marinat "" --sizes small medium \
+        --output benchmark.json
+
+With --unit-of-work, the calls to each method share one transaction.
+
+The concurrency suite instead measures the requests per second served to
+many concurrent callers, by AsyncWasteWrangler on one event loop and by a
+pooled WasteWrangler shared between threads:
+
+    python benchmark.py csc343h-marinat marinat "" --suite concurrency \
+        --callers 100
+
+the indexes suite measures every method before and after
+WasteWrangler.provision_indexes:
+
+    python benchmark.py csc343h-marinat marinat "" --suite indexes
+
+and the stress suite measures the scheduling requests per second served by
+several processes competing for the same trucks, employees and routes, and
+counts the double bookings they leave behind:
+
+    python benchmark.py csc343h-marinat marinat "" --suite stress \
+        --workers 1 2 4 8
+
+and the queue suite measures the jobs per second run by several JobWorker
+processes serving the same requests from a JobQueue:
+
+    python benchmark.py csc343h-marinat marinat "" --suite queue \
+        --workers 1 2 4 8
+
+and the whatif suite measures the scenarios per second simulated from one
+snapshot of the database by several processes:
+
+    python benchmark.py csc343h-marinat marinat "" --suite whatif \
+        --workers 1 2 4 8 --scenarios 32
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import io
+import json
+import random
+import statistics
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Any, Callable, Optional
+
+import psycopg2 as pg
+from psycopg2 import extensions as pg_ext
+
+import datagen
+import job_queue
+import simulator
+from a2 import WasteWrangler
+from async_wrangler import AsyncWasteWrangler
+
+# The number of calls measured for each method at each size.
+CALLS = 20
+
+
+class _CountingCursor(pg_ext.cursor):
+    """A cursor that reports each of its statements to its connection."""
+
+    def execute(self, query: Any, vars: Any = None) -> None:
+        """Execute <query> with <vars> and count it."""
+        self.connection.before_statement()
+        try:
+            super().execute(query, vars)
+        finally:
+            self.connection.after_statement(self.rowcount)
+
+    def executemany(self, query: Any, vars_list: Any) -> None:
+        """Execute <query> once for each of <vars_list> and count them."""
+        for vars in vars_list:
+            self.execute(query, vars)
+
+    def copy_expert(self, sql: Any, file: Any, size: int = 8192) -> None:
+        """Run the COPY statement <sql> with <file> and count it."""
+        self.connection.before_statement()
+        try:
+            super().copy_expert(sql, file, size)
+        finally:
+            self.connection.after_statement(self.rowcount)
+
+
+class CountingConnection(pg_ext.connection):
+    """A connection that counts its round trips to the server and the rows
+    touched by its statements.
+
+    A round trip is a statement, a commit or rollback of an open transaction,
+    or the BEGIN that psycopg2 sends before the first statement of one.
+
+    === Instance Attributes ===
+    round_trips: the number of round trips made so far.
+    rows: the number of rows returned or changed by statements so far.
+    """
+    round_trips: int
+    rows: int
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        """Initialize a counting connection with the arguments of
+        psycopg2.extensions.connection.
+        """
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = _CountingCursor
+        self.round_trips = 0
+        self.rows = 0
+
+    def before_statement(self) -> None:
+        """Count a statement that is about to be sent."""
+        if not self.autocommit and self.status == pg_ext.STATUS_READY:
+            self.round_trips += 1
+        self.round_trips += 1
+
+    def after_statement(self, rowcount: int) -> None:
+        """Count the <rowcount> rows touched by the last statement."""
+        self.rows += max(rowcount, 0)
+
+    def commit(self) -> None:
+        """Commit the current transaction and count it."""
+        if self.status != pg_ext.STATUS_READY:
+            self.round_trips += 1
+        super().commit()
+
+    def rollback(self) -> None:
+        """Roll back the current transaction and count it."""
+        if self.status != pg_ext.STATUS_READY:
+            self.round_trips += 1
+        super().rollback()
+
+
+def _workload(data: dict[str, list[tuple]], size: datagen.DatasetSize,
+              seed: int) -> dict[str, list[Callable[[WasteWrangler], Any]]]:
+    """Return the calls to measure for each method on the dataset <data> of
+    the given <size>, chosen at random from <seed>.
+
+    Dates fall in the last month of the history, where trips are densest.
+    """
+    rand = random.Random(seed)
+    days = [size.end - dt.timedelta(days=i) for i in range(30)]
+    rids = [row[0] for row in data["route"]]
+    tids = [row[0] for row in data["truck"]]
+    eids = [row[0] for row in data["employee"]]
+    fids = [row[0] for row in data["facility"]]
+
+    def qualifications(bulk: bool) -> Callable[[WasteWrangler], Any]:
+        file = io.StringIO()
+        datagen.write_qualifications(data, file, len(eids), rand.random())
+        file.seek(0)
+        return lambda ww: ww.update_technicians(file, bulk=bulk)
+
+    def trip(rid: int, day: dt.date) -> Callable[[WasteWrangler], Any]:
+        time = dt.datetime.combine(day, dt.time(rand.randint(8, 14)))
+        return lambda ww: ww.schedule_trip(rid, time)
+
+    workload = {
+        "schedule_trip": [trip(rand.choice(rids), rand.choice(days))
+                          for _ in range(CALLS)],
+        "schedule_trip_many": [],
+        "schedule_trips": [],
+        "update_technicians": [qualifications(False) for _ in range(3)],
+        "update_technicians_bulk": [qualifications(True) for _ in range(3)],
+        "workmate_sphere": [],
+        "schedule_maintenance": [],
+        "reroute_waste": [],
+    }
+    for _ in range(CALLS):
+        tid, day = rand.choice(tids), rand.choice(days)
+        workload["schedule_trips"].append(
+            lambda ww, tid=tid, day=day: ww.schedule_trips(tid, day))
+        eid = rand.choice(eids)
+        workload["workmate_sphere"].append(
+            lambda ww, eid=eid: ww.workmate_sphere(eid))
+        fid, day = rand.choice(fids), rand.choice(days)
+        workload["reroute_waste"].append(
+            lambda ww, fid=fid, day=day: ww.reroute_waste(fid, day))
+    for day in rand.sample(days, 3):
+        workload["schedule_maintenance"].append(
+            lambda ww, day=day: ww.schedule_maintenance(day))
+    for _ in range(3):
+        requests = [(rand.choice(rids),
+                     dt.datetime.combine(rand.choice(days),
+                                         dt.time(rand.randint(8, 14))))
+                    for _ in range(CALLS)]
+        workload["schedule_trip_many"].append(
+            lambda ww, requests=requests: ww.schedule_trip_many(requests))
+    return workload
+
+
+def _summary(latencies: list[float], round_trips: int, rows: int
+             ) -> dict[str, Any]:
+    """Return the measurements of a method over len(<latencies>) calls that
+    made <round_trips> round trips and touched <rows> rows in total.
+    """
+    ordered = sorted(latencies)
+    calls = len(ordered)
+    return {
+        "calls": calls,
+        "latency_ms": {
+            "mean": 1000 * statistics.fmean(ordered),
+            "p50": 1000 * ordered[calls // 2],
+            "p95": 1000 * ordered[min(calls - 1, int(calls * 0.95))],
+            "max": 1000 * ordered[-1],
+        },
+        "round_trips_per_call": round_trips / calls,
+        "rows_per_call": rows / calls,
+    }
+
+
+def _mix(data: dict[str, list[tuple]], size: datagen.DatasetSize, seed: int,
+         count: int) -> list[tuple[str, tuple]]:
+    """Return <count> (method name, arguments) requests of the kinds a
+    dispatch API serves, on the dataset <data> of the given <size>, chosen at
+    random from <seed>.
+    """
+    rand = random.Random(seed)
+    days = [size.end + dt.timedelta(days=i) for i in range(1, 31)]
+    rids = [row[0] for row in data["route"]]
+    tids = [row[0] for row in data["truck"]]
+    eids = [row[0] for row in data["employee"]]
+    fids = [row[0] for row in data["facility"]]
+    requests = []
+    for _ in range(count):
+        kind = rand.random()
+        if kind < 0.6:
+            time = dt.datetime.combine(rand.choice(days),
+                                       dt.time(rand.randint(8, 14)))
+            requests.append(("schedule_trip", (rand.choice(rids), time)))
+        elif kind < 0.75:
+            requests.append(("schedule_trips",
+                             (rand.choice(tids), rand.choice(days))))
+        elif kind < 0.85:
+            requests.append(("workmate_sphere", (rand.choice(eids),)))
+        else:
+            requests.append(("reroute_waste",
+                             (rand.choice(fids), rand.choice(days))))
+    return requests
+
+
+async def _serve_async(ww: AsyncWasteWrangler,
+                       requests: list[tuple[str, tuple]], callers: int
+                       ) -> tuple[list[float], int]:
+    """Serve <requests> with <callers> concurrent tasks on <ww>, and return
+    the latency of each request and the number of requests that did
+    anything.
+    """
+    pending = iter(requests)
+    latencies = []
+    succeeded = 0
+
+    async def caller() -> None:
+        nonlocal succeeded
+        for method, args in pending:
+            start = perf_counter()
+            result = await getattr(ww, method)(*args)
+            latencies.append(perf_counter() - start)
+            succeeded += _succeeded(result)
+
+    await asyncio.gather(*[caller() for _ in range(callers)])
+    return latencies, succeeded
+
+
+def _serve_threads(ww: WasteWrangler, requests: list[tuple[str, tuple]],
+                   callers: int) -> tuple[list[float], int]:
+    """Serve <requests> with <callers> concurrent threads on <ww>, and return
+    the latency of each request and the number of requests that did
+    anything.
+    """
+    def call(request: tuple[str, tuple]) -> tuple[float, bool]:
+        start = perf_counter()
+        result = getattr(ww, request[0])(*request[1])
+        return perf_counter() - start, _succeeded(result)
+
+    with ThreadPoolExecutor(callers) as executor:
+        served = list(executor.map(call, requests))
+    return ([latency for latency, _ in served],
+            sum(succeeded for _, succeeded in served))
+
+
+def _succeeded(result: Any) -> bool:
+    """Return whether a method that returned <result> did anything: whether
+    it returned True, a nonzero count, or a list or dict with a truthy
+    value.
+    """
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, list):
+        return any(result)
+    return bool(result)
+
+
+def run_concurrency(dbname: str, username: str, password: str,
+                    sizes: list[str], seed: int = 343, callers: int = 100,
+                    requests: int = 2000, maxconn: int = 20
+                    ) -> dict[str, Any]:
+    """Return the requests per second that AsyncWasteWrangler and a pooled
+    WasteWrangler serve to <callers> concurrent callers making <requests>
+    requests in total, over at most <maxconn> connections, and how many of
+    them per second did anything, on a generated dataset of each of <sizes>,
+    using the database <dbname> with the username <username> and password
+    <password>.
+
+    The database is reloaded before each run. Its previous contents are lost.
+    """
+    results = {"generated_at": dt.datetime.now().isoformat(), "seed": seed,
+               "callers": callers, "maxconn": maxconn, "sizes": {}}
+    for name in sizes:
+        size = datagen.SIZES[name]
+        data = datagen.generate(size, seed)
+        mix = _mix(data, size, seed, requests)
+        measured = {}
+
+        datagen.load(dbname, username, password, data)
+        async_ww = AsyncWasteWrangler()
+
+        async def serve() -> tuple[tuple[list[float], int], float]:
+            await async_ww.connect(dbname, username, password, 1, maxconn)
+            try:
+                start = perf_counter()
+                served = await _serve_async(async_ww, mix, callers)
+                return served, perf_counter() - start
+            finally:
+                await async_ww.disconnect()
+
+        (latencies, succeeded), seconds = asyncio.run(serve())
+        measured["async"] = _throughput(latencies, succeeded, seconds)
+
+        datagen.load(dbname, username, password, data)
+        ww = WasteWrangler()
+        ww.connect_pool(dbname, username, password, 1, maxconn)
+        try:
+            start = perf_counter()
+            latencies, succeeded = _serve_threads(ww, mix, callers)
+            measured["threads"] = _throughput(latencies, succeeded,
+                                              perf_counter() - start)
+        finally:
+            ww.disconnect()
+        results["sizes"][name] = measured
+    return results
+
+
+def _throughput(latencies: list[float], succeeded: int, seconds: float
+                ) -> dict[str, Any]:
+    """Return the measurements of len(<latencies>) requests served in
+    <seconds>, of which <succeeded> did anything.
+    """
+    summary = _summary(latencies, 0, 0)
+    return {
+        "requests": summary["calls"],
+        "succeeded": succeeded,
+        "seconds": seconds,
+        "requests_per_second": summary["calls"] / seconds,
+        "successes_per_second": succeeded / seconds,
+        "latency_ms": summary["latency_ms"],
+    }
+
+
+# Queries counting the double bookings in the database, by kind: trips on
+# the same route on the same day, and pairs of trips that share a truck or an
+# employee less than 30 minutes apart, trips of trucks under maintenance that
+# day, and technicians maintaining two trucks on the same day. Every trip
+# ends on the day it starts, so trips are only paired within a day, and
+# employees are paired through their trips so that the join is on eID.
+_DOUBLE_BOOKINGS = {
+    "routes": """
+        SELECT count(*) FROM waste_wrangler.trip a
+             JOIN waste_wrangler.trip b
+               ON b.rid = a.rid AND b.ttime::date = a.ttime::date
+              AND b.ttime > a.ttime
+    """,
+    "trucks": """
+        SELECT count(*) FROM waste_wrangler.trip a
+             JOIN waste_wrangler.route ra ON ra.rid = a.rid
+             JOIN waste_wrangler.trip b
+               ON b.tid = a.tid AND b.ttime::date = a.ttime::date
+              AND (b.ttime, b.rid) > (a.ttime, a.rid)
+        WHERE b.ttime < a.ttime + ra.length * interval '12 minutes'
+                        + interval '30 minutes'
+    """,
+    "employees": """
+        WITH crew AS (
+            SELECT t.rid, t.ttime, t.ttime + r.length * interval '12 minutes'
+                                   + interval '30 minutes' AS free, e.eid
+            FROM waste_wrangler.trip t
+                 JOIN waste_wrangler.route r ON r.rid = t.rid,
+                 LATERAL (VALUES (t.eid1), (t.eid2)) e(eid)
+        )
+        SELECT count(DISTINCT (a.rid, a.ttime, b.rid, b.ttime))
+        FROM crew a
+             JOIN crew b
+               ON b.eid = a.eid AND b.ttime::date = a.ttime::date
+              AND (b.ttime, b.rid) > (a.ttime, a.rid)
+        WHERE b.ttime < a.free
+    """,
+    "maintained_trucks": """
+        SELECT count(*) FROM waste_wrangler.trip t
+             JOIN waste_wrangler.maintenance m
+               ON m.tid = t.tid AND m.mdate = t.ttime::date
+    """,
+    "technicians": """
+        SELECT count(*) FROM waste_wrangler.maintenance a
+             JOIN waste_wrangler.maintenance b
+               ON b.eid = a.eid AND b.mdate = a.mdate AND b.tid > a.tid
+    """,
+}
+
+
+def _contended(data: dict[str, list[tuple]], size: datagen.DatasetSize,
+               seed: int, count: int) -> list[tuple[str, tuple]]:
+    """Return <count> (method name, arguments) scheduling requests on the
+    dataset <data> of the given <size>, chosen at random from <seed>, all on
+    the same few days so that they compete for the same resources.
+    """
+    rand = random.Random(seed)
+    days = [size.end + dt.timedelta(days=i) for i in range(1, 4)]
+    rids = [row[0] for row in data["route"]]
+    tids = [row[0] for row in data["truck"]]
+
+    def time() -> dt.datetime:
+        return dt.datetime.combine(rand.choice(days),
+                                   dt.time(rand.randint(8, 14),
+                                           rand.choice([0, 30])))
+
+    requests = []
+    for _ in range(count):
+        kind = rand.random()
+        if kind < 0.7:
+            requests.append(("schedule_trip", (rand.choice(rids), time())))
+        elif kind < 0.85:
+            requests.append(("schedule_trips",
+                             (rand.choice(tids), rand.choice(days))))
+        elif kind < 0.95:
+            requests.append(("schedule_trip_many", (
+                [(rand.choice(rids), time()) for _ in range(10)],
+            )))
+        else:
+            day = size.end - dt.timedelta(days=rand.randint(0, 9))
+            requests.append(("schedule_maintenance", (day,)))
+    return requests
+
+
+def _stress_worker(dbname: str, username: str, password: str,
+                   requests: list[tuple[str, tuple]]
+                   ) -> tuple[float, float, int]:
+    """Serve <requests> on a WasteWrangler of its own, in a worker process,
+    and return the wall-clock times at which it started and finished and the
+    number of requests that scheduled anything.
+    """
+    ww = WasteWrangler()
+    ww.connect(dbname, username, password)
+    try:
+        start = dt.datetime.now().timestamp()
+        scheduled = 0
+        for method, args in requests:
+            scheduled += _succeeded(getattr(ww, method)(*args))
+        return start, dt.datetime.now().timestamp(), scheduled
+    finally:
+        ww.disconnect()
+
+
+def _double_bookings(dbname: str, username: str, password: str
+                     ) -> dict[str, int]:
+    """Return the number of double bookings of each kind in the database
+    <dbname>, using the username <username> and password <password>.
+    """
+    connection = pg.connect(dbname=dbname, user=username, password=password)
+    try:
+        cursor = connection.cursor()
+        counts = {}
+        for kind, query in _DOUBLE_BOOKINGS.items():
+            cursor.execute(query)
+            counts[kind] = cursor.fetchone()[0]
+        return counts
+    finally:
+        connection.close()
+
+
+def run_stress(dbname: str, username: str, password: str, sizes: list[str],
+               seed: int = 343, workers: tuple[int, ...] = (1, 2, 4, 8),
+               requests: int = 1000) -> dict[str, Any]:
+    """Return the requests per second served by each number of <workers>
+    processes, each with its own WasteWrangler, sharing <requests>
+    scheduling requests that compete for the same resources, and the double
+    bookings found afterwards, on a generated dataset of each of <sizes>,
+    using the database <dbname> with the username <username> and password
+    <password>.
+
+    The database is reloaded before each run. Its previous contents are lost.
+    """
+    results = {"generated_at": dt.datetime.now().isoformat(), "seed": seed,
+               "requests": requests, "sizes": {}}
+    for name in sizes:
+        size = datagen.SIZES[name]
+        data = datagen.generate(size, seed)
+        contended = _contended(data, size, seed, requests)
+        measured = {}
+        for count in workers:
+            datagen.load(dbname, username, password, data)
+            with ProcessPoolExecutor(count) as executor:
+                served = list(executor.map(
+                    _stress_worker, [dbname] * count, [username] * count,
+                    [password] * count,
+                    [contended[i::count] for i in range(count)]
+                ))
+            seconds = (max(end for _, end, _ in served)
+                       - min(start for start, _, _ in served))
+            measured[count] = {
+                "seconds": seconds,
+                "requests_per_second": requests / seconds,
+                "scheduled": sum(scheduled for _, _, scheduled in served),
+                "double_bookings": _double_bookings(dbname, username,
+                                                    password),
+            }
+        results["sizes"][name] = measured
+    return results
+
+
+def run_queue(dbname: str, username: str, password: str, sizes: list[str],
+              seed: int = 343, workers: tuple[int, ...] = (1, 2, 4, 8),
+              requests: int = 1000, batch: int = 1) -> dict[str, Any]:
+    """Return the jobs per second run by each number of <workers> JobWorker
+    processes, claiming <batch> jobs at a time, from a JobQueue of
+    <requests> scheduling requests that compete for the same resources, and
+    the double bookings found afterwards, on a generated dataset of each of
+    <sizes>, using the database <dbname> with the username <username> and
+    password <password>.
+
+    Requests for methods that cannot be run as jobs are left out. The
+    database is reloaded before each run. Its previous contents are lost.
+    """
+    results = {"generated_at": dt.datetime.now().isoformat(), "seed": seed,
+               "batch": batch, "sizes": {}}
+    for name in sizes:
+        size = datagen.SIZES[name]
+        data = datagen.generate(size, seed)
+        jobs = [(method, args) for method, args
+                in _contended(data, size, seed, requests)
+                if method in job_queue._JOB_METHODS]
+        measured = {}
+        for count in workers:
+            datagen.load(dbname, username, password, data)
+            ww = WasteWrangler()
+            ww.connect(dbname, username, password)
+            try:
+                queue = job_queue.JobQueue(ww)
+                queue.provision()
+                queue.enqueue_many(jobs)
+                #     Each worker stops after finding no job due for 0.5
+                #     seconds, which is not counted
+                start = perf_counter()
+                served = job_queue.run_workers(dbname, username, password,
+                                               count, batch, 0.5)
+                seconds = perf_counter() - start - 0.5
+                measured[count] = {
+                    "jobs": len(jobs),
+                    "seconds": seconds,
+                    "jobs_per_second": len(jobs) / seconds,
+                    "failed": sum(failed for _, failed in served),
+                    "methods": queue.report(),
+                    "double_bookings": _double_bookings(dbname, username,
+                                                        password),
+                }
+            finally:
+                ww.disconnect()
+        results["sizes"][name] = measured
+    return results
+
+
+def run_whatif(dbname: str, username: str, password: str, sizes: list[str],
+               seed: int = 343, workers: tuple[int, ...] = (1, 2, 4, 8),
+               requests: int = 1000, scenarios: int = 32) -> dict[str, Any]:
+    """Return how long a snapshot takes to load, and the scenarios per second
+    simulated from it by each number of <workers> processes, for <scenarios>
+    scenarios that each make <requests> scheduling requests with a few trucks
+    out of service and a facility closed, on a generated dataset of each of
+    <sizes>, using the database <dbname> with the username <username> and
+    password <password>.
+
+    The database is reloaded once for each size. Its previous contents are
+    lost, but the simulations do not change it.
+    """
+    results = {"generated_at": dt.datetime.now().isoformat(), "seed": seed,
+               "requests": requests, "scenarios": scenarios, "sizes": {}}
+    for name in sizes:
+        size = datagen.SIZES[name]
+        data = datagen.generate(size, seed)
+        rand = random.Random(seed)
+        calls = [(method, args) for method, args
+                 in _contended(data, size, seed, requests)
+                 if hasattr(simulator.Simulation, method)]
+        tids = [row[0] for row in data["truck"]]
+        fids = [row[0] for row in data["facility"]]
+        alternatives = [
+            simulator.Scenario(str(i), calls, rand.sample(tids, 5),
+                               rand.sample(fids, 1))
+            for i in range(scenarios)
+        ]
+        datagen.load(dbname, username, password, data)
+        ww = WasteWrangler()
+        ww.connect(dbname, username, password)
+        try:
+            start = perf_counter()
+            snapshot = simulator.take_snapshot(
+                ww, size.end - dt.timedelta(days=9))
+            measured = {"snapshot_seconds": perf_counter() - start}
+        finally:
+            ww.disconnect()
+        for count in workers:
+            start = perf_counter()
+            outcomes = simulator.simulate(snapshot, alternatives, count)
+            seconds = perf_counter() - start
+            measured[count] = {
+                "seconds": seconds,
+                "scenarios_per_second": scenarios / seconds,
+                "trips": statistics.mean(len(outcome.trips)
+                                         for outcome in outcomes),
+            }
+        results["sizes"][name] = measured
+    return results
+
+
+def run(dbname: str, username: str, password: str, sizes: list[str],
+        seed: int = 343, methods: Optional[list[str]] = None,
+        indexes: bool = False, exclusion: bool = False,
+        unit_of_work: bool = False) -> dict[str, Any]:
+    """Return the measurements of <methods>, or of every method if <methods>
+    is None, on a generated dataset of each of <sizes>, using the database
+    <dbname> with the username <username> and password <password>.
+
+    If <indexes> is True, WasteWrangler.provision_indexes is run with
+    <exclusion> after each load, and its result is recorded.
+
+    If <unit_of_work> is True, the calls to each method are made within one
+    WasteWrangler.unit_of_work, and the commit at its end counts towards the
+    latency of the last call.
+
+    The database is reloaded before each method, so that every method runs
+    against the same data. Its previous contents are lost.
+    """
+    results = {"generated_at": dt.datetime.now().isoformat(), "seed": seed,
+               "sizes": {}}
+    for name in sizes:
+        size = datagen.SIZES[name]
+        data = datagen.generate(size, seed)
+        workload = _workload(data, size, seed)
+        measured = {}
+        provisioned = None
+        for method, calls in workload.items():
+            if methods is not None and method not in methods:
+                continue
+            datagen.load(dbname, username, password, data)
+            ww = WasteWrangler()
+            ww.connection = pg.connect(
+                dbname=dbname, user=username, password=password,
+                options="-c search_path=waste_wrangler",
+                connection_factory=CountingConnection
+            )
+            if indexes:
+                provisioned = ww.provision_indexes(exclusion)
+                ww.connection.round_trips = ww.connection.rows = 0
+            latencies = []
+            try:
+                with ww.unit_of_work() if unit_of_work else nullcontext():
+                    for call in calls:
+                        start = perf_counter()
+                        call(ww)
+                        latencies.append(perf_counter() - start)
+                    start = perf_counter()
+                latencies[-1] += perf_counter() - start
+                measured[method] = _summary(latencies,
+                                            ww.connection.round_trips,
+                                            ww.connection.rows)
+            finally:
+                ww.disconnect()
+        results["sizes"][name] = {
+            "dataset": {table: len(rows) for table, rows in data.items()},
+            "methods": measured,
+        }
+        if indexes:
+            results["sizes"][name]["provisioned"] = provisioned
+    return results
+
+
+def run_indexes(dbname: str, username: str, password: str, sizes: list[str],
+                seed: int = 343, methods: Optional[list[str]] = None,
+                exclusion: bool = False) -> dict[str, Any]:
+    """Return the measurements of run before and after
+    WasteWrangler.provision_indexes, with the same arguments.
+    """
+    return {
+        "before": run(dbname, username, password, sizes, seed, methods),
+        "after": run(dbname, username, password, sizes, seed, methods,
+                     True, exclusion),
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the benchmarks with the command line arguments <argv>."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dbname")
+    parser.add_argument("username")
+    parser.add_argument("password")
+    parser.add_argument("--sizes", nargs="+", default=["tiny", "small"],
+                        choices=sorted(datagen.SIZES))
+    parser.add_argument("--suite", default="methods",
+                        choices=["methods", "concurrency", "indexes",
+                                 "stress", "queue", "whatif"])
+    parser.add_argument("--exclusion", action="store_true")
+    parser.add_argument("--unit-of-work", action="store_true")
+    parser.add_argument("--methods", nargs="+")
+    parser.add_argument("--callers", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--maxconn", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=[1, 2, 4, 8])
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--scenarios", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=343)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args(argv)
+
+    if args.suite == "concurrency":
+        results = run_concurrency(args.dbname, args.username, args.password,
+                                  args.sizes, args.seed, args.callers,
+                                  args.requests, args.maxconn)
+    elif args.suite == "stress":
+        results = run_stress(args.dbname, args.username, args.password,
+                             args.sizes, args.seed, tuple(args.workers),
+                             args.requests)
+    elif args.suite == "queue":
+        results = run_queue(args.dbname, args.username, args.password,
+                            args.sizes, args.seed, tuple(args.workers),
+                            args.requests, args.batch)
+    elif args.suite == "whatif":
+        results = run_whatif(args.dbname, args.username, args.password,
+                             args.sizes, args.seed, tuple(args.workers),
+                             args.requests, args.scenarios)
+    elif args.suite == "indexes":
+        results = run_indexes(args.dbname, args.username, args.password,
+                              args.sizes, args.seed, args.methods,
+                              args.exclusion)
+    else:
+        results = run(args.dbname, args.username, args.password, args.sizes,
+                      args.seed, args.methods,
+                      unit_of_work=args.unit_of_work)
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
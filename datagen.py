@@ -0,0 +1,261 @@
+"""Synthetic data for the waste_wrangler schema
+
+=== Module Description ===
+
+This file contains a generator of datasets that conform to the schema in
+waste_wrangler_schema.ddl, at configurable sizes, and a function that loads
+such a dataset into a PostgreSQL database.
+
+A dataset is a dict from table name to a list of rows, in the column order of
+the schema. Generation is deterministic for a given size and seed.
+"""
+
+import datetime as dt
+import random
+from typing import TextIO
+
+import psycopg2 as pg
+
+from a2 import _CopyStream, _plan_day
+
+WASTE_TYPES = ["general", "recycling", "compost", "hazardous", "glass",
+               "metal", "paper", "textile"]
+
+FIRST_NAMES = ["Ann", "Bob", "Cat", "Dan", "Eve", "Fay", "Gus", "Hal", "Ivy",
+               "Jon", "Kim", "Lee", "Max", "Nia", "Oto", "Pam", "Quy", "Ray"]
+
+TITLES = ["Mr.", "Ms.", "Mrs.", "Dr.", "Prof."]
+
+# The tables of the schema, in an order in which they can be loaded.
+TABLES = ["trucktype", "truck", "employee", "driver", "technician", "route",
+          "facility", "maintenance", "trip"]
+
+
+class DatasetSize:
+    """The size of a generated dataset.
+
+    === Instance Attributes ===
+    trucks: the number of trucks.
+    employees: the number of employees.
+    routes: the number of routes.
+    facilities: the number of facilities.
+    months: the number of months of trip and maintenance history.
+    start: the first day of the history.
+    """
+    trucks: int
+    employees: int
+    routes: int
+    facilities: int
+    months: int
+    start: dt.date
+
+    def __init__(self, trucks: int, employees: int, routes: int,
+                 facilities: int, months: int,
+                 start: dt.date = dt.date(2023, 1, 1)) -> None:
+        """Initialize a dataset size with the given counts."""
+        self.trucks = trucks
+        self.employees = employees
+        self.routes = routes
+        self.facilities = facilities
+        self.months = months
+        self.start = start
+
+    @property
+    def end(self) -> dt.date:
+        """Return the last day of the history."""
+        return self.start + dt.timedelta(days=30 * self.months - 1)
+
+
+SIZES = {
+    "tiny": DatasetSize(10, 30, 20, 8, 1),
+    "small": DatasetSize(50, 150, 100, 16, 3),
+    "medium": DatasetSize(200, 600, 400, 40, 6),
+    "large": DatasetSize(1000, 3000, 2000, 120, 12),
+}
+
+
+def generate(size: DatasetSize, seed: int = 343) -> dict[str, list[tuple]]:
+    """Return a dataset of the given <size>, generated from <seed>.
+
+    Trips are laid out the way schedule_trips would lay them out: each
+    working truck covers some of the routes it can carry from 8 a.m., with the
+    same crew all day, and no route or employee is used twice on a day.
+    """
+    rand = random.Random(seed)
+    data = {table: [] for table in TABLES}
+
+    #     Truck types each carry one to three waste types, and every waste
+    #     type is carried by at least one truck type
+    trucktypes = {}
+    for i, wastetype in enumerate(WASTE_TYPES * 2):
+        carried = {wastetype} | set(rand.sample(WASTE_TYPES, rand.randint(0, 2)))
+        trucktypes["T" + str(i)] = sorted(carried)
+    for trucktype, carried in trucktypes.items():
+        data["trucktype"].extend((trucktype, w) for w in carried)
+
+    truck_of = {}
+    for tid in range(1, size.trucks + 1):
+        truck_of[tid] = rand.choice(list(trucktypes))
+        data["truck"].append((tid, truck_of[tid],
+                              float(rand.choice([5, 10, 15, 20, 25, 30]))))
+
+    for eid in range(1, size.employees + 1):
+        name = rand.choice(FIRST_NAMES) + " Surname" + str(eid)
+        hired = dt.date(2000, 1, 1) + dt.timedelta(days=rand.randint(0, 8000))
+        data["employee"].append((eid, name, hired))
+
+    #     Most employees drive one or two truck types, and some of the others
+    #     are technicians
+    drivers, technicians = {}, {}
+    for eid in range(1, size.employees + 1):
+        kinds = rand.sample(list(trucktypes), rand.randint(1, 3))
+        if rand.random() < 0.7:
+            drivers[eid] = kinds[:2]
+            data["driver"].extend((eid, t) for t in kinds[:2])
+        elif rand.random() < 0.6:
+            technicians[eid] = kinds
+            data["technician"].extend((eid, t) for t in kinds)
+
+    for rid in range(1, size.routes + 1):
+        data["route"].append((rid, rand.choice(WASTE_TYPES),
+                              rand.choice([2.5, 5.0, 7.5, 10.0, 12.5, 15.0])))
+
+    for fid in range(1, size.facilities + 1):
+        wastetype = WASTE_TYPES[(fid - 1) % len(WASTE_TYPES)]
+        data["facility"].append((fid, str(fid) + " Dump Rd.", wastetype))
+
+    _generate_maintenance(rand, size, data, truck_of, technicians)
+    _generate_trips(rand, size, data, trucktypes, truck_of, drivers)
+    return data
+
+
+def _generate_maintenance(rand: random.Random, size: DatasetSize,
+                          data: dict[str, list[tuple]],
+                          truck_of: dict[int, str],
+                          technicians: dict[int, list[str]]) -> None:
+    """Add maintenance every 60 to 150 days for each truck to <data>."""
+    qualified = {}
+    for eid, kinds in technicians.items():
+        for trucktype in kinds:
+            qualified.setdefault(trucktype, []).append(eid)
+    booked = set()
+    for tid, trucktype in truck_of.items():
+        if trucktype not in qualified:
+            continue
+        day = size.start + dt.timedelta(days=rand.randint(0, 90))
+        while day <= size.end:
+            eid = rand.choice(qualified[trucktype])
+            if (eid, day) not in booked:
+                booked.add((eid, day))
+                data["maintenance"].append((tid, eid, day))
+            day += dt.timedelta(days=rand.randint(60, 150))
+
+
+def _generate_trips(rand: random.Random, size: DatasetSize,
+                    data: dict[str, list[tuple]],
+                    trucktypes: dict[str, list[str]],
+                    truck_of: dict[int, str],
+                    drivers: dict[int, list[str]]) -> None:
+    """Add a day of trips for about half of the trucks on every weekday of
+    the history to <data>.
+    """
+    routes_for = {}
+    for rid, wastetype, length in data["route"]:
+        routes_for.setdefault(wastetype, []).append(
+            (rid, dt.timedelta(minutes=12 * length)))
+    facility_for = {}
+    for fid, _, wastetype in data["facility"]:
+        facility_for.setdefault(wastetype, fid)
+    maintained = {(tid, day) for tid, _, day in data["maintenance"]}
+    employees = [eid for eid, _, _ in data["employee"]]
+
+    day = size.start
+    while day <= size.end:
+        if day.weekday() < 5:
+            free = set(employees)
+            taken = set()
+            trucks = rand.sample(list(truck_of), len(truck_of) // 2)
+            for tid in trucks:
+                if (tid, day) in maintained or len(free) < 2:
+                    continue
+                trucktype = truck_of[tid]
+                able = [eid for eid in free
+                        if trucktype in drivers.get(eid, ())]
+                if not able:
+                    continue
+                driver = rand.choice(able)
+                partner = rand.choice([eid for eid in free if eid != driver])
+                routes = sorted(
+                    (rid, duration, facility_for.get(wastetype))
+                    for wastetype in trucktypes[trucktype]
+                    for rid, duration in routes_for.get(wastetype, [])
+                    if rid not in taken and rand.random() < 0.3
+                )
+                plan = _plan_day(day, routes)
+                if not plan:
+                    continue
+                free -= {driver, partner}
+                for rid, start, fid in plan:
+                    taken.add(rid)
+                    volume = round(rand.uniform(1, 20), 1)
+                    data["trip"].append((rid, tid, start, volume,
+                                         max(driver, partner),
+                                         min(driver, partner), fid))
+        day += dt.timedelta(days=1)
+
+
+def write_qualifications(data: dict[str, list[tuple]], file: TextIO,
+                         entries: int, seed: int = 343) -> None:
+    """Write <entries> entries in the format of the qualifications file on the
+    A2 handout to <file>, naming employees and truck types from <data>.
+
+    About a fifth of the entries are invalid: unknown names or truck types,
+    drivers, or repeats of earlier entries.
+    """
+    rand = random.Random(seed)
+    employees = [name for _, name, _ in data["employee"]]
+    trucktypes = sorted({trucktype for trucktype, _ in data["trucktype"]})
+    lines = []
+    for i in range(entries):
+        name, trucktype = rand.choice(employees), rand.choice(trucktypes)
+        roll = rand.random()
+        if roll < 0.05:
+            name = "Nobody Surname" + str(i)
+        elif roll < 0.1:
+            trucktype = "X" + str(i)
+        if rand.random() < 0.3:
+            name = rand.choice(TITLES) + " " + name
+        lines.append(name + "\n" + trucktype)
+    file.write("\n".join(lines))
+
+
+def load(dbname: str, username: str, password: str,
+         data: dict[str, list[tuple]],
+         schema_path: str = "./waste_wrangler_schema.sql") -> None:
+    """Replace the contents of the database <dbname> with <data>, using the
+    username <username> and password <password>, after creating the schema
+    from the file at <schema_path>.
+    """
+    connection = pg.connect(
+        dbname=dbname, user=username, password=password,
+        options="-c search_path=waste_wrangler"
+    )
+    try:
+        cursor = connection.cursor()
+        with open(schema_path, "r") as schema_file:
+            cursor.execute(schema_file.read())
+        for table in TABLES:
+            cursor.copy_expert("COPY waste_wrangler." + table + " FROM STDIN",
+                               _CopyStream(data[table]))
+        cursor.execute("ANALYZE")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    dataset = generate(SIZES[sys.argv[1] if len(sys.argv) > 1 else "small"])
+    for name in TABLES:
+        print(name, len(dataset[name]))
@@ -0,0 +1,492 @@
+"""A compact in-memory model of the waste_wrangler schema
+
+=== Module Description ===
+
+This file contains the classes that hold the trucks, employees, routes,
+facilities, trips and maintenance of a waste_wrangler database in memory for
+planning, without keeping the rows psycopg2 returns:
+
+    - Truck, Employee, Route and Facility, one object per row, with
+      __slots__ and with their truck and waste types coded as small integers
+      by TypeCodes, so that the truck types an employee drives or a truck
+      type carries are a bitmask,
+    - TripTable and MaintenanceTable, which keep trips and maintenance in
+      columns of machine integers sorted by time, and return the rows of a
+      day by binary search,
+    - Fleet, which holds all of them with hash indexes by ID and by type.
+"""
+
+import datetime as dt
+import itertools
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Optional
+
+# Times of trips are kept as microseconds since _EPOCH, and days of
+# maintenance as their proleptic Gregorian ordinals.
+_EPOCH = dt.datetime(2000, 1, 1)
+_MICROSECOND = dt.timedelta(microseconds=1)
+
+# The number of rows TripTable.extend and MaintenanceTable.extend convert to
+# columns at a time.
+_CHUNK = 4096
+
+
+class TypeCodes:
+    """Small integer codes for the names of truck types or of waste types,
+    given in the order the names are first seen.
+
+    === Instance Attributes ===
+    names: the name of each code, by code.
+    """
+    __slots__ = ("names", "_codes")
+    names: list[str]
+    _codes: dict[str, int]
+
+    def __init__(self) -> None:
+        """Initialize a coding with no names."""
+        self.names = []
+        self._codes = {}
+
+    def __len__(self) -> int:
+        """Return the number of names coded."""
+        return len(self.names)
+
+    def code(self, name: str) -> int:
+        """Return the code of <name>, giving it the next one if it has none.
+        """
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def find(self, name: str) -> Optional[int]:
+        """Return the code of <name>, or None if it has none."""
+        return self._codes.get(name)
+
+    def codes(self, mask: int) -> frozenset[int]:
+        """Return the codes in the bitmask <mask>."""
+        return frozenset(code for code in range(len(self.names))
+                         if mask >> code & 1)
+
+
+class Truck:
+    """A truck.
+
+    === Instance Attributes ===
+    tid: the tID of the truck.
+    trucktype: the code of its truck type.
+    capacity: its capacity.
+    """
+    __slots__ = ("tid", "trucktype", "capacity")
+    tid: int
+    trucktype: int
+    capacity: float
+
+    def __init__(self, tid: int, trucktype: int, capacity: float) -> None:
+        """Initialize truck <tid> of the truck type coded <trucktype>, with
+        the given <capacity>.
+        """
+        self.tid = tid
+        self.trucktype = trucktype
+        self.capacity = capacity
+
+
+class Employee:
+    """An employee.
+
+    === Instance Attributes ===
+    eid: the eID of the employee.
+    hiredate: the day they were hired.
+    drives: the bitmask of the codes of the truck types they can drive.
+    repairs: the bitmask of the codes of the truck types they can work on.
+    """
+    __slots__ = ("eid", "hiredate", "drives", "repairs")
+    eid: int
+    hiredate: dt.date
+    drives: int
+    repairs: int
+
+    def __init__(self, eid: int, hiredate: dt.date) -> None:
+        """Initialize employee <eid>, hired on <hiredate>, who can neither
+        drive nor work on any truck type.
+        """
+        self.eid = eid
+        self.hiredate = hiredate
+        self.drives = 0
+        self.repairs = 0
+
+
+class Route:
+    """A route.
+
+    === Instance Attributes ===
+    rid: the rID of the route.
+    wastetype: the code of its waste type.
+    length: its length, in km.
+    duration: how long a trip on it takes.
+    """
+    __slots__ = ("rid", "wastetype", "length", "duration")
+    rid: int
+    wastetype: int
+    length: float
+    duration: dt.timedelta
+
+    def __init__(self, rid: int, wastetype: int, length: float,
+                 duration: dt.timedelta) -> None:
+        """Initialize route <rid> of the waste type coded <wastetype>, with
+        the given <length> and <duration>.
+        """
+        self.rid = rid
+        self.wastetype = wastetype
+        self.length = length
+        self.duration = duration
+
+
+class Facility:
+    """A facility.
+
+    === Instance Attributes ===
+    fid: the fID of the facility.
+    wastetype: the code of the waste type it takes.
+    """
+    __slots__ = ("fid", "wastetype")
+    fid: int
+    wastetype: int
+
+    def __init__(self, fid: int, wastetype: int) -> None:
+        """Initialize facility <fid>, taking the waste type coded
+        <wastetype>.
+        """
+        self.fid = fid
+        self.wastetype = wastetype
+
+
+class Trip:
+    """A trip, as read from a TripTable.
+
+    === Instance Attributes ===
+    rid: the route of the trip.
+    tid: its truck.
+    ttime: when it starts.
+    eid1: the larger of the eIDs of its crew.
+    eid2: the smaller of them.
+    fid: the facility it delivers to.
+    """
+    __slots__ = ("rid", "tid", "ttime", "eid1", "eid2", "fid")
+    rid: int
+    tid: int
+    ttime: dt.datetime
+    eid1: int
+    eid2: int
+    fid: int
+
+    def __init__(self, rid: int, tid: int, ttime: dt.datetime, eid1: int,
+                 eid2: int, fid: int) -> None:
+        """Initialize a trip on route <rid> with truck <tid> at <ttime>,
+        crewed by <eid1> and <eid2>, to facility <fid>.
+        """
+        self.rid = rid
+        self.tid = tid
+        self.ttime = ttime
+        self.eid1 = eid1
+        self.eid2 = eid2
+        self.fid = fid
+
+
+class Maintenance:
+    """A maintenance, as read from a MaintenanceTable.
+
+    === Instance Attributes ===
+    tid: the truck maintained.
+    eid: the technician who maintains it.
+    mdate: the day of the maintenance.
+    """
+    __slots__ = ("tid", "eid", "mdate")
+    tid: int
+    eid: int
+    mdate: dt.date
+
+    def __init__(self, tid: int, eid: int, mdate: dt.date) -> None:
+        """Initialize the maintenance of truck <tid> by <eid> on <mdate>."""
+        self.tid = tid
+        self.eid = eid
+        self.mdate = mdate
+
+
+class TripTable:
+    """Trips, kept in one array per column, in order of start time.
+
+    === Instance Attributes ===
+    rids: the rID of each trip.
+    tids: the tID of each trip.
+    starts: the start time of each trip, in microseconds since _EPOCH, in
+    ascending order.
+    eid1s: the eID1 of each trip.
+    eid2s: the eID2 of each trip.
+    fids: the fID of each trip.
+    """
+    __slots__ = ("rids", "tids", "starts", "eid1s", "eid2s", "fids")
+    rids: array
+    tids: array
+    starts: array
+    eid1s: array
+    eid2s: array
+    fids: array
+
+    def __init__(self, rids: Iterable[int] = (), tids: Iterable[int] = (),
+                 ttimes: Iterable[dt.datetime] = (),
+                 eid1s: Iterable[int] = (), eid2s: Iterable[int] = (),
+                 fids: Iterable[int] = ()) -> None:
+        """Initialize a table of the trips with the given columns.
+
+        Pre-condition:
+            <ttimes> is in ascending order.
+        """
+        self.rids, self.tids = array("i", rids), array("i", tids)
+        self.starts = array("q", [(ttime - _EPOCH) // _MICROSECOND
+                                  for ttime in ttimes])
+        self.eid1s, self.eid2s = array("i", eid1s), array("i", eid2s)
+        self.fids = array("i", fids)
+
+    def __len__(self) -> int:
+        """Return the number of trips."""
+        return len(self.rids)
+
+    def extend(self, trips: Iterable[tuple[int, int, dt.datetime, int, int,
+                                           int]]) -> None:
+        """Append the (rID, tID, tTime, eID1, eID2, fID) <trips>, consuming
+        them _CHUNK at a time.
+
+        Pre-condition:
+            <trips> start in ascending order, none before the last trip in
+            this table.
+        """
+        trips = iter(trips)
+        while True:
+            rows = list(itertools.islice(trips, _CHUNK))
+            if not rows:
+                return
+            rids, tids, ttimes, eid1s, eid2s, fids = zip(*rows)
+            self.rids.extend(rids)
+            self.tids.extend(tids)
+            self.starts.extend([(ttime - _EPOCH) // _MICROSECOND
+                                for ttime in ttimes])
+            self.eid1s.extend(eid1s)
+            self.eid2s.extend(eid2s)
+            self.fids.extend(fids)
+
+    def __getitem__(self, i: int) -> Trip:
+        """Return trip <i>."""
+        return Trip(*self.row(i))
+
+    def row(self, i: int) -> tuple[int, int, dt.datetime, int, int, int]:
+        """Return trip <i> as (rID, tID, tTime, eID1, eID2, fID)."""
+        return (self.rids[i], self.tids[i],
+                _EPOCH + self.starts[i] * _MICROSECOND, self.eid1s[i],
+                self.eid2s[i], self.fids[i])
+
+    def between(self, start: dt.datetime, end: dt.datetime) -> range:
+        """Return the indexes of the trips that start at or after <start>
+        and before <end>.
+        """
+        return range(
+            bisect_left(self.starts, (start - _EPOCH) // _MICROSECOND),
+            bisect_left(self.starts, (end - _EPOCH) // _MICROSECOND))
+
+    def on(self, day: dt.date
+           ) -> list[tuple[int, int, dt.datetime, int, int, int]]:
+        """Return the (rID, tID, tTime, eID1, eID2, fID) of the trips that
+        start on <day>, in order of start time.
+        """
+        midnight = dt.datetime.combine(day, dt.time())
+        return [self.row(i) for i in self.between(
+            midnight, midnight + dt.timedelta(days=1))]
+
+
+class MaintenanceTable:
+    """Maintenance, kept in one array per column, in order of day.
+
+    === Instance Attributes ===
+    tids: the tID of each maintenance.
+    eids: the eID of each maintenance.
+    days: the day of each maintenance, as its ordinal, in ascending order.
+    """
+    __slots__ = ("tids", "eids", "days")
+    tids: array
+    eids: array
+    days: array
+
+    def __init__(self, tids: Iterable[int] = (), eids: Iterable[int] = (),
+                 mdates: Iterable[dt.date] = ()) -> None:
+        """Initialize a table of the maintenance with the given columns.
+
+        Pre-condition:
+            <mdates> is in ascending order.
+        """
+        self.tids, self.eids = array("i", tids), array("i", eids)
+        self.days = array("i", [mdate.toordinal() for mdate in mdates])
+
+    def __len__(self) -> int:
+        """Return the number of maintenance."""
+        return len(self.tids)
+
+    def extend(self, maintenance: Iterable[tuple[int, int, dt.date]]
+               ) -> None:
+        """Append the (tID, eID, mDate) <maintenance>, consuming them _CHUNK
+        at a time.
+
+        Pre-condition:
+            <maintenance> is in ascending order of day, none before the last
+            day in this table.
+        """
+        maintenance = iter(maintenance)
+        while True:
+            rows = list(itertools.islice(maintenance, _CHUNK))
+            if not rows:
+                return
+            tids, eids, mdates = zip(*rows)
+            self.tids.extend(tids)
+            self.eids.extend(eids)
+            self.days.extend([mdate.toordinal() for mdate in mdates])
+
+    def __getitem__(self, i: int) -> Maintenance:
+        """Return maintenance <i>."""
+        return Maintenance(self.tids[i], self.eids[i],
+                           dt.date.fromordinal(self.days[i]))
+
+    def on(self, day: dt.date) -> list[tuple[int, int]]:
+        """Return the (tID, eID) of the maintenance on <day>."""
+        ordinal = day.toordinal()
+        return [(self.tids[i], self.eids[i]) for i in range(
+            bisect_left(self.days, ordinal),
+            bisect_left(self.days, ordinal + 1))]
+
+
+class Fleet:
+    """The trucks, employees, routes, facilities, trips and maintenance of a
+    waste_wrangler database, indexed by ID and by type.
+
+    === Instance Attributes ===
+    trucktypes: the codes of the truck types.
+    wastetypes: the codes of the waste types.
+    carries: the bitmask of the codes of the waste types each truck type
+    carries, by the code of the truck type.
+    trucks: every truck, by tID.
+    employees: every employee, by eID.
+    preferred: every employee, in order of preference: by hireDate, then eID.
+    routes: every route, by rID.
+    facilities: every facility, by fID.
+    trips: every trip.
+    maintenance: every maintenance.
+    """
+    trucktypes: TypeCodes
+    wastetypes: TypeCodes
+    carries: dict[int, int]
+    trucks: dict[int, Truck]
+    employees: dict[int, Employee]
+    preferred: list[Employee]
+    routes: dict[int, Route]
+    facilities: dict[int, Facility]
+    trips: TripTable
+    maintenance: MaintenanceTable
+    _carrying: dict[int, list[Truck]]
+    _carried: dict[int, list[Route]]
+    _facilities: dict[int, list[Facility]]
+    _drivers: dict[int, frozenset[int]]
+    _technicians: dict[int, list[int]]
+
+    def __init__(self, trucktypes: Iterable[tuple[str, str]],
+                 trucks: Iterable[tuple[int, str, float]],
+                 employees: Iterable[tuple[int, dt.date]],
+                 drivers: Iterable[tuple[int, str]],
+                 technicians: Iterable[tuple[int, str]],
+                 routes: Iterable[tuple[int, str, float, dt.timedelta]],
+                 facilities: Iterable[tuple[int, str]],
+                 maintenance: MaintenanceTable, trips: TripTable) -> None:
+        """Initialize a fleet from the rows of each table: the (truck type,
+        waste type) <trucktypes>, the (tID, truck type, capacity) <trucks>,
+        the (eID, hireDate) <employees>, the (eID, truck type) <drivers> and
+        <technicians>, the (rID, waste type, length, duration) <routes>, the
+        (fID, waste type) <facilities>, and the tables of <maintenance> and
+        <trips>.
+        """
+        self.trucktypes = TypeCodes()
+        self.wastetypes = TypeCodes()
+        self.carries = {}
+        for trucktype, wastetype in trucktypes:
+            code = self.trucktypes.code(trucktype)
+            self.carries[code] = (self.carries.get(code, 0)
+                                  | 1 << self.wastetypes.code(wastetype))
+        self.trucks = {tid: Truck(tid, self.trucktypes.code(trucktype),
+                                  capacity)
+                       for tid, trucktype, capacity in trucks}
+        self.employees = {eid: Employee(eid, hiredate)
+                          for eid, hiredate in employees}
+        self.preferred = sorted(self.employees.values(),
+                                key=lambda e: (e.hiredate, e.eid))
+        for eid, trucktype in drivers:
+            self.employees[eid].drives |= 1 << self.trucktypes.code(trucktype)
+        for eid, trucktype in technicians:
+            self.employees[eid].repairs |= 1 << self.trucktypes.code(
+                trucktype)
+        self.routes = {rid: Route(rid, self.wastetypes.code(wastetype),
+                                  length, duration)
+                       for rid, wastetype, length, duration in routes}
+        self.facilities = {fid: Facility(fid, self.wastetypes.code(wastetype))
+                           for fid, wastetype in facilities}
+        self.maintenance = maintenance
+        self.trips = trips
+
+        #     Index the trucks, routes, facilities and employees by type
+        self._carrying, self._carried, self._facilities = {}, {}, {}
+        for truck in sorted(self.trucks.values(),
+                            key=lambda truck: (-truck.capacity, truck.tid)):
+            for wastetype in self.wastetypes.codes(
+                    self.carries.get(truck.trucktype, 0)):
+                self._carrying.setdefault(wastetype, []).append(truck)
+        for rid in sorted(self.routes):
+            route = self.routes[rid]
+            for trucktype, carried in self.carries.items():
+                if carried >> route.wastetype & 1:
+                    self._carried.setdefault(trucktype, []).append(route)
+        for fid in sorted(self.facilities):
+            self._facilities.setdefault(self.facilities[fid].wastetype,
+                                        []).append(self.facilities[fid])
+        self._drivers, self._technicians = {}, {}
+        for code in range(len(self.trucktypes)):
+            self._drivers[code] = frozenset(
+                e.eid for e in self.preferred if e.drives >> code & 1)
+            self._technicians[code] = sorted(
+                e.eid for e in self.preferred if e.repairs >> code & 1)
+
+    def trucks_carrying(self, wastetype: int) -> list[Truck]:
+        """Return the trucks that can carry the waste type coded <wastetype>,
+        by largest capacity and then lowest tID.
+        """
+        return self._carrying.get(wastetype, [])
+
+    def routes_carried_by(self, trucktype: int) -> list[Route]:
+        """Return the routes whose waste type the truck type coded
+        <trucktype> can carry, in ascending order of rID.
+        """
+        return self._carried.get(trucktype, [])
+
+    def facilities_taking(self, wastetype: int) -> list[Facility]:
+        """Return the facilities that take the waste type coded <wastetype>,
+        in ascending order of fID.
+        """
+        return self._facilities.get(wastetype, [])
+
+    def drivers_of(self, trucktype: int) -> frozenset[int]:
+        """Return the eIDs of the employees who can drive the truck type
+        coded <trucktype>.
+        """
+        return self._drivers.get(trucktype, frozenset())
+
+    def technicians_for(self, trucktype: int) -> list[int]:
+        """Return the eIDs of the employees who can work on the truck type
+        coded <trucktype>, in ascending order.
+        """
+        return self._technicians.get(trucktype, [])
@@ -0,0 +1,513 @@
+"""A durable queue of WasteWrangler method calls
+
+=== Module Description ===
+
+This file contains the JobQueue class, through which callers enqueue calls to
+the scheduling methods of WasteWrangler as jobs in the table ww_job, and the
+JobWorker class, which runs them on a WasteWrangler of its own. Any number of
+workers, in any number of processes or on any number of hosts, can serve the
+same queue; run_workers starts several worker processes on this host.
+
+A worker claims jobs with SELECT ... FOR UPDATE SKIP LOCKED, so no two
+workers claim the same job and none waits for another, and commits the claim
+at once, counting an attempt of each job. It then locks the jobs again, runs
+them and records their results within one WasteWrangler.unit_of_work: a job
+is done exactly when its changes are committed. If the worker dies, or the
+commit fails, its jobs are queued again once _CLAIM_LEASE has passed, with
+the attempt still counted, so that a job that kills its worker is not
+retried forever. Jobs that raise, or whose work is rolled back after a
+database error, are retried after a delay that doubles with each attempt,
+until they have been attempted <max_attempts> times.
+
+Arguments and results are stored as JSON, with dates and times as ISO 8601
+strings.
+"""
+
+import datetime as dt
+import json
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic, perf_counter, sleep
+from typing import Any, Callable, Optional
+
+import psycopg2 as pg
+
+from a2 import UnitOfWork, WasteWrangler, _statement
+
+
+# How long a claimed job is not due for, so that no other worker claims it
+# before the worker that claimed it locks it to run it, and after which it is
+# queued again if that worker died.
+_CLAIM_LEASE = dt.timedelta(seconds=30)
+
+# The WasteWrangler methods that can be run as jobs, and how each of their
+# arguments is read back from JSON.
+_JOB_METHODS: dict[str, tuple[Callable[[Any], Any], ...]] = {
+    "schedule_trip": (int, dt.datetime.fromisoformat),
+    "schedule_trips": (int, dt.date.fromisoformat),
+    "reroute_waste": (int, dt.date.fromisoformat),
+    "schedule_maintenance": (dt.date.fromisoformat,),
+}
+
+# The job table, and the index workers find the queued jobs with. A job being
+# run is still 'queued', but locked by the worker running it.
+_JOB_TABLE = """
+    CREATE TABLE IF NOT EXISTS waste_wrangler.ww_job (
+        jid BIGSERIAL PRIMARY KEY,
+        method TEXT NOT NULL,
+        args JSONB NOT NULL,
+        state TEXT NOT NULL DEFAULT 'queued'
+            CHECK (state IN ('queued', 'done', 'failed')),
+        attempts INT NOT NULL DEFAULT 0,
+        max_attempts INT NOT NULL,
+        run_after TIMESTAMP NOT NULL DEFAULT localtimestamp,
+        enqueued TIMESTAMP NOT NULL DEFAULT localtimestamp,
+        started TIMESTAMP,
+        finished TIMESTAMP,
+        worker TEXT,
+        result JSONB,
+        error TEXT,
+        seconds FLOAT
+    );
+    CREATE INDEX IF NOT EXISTS ww_job_queued
+        ON waste_wrangler.ww_job (jid) WHERE state = 'queued';
+"""
+
+# Jobs with methods $1 and arguments $2, each to be attempted at most $3
+# times, in order.
+_ENQUEUE_JOBS = _statement("enqueue_jobs", ("text[]", "text[]", "int"), """
+    INSERT INTO waste_wrangler.ww_job (method, args, max_attempts)
+    SELECT j.method, j.args::jsonb, $3
+    FROM unnest($1, $2) WITH ORDINALITY j(method, args, n)
+    ORDER BY j.n
+    RETURNING jid
+""")
+
+# Claim up to $1 of the oldest queued jobs that are due and not locked by
+# another worker for worker $2, as attempted once more and not due again for
+# $3. Jobs already attempted as many times as they may be, by workers that
+# died or failed to commit, fail instead.
+_CLAIM_JOBS = _statement("claim_jobs", ("int", "text", "interval"), """
+    WITH due AS (
+        SELECT q.jid FROM waste_wrangler.ww_job q
+        WHERE q.state = 'queued'
+          AND q.run_after <= localtimestamp
+        ORDER BY q.jid
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    ), exhausted AS (
+        UPDATE waste_wrangler.ww_job j
+        SET state = 'failed', finished = clock_timestamp()::timestamp,
+            error = 'abandoned on its last attempt'
+        FROM due
+        WHERE j.jid = due.jid AND j.attempts >= j.max_attempts
+    )
+    UPDATE waste_wrangler.ww_job j
+    SET attempts = j.attempts + 1, worker = $2,
+        started = clock_timestamp()::timestamp, finished = NULL,
+        run_after = clock_timestamp()::timestamp + $3
+    FROM due
+    WHERE j.jid = due.jid AND j.attempts < j.max_attempts
+    RETURNING j.jid, j.method, j.args, j.attempts, j.max_attempts
+""")
+
+# Lock each job of $1 that is still queued at the attempt of it in $2, unless
+# another worker has locked it, and return its jID.
+_LOCK_CLAIMED_JOBS = _statement(
+    "lock_claimed_jobs", ("bigint[]", "int[]"), """
+    SELECT j.jid
+    FROM waste_wrangler.ww_job j
+         JOIN unnest($1, $2) c(jid, attempts)
+           ON c.jid = j.jid AND c.attempts = j.attempts
+    WHERE j.state = 'queued'
+    FOR UPDATE OF j SKIP LOCKED
+""")
+
+# Record that job $1, run by worker $6 for $5 seconds, is now in state $2
+# with result $3 or error $4, and is not due again for $7.
+_FINISH_JOB = _statement(
+    "finish_job",
+    ("bigint", "text", "jsonb", "text", "float8", "text", "interval"), """
+    UPDATE waste_wrangler.ww_job
+    SET state = $2, result = $3, error = $4, seconds = $5, worker = $6,
+        started = clock_timestamp()::timestamp
+                  - $5 * interval '1 second',
+        finished = clock_timestamp()::timestamp,
+        run_after = clock_timestamp()::timestamp + $7
+    WHERE jid = $1
+""")
+
+_JOB = _statement("job", ("bigint",), """
+    SELECT jid, method, args, state, attempts, max_attempts, enqueued,
+           started, finished, worker, result, error, seconds
+    FROM waste_wrangler.ww_job
+    WHERE jid = $1
+""")
+
+# For each method, the number of its jobs in each state, and the mean
+# seconds its finished jobs waited to be started and took to run.
+_JOB_REPORT = _statement("job_report", (), """
+    SELECT method,
+           count(*) FILTER (WHERE state = 'queued'),
+           count(*) FILTER (WHERE state = 'done'),
+           count(*) FILTER (WHERE state = 'failed'),
+           coalesce(avg(extract(epoch FROM started - enqueued))
+                    FILTER (WHERE finished IS NOT NULL), 0),
+           coalesce(avg(seconds) FILTER (WHERE finished IS NOT NULL), 0)
+    FROM waste_wrangler.ww_job
+    GROUP BY method
+""")
+
+
+class Job:
+    """A call to a WasteWrangler method enqueued in a JobQueue.
+
+    === Instance Attributes ===
+    jid: the ID of the job.
+    method: the name of the method.
+    args: the arguments of the call, as stored if <method> cannot take
+    them.
+    state: 'queued' until the job is done, or has failed on its last attempt.
+    attempts: the number of times the job has been attempted.
+    max_attempts: the number of times the job may be attempted.
+    enqueued: when the job was enqueued.
+    started: when the job's last attempt started, if any.
+    finished: when the job's last attempt finished, if any.
+    worker: the name of the worker that made the last attempt, if any.
+    result: the value the method returned, if the job is done.
+    error: why the last attempt failed, if it did.
+    seconds: how long the last attempt took, if any.
+    """
+    jid: int
+    method: str
+    args: tuple
+    state: str
+    attempts: int
+    max_attempts: int
+    enqueued: dt.datetime
+    started: Optional[dt.datetime]
+    finished: Optional[dt.datetime]
+    worker: Optional[str]
+    result: Any
+    error: Optional[str]
+    seconds: Optional[float]
+
+    def __init__(self, row: tuple) -> None:
+        """Initialize a job from a <row> of the job table."""
+        (self.jid, self.method, args, self.state, self.attempts,
+         self.max_attempts, self.enqueued, self.started, self.finished,
+         self.worker, self.result, self.error, self.seconds) = row
+        try:
+            self.args = _decode_args(self.method, args)
+        except (TypeError, ValueError):
+            self.args = tuple(args)
+
+
+class JobQueue:
+    """The queue of jobs in the database of a WasteWrangler.
+
+    === Instance Attributes ===
+    wrangler: the WasteWrangler whose connection the queue is reached by.
+    """
+    wrangler: WasteWrangler
+
+    def __init__(self, wrangler: WasteWrangler) -> None:
+        """Initialize a queue reached by the connection of <wrangler>."""
+        self.wrangler = wrangler
+
+    def provision(self) -> bool:
+        """Create the job table, if it does not exist yet.
+
+        Return True iff the table exists afterwards.
+        """
+        try:
+            with self.wrangler._transaction() as connection:
+                connection.cursor().execute(_JOB_TABLE)
+            return True
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return False
+
+    def enqueue(self, method: str, *args: Any, max_attempts: int = 3) -> int:
+        """Enqueue a call of the WasteWrangler method <method> with <args>,
+        to be attempted at most <max_attempts> times.
+
+        Return the jID of the job, or 0 if it could not be enqueued, e.g.
+        because <method> cannot be run as a job.
+
+        >>> ww = WasteWrangler()
+        >>> ww.connect("csc343h-marinat", "marinat", "")
+        True
+        >>> queue = JobQueue(ww)
+        >>> queue.provision()
+        True
+        >>> queue.enqueue("schedule_trips", 2, dt.date(2023, 5, 4))
+        1
+        """
+        return self.enqueue_many([(method, args)], max_attempts)[0]
+
+    def enqueue_many(self, jobs: list[tuple[str, tuple]],
+                     max_attempts: int = 3) -> list[int]:
+        """Enqueue the calls <jobs>, as (method, arguments) pairs, each to be
+        attempted at most <max_attempts> times, in one statement.
+
+        Return the jID of each job, in order. If any of them cannot be
+        enqueued, none is, and every jID is 0.
+        """
+        if any(method not in _JOB_METHODS for method, _ in jobs):
+            return [0] * len(jobs)
+        try:
+            with self.wrangler._transaction() as connection:
+                cursor = connection.cursor()
+                self.wrangler.statements.execute(cursor, _ENQUEUE_JOBS, (
+                    [method for method, _ in jobs],
+                    [json.dumps(args, default=_encode) for _, args in jobs],
+                    max_attempts
+                ))
+                return [jid for jid, in cursor.fetchall()]
+        except (pg.Error, TypeError) as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return [0] * len(jobs)
+
+    def job(self, jid: int) -> Optional[Job]:
+        """Return the job <jid>, or None if there is no such job or it could
+        not be read.
+        """
+        try:
+            with self.wrangler._transaction() as connection:
+                cursor = connection.cursor()
+                self.wrangler.statements.execute(cursor, _JOB, (jid,))
+                row = cursor.fetchone()
+                return None if row is None else Job(row)
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return None
+
+    def wait(self, jid: int, timeout: float,
+             poll_interval: float = 0.1) -> Optional[Job]:
+        """Return the job <jid> once it is done or has failed, checking every
+        <poll_interval> seconds, or None if that takes longer than <timeout>
+        seconds.
+        """
+        deadline = monotonic() + timeout
+        while True:
+            job = self.job(jid)
+            if job is not None and job.state != "queued":
+                return job
+            if monotonic() >= deadline:
+                return None
+            sleep(poll_interval)
+
+    def report(self) -> dict[str, dict[str, float]]:
+        """Return, for each method with jobs, the number of its jobs that are
+        queued, done and failed, and the mean seconds its attempted jobs
+        waited before their last attempt and took to run.
+        """
+        try:
+            with self.wrangler._transaction() as connection:
+                cursor = connection.cursor()
+                self.wrangler.statements.execute(cursor, _JOB_REPORT)
+                return {
+                    method: {"queued": queued, "done": done,
+                             "failed": failed, "wait_seconds": float(wait),
+                             "run_seconds": float(run)}
+                    for method, queued, done, failed, wait, run
+                    in cursor.fetchall()
+                }
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return {}
+
+
+class JobWorker:
+    """Runs the jobs of a JobQueue on a WasteWrangler.
+
+    === Instance Attributes ===
+    wrangler: the WasteWrangler the jobs are run on.
+    name: the name the worker records on the jobs it runs.
+    batch: the number of jobs claimed, run and committed together.
+    backoff: the seconds a job is delayed after its first failed attempt.
+    processed: the number of job attempts this worker has committed.
+    failed: the number of those attempts that failed.
+    """
+    wrangler: WasteWrangler
+    name: str
+    batch: int
+    backoff: float
+    processed: int
+    failed: int
+
+    def __init__(self, wrangler: WasteWrangler, name: Optional[str] = None,
+                 batch: int = 1, backoff: float = 1.0) -> None:
+        """Initialize a worker running jobs on <wrangler>, <batch> at a time,
+        named <name>, or after its host and process if <name> is None.
+        """
+        self.wrangler = wrangler
+        self.name = name or socket.gethostname() + ":" + str(os.getpid())
+        self.batch = batch
+        self.backoff = backoff
+        self.processed = 0
+        self.failed = 0
+
+    def run_once(self) -> int:
+        """Claim up to <batch> due jobs, committing an attempt of each, then
+        run them, and commit their changes and results together.
+
+        Return the number of jobs attempted and committed. If the commit
+        fails, the jobs are queued again once _CLAIM_LEASE has passed, and 0
+        is returned.
+        """
+        try:
+            with self.wrangler._transaction() as connection:
+                cursor = connection.cursor()
+                self.wrangler.statements.execute(cursor, _CLAIM_JOBS, (
+                    self.batch, self.name, _CLAIM_LEASE
+                ))
+                claimed = sorted(cursor.fetchall())
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
+        if not claimed:
+            return 0
+
+        attempted = failed = 0
+        try:
+            with self.wrangler.unit_of_work() as unit:
+                cursor = unit.connection.cursor()
+                #     Leave out any job whose lease ran out and that another
+                #     worker claimed since
+                self.wrangler.statements.execute(cursor, _LOCK_CLAIMED_JOBS, (
+                    [job[0] for job in claimed], [job[3] for job in claimed]
+                ))
+                locked = {jid for jid, in cursor.fetchall()}
+                for jid, method, args, attempts, max_attempts in claimed:
+                    if jid not in locked:
+                        continue
+                    error, result, seconds = self._run(unit, method, args)
+                    if error is None:
+                        state, delay = "done", dt.timedelta(0)
+                    else:
+                        failed += 1
+                        state = ("queued" if attempts < max_attempts
+                                 else "failed")
+                        delay = dt.timedelta(
+                            seconds=self.backoff * 2 ** (attempts - 1))
+                    self.wrangler.statements.execute(cursor, _FINISH_JOB, (
+                        jid, state, None if error else json.dumps(result),
+                        error, seconds, self.name, delay
+                    ))
+                    attempted += 1
+        except pg.Error as ex:
+            # You may find it helpful to uncomment this line while debugging,
+            # as it will show you all the details of the error that occurred:
+            # raise ex
+            return 0
+        if not unit.committed:
+            return 0
+        self.processed += attempted
+        self.failed += failed
+        return attempted
+
+    def run(self, idle_timeout: float = 1.0, poll_interval: float = 0.1,
+            max_jobs: Optional[int] = None) -> int:
+        """Run jobs until none has been due for <idle_timeout> seconds, or
+        <max_jobs> jobs have been attempted, waiting <poll_interval> seconds
+        whenever none is due.
+
+        Return the number of jobs attempted.
+        """
+        attempted = 0
+        idle_since = monotonic()
+        while max_jobs is None or attempted < max_jobs:
+            count = self.run_once()
+            if count:
+                attempted += count
+                idle_since = monotonic()
+            elif monotonic() - idle_since >= idle_timeout:
+                break
+            else:
+                sleep(poll_interval)
+        return attempted
+
+    def _run(self, unit: UnitOfWork, method: str, args: list
+             ) -> tuple[Optional[str], Any, float]:
+        """Run the job calling <method> with the JSON arguments <args> within
+        <unit>, and return why it failed, or None if it did not, what it
+        returned, and how many seconds it took.
+        """
+        failed = unit.failed
+        start = perf_counter()
+        try:
+            result = getattr(self.wrangler, method)(
+                *_decode_args(method, args))
+        except Exception as ex:
+            error = type(ex).__name__ + ": " + str(ex)
+            return error, None, perf_counter() - start
+        seconds = perf_counter() - start
+        if unit.failed > failed:
+            return "rolled back after a database error", None, seconds
+        return None, result, seconds
+
+
+def _encode(value: object) -> str:
+    """Return <value>, a date or time, as an ISO 8601 string for JSON."""
+    if isinstance(value, (dt.date, dt.time)):
+        return value.isoformat()
+    raise TypeError("cannot store " + type(value).__name__ + " in a job")
+
+
+def _decode_args(method: str, args: list) -> tuple:
+    """Return the arguments <args> of a job calling <method>, as read from
+    JSON, as the values <method> takes.
+    """
+    if method not in _JOB_METHODS:
+        raise ValueError("cannot run " + method + " as a job")
+    return tuple(read(arg) for read, arg in zip(_JOB_METHODS[method], args))
+
+
+def _work(dbname: str, username: str, password: str, batch: int,
+          idle_timeout: float) -> tuple[int, int]:
+    """Run the jobs of the queue in the database <dbname>, using the
+    username <username> and password <password>, in a worker process, until
+    none has been due for <idle_timeout> seconds. Return the number of jobs
+    attempted and of those that failed.
+    """
+    ww = WasteWrangler()
+    if not ww.connect(dbname, username, password):
+        return 0, 0
+    try:
+        worker = JobWorker(ww, batch=batch)
+        worker.run(idle_timeout)
+        return worker.processed, worker.failed
+    finally:
+        ww.disconnect()
+
+
+def run_workers(dbname: str, username: str, password: str, processes: int,
+                batch: int = 1, idle_timeout: float = 1.0
+                ) -> list[tuple[int, int]]:
+    """Run the jobs of the queue in the database <dbname>, using the
+    username <username> and password <password>, on <processes> worker
+    processes, each claiming <batch> jobs at a time, until none has been due
+    for <idle_timeout> seconds.
+
+    Return, for each process, the number of jobs it attempted and of those
+    that failed.
+    """
+    with ProcessPoolExecutor(processes) as executor:
+        return list(executor.map(
+            _work, [dbname] * processes, [username] * processes,
+            [password] * processes, [batch] * processes,
+            [idle_timeout] * processes
+        ))
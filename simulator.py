@@ -0,0 +1,477 @@
+"""Dry runs of the WasteWrangler scheduling methods
+
+=== Module Description ===
+
+This file contains take_snapshot, which loads what the scheduling methods of
+WasteWrangler read from a waste_wrangler database into a Snapshot, and the
+Simulation class, which runs schedule_trip, schedule_trips,
+schedule_maintenance and reroute_waste against a Snapshot in memory, with
+the same results as the methods would have on the database, without writing
+to it.
+
+A Scenario describes an alternative to try: a sequence of such calls, with
+some trucks taken out of service and some facilities closed. simulate runs
+many scenarios against the same snapshot, on a pool of processes that each
+receive the snapshot once.
+"""
+
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Any, Iterable, Optional
+
+import psycopg2 as pg
+
+from a2 import (DayAvailability, WasteWrangler, _DayTrips,
+                _MAINTENANCE_HORIZON, _TRIP_DURATION, _TRIP_GAP, _pick_crew,
+                _place_trip, _plan_day, _solve_maintenance, _statement)
+from domain import Fleet, MaintenanceTable, TripTable
+
+# The reference tables the scheduling methods read, in one statement, with the
+# columns of each table aggregated in the same order.
+_SNAPSHOT = _statement("snapshot", (), """
+    SELECT *
+    FROM (SELECT array_agg(trucktype), array_agg(wastetype)
+          FROM waste_wrangler.trucktype) tt,
+         (SELECT array_agg(tid), array_agg(trucktype), array_agg(capacity)
+          FROM waste_wrangler.truck) tk,
+         (SELECT array_agg(eid), array_agg(hiredate)
+          FROM waste_wrangler.employee) e,
+         (SELECT array_agg(eid), array_agg(trucktype)
+          FROM waste_wrangler.driver) d,
+         (SELECT array_agg(eid), array_agg(trucktype)
+          FROM waste_wrangler.technician) tc,
+         (SELECT array_agg(r.rid), array_agg(r.wastetype),
+                 array_agg(r.length), array_agg(""" + _TRIP_DURATION + """)
+          FROM waste_wrangler.route r) r,
+         (SELECT array_agg(fid), array_agg(wastetype)
+          FROM waste_wrangler.facility) f
+""")
+
+# The maintenance and trips the scheduling methods can look at from $1 on, or
+# all of them if $1 is NULL, in order of time and then of primary key.
+_SNAPSHOT_MAINTENANCE = _statement("snapshot_maintenance", ("date",), """
+    SELECT tid, eid, mdate
+    FROM waste_wrangler.maintenance
+    WHERE $1 IS NULL OR mdate >= $1 - 90
+    ORDER BY mdate, tid
+""")
+
+_SNAPSHOT_TRIPS = _statement("snapshot_trips", ("date",), """
+    SELECT rid, tid, ttime, eid1, eid2, fid
+    FROM waste_wrangler.trip
+    WHERE $1 IS NULL OR ttime > $1 - (
+        SELECT coalesce(max(r.length), 0) * interval '12 minutes'
+        FROM waste_wrangler.route r)
+    ORDER BY ttime, rid
+""")
+
+
+class Snapshot:
+    """What the scheduling methods read from a waste_wrangler database at
+    one point in time.
+
+    === Instance Attributes ===
+    start: the first day the snapshot can be simulated from, or None if it
+    holds every trip and maintenance.
+    taken_at: when the snapshot was taken.
+    fleet: the trucks, employees, routes, facilities, trips and maintenance
+    read.
+    """
+    start: Optional[dt.date]
+    taken_at: dt.datetime
+    fleet: Fleet
+
+    def __init__(self, start: Optional[dt.date], row: tuple,
+                 maintenance: MaintenanceTable, trips: TripTable) -> None:
+        """Initialize a snapshot from <start> of the reference tables in the
+        <row> read by _SNAPSHOT, and of <maintenance> and <trips>.
+        """
+        (tt_types, tt_wastes, tids, tk_types, capacities, eids, hiredates,
+         d_eids, d_types, tc_eids, tc_types, rids, r_wastes, lengths,
+         durations, fids, f_wastes) = [column or [] for column in row]
+        self.start = start
+        self.taken_at = dt.datetime.now()
+        self.fleet = Fleet(
+            zip(tt_types, tt_wastes), zip(tids, tk_types, capacities),
+            zip(eids, hiredates), zip(d_eids, d_types),
+            zip(tc_eids, tc_types), zip(rids, r_wastes, lengths, durations),
+            zip(fids, f_wastes), maintenance, trips)
+
+
+class Simulation:
+    """A dry run of WasteWrangler scheduling methods against a Snapshot.
+
+    The methods behave as the WasteWrangler methods of the same name would
+    on the database the snapshot was taken from, with the trips and
+    maintenance of the earlier calls of this simulation added, except that
+    the trucks out of service are neither scheduled nor maintained and the
+    closed facilities receive no trips.
+
+    === Instance Attributes ===
+    snapshot: the snapshot the simulation starts from.
+    out_of_service: the tIDs of the trucks taken out of service.
+    closed: the fIDs of the closed facilities.
+    trips: the trips scheduled, as (rID, tID, tTime, eID1, eID2, fID).
+    maintenance: the maintenance scheduled, as (tID, eID, mDate).
+    rerouted: the trips rerouted, as (rID, tTime, old fID, new fID).
+
+    Representation invariants:
+    - Every day in _trips, _maintenance and _days is on or after the start
+      of <snapshot>, or the day before it.
+    """
+    snapshot: Snapshot
+    out_of_service: frozenset[int]
+    closed: frozenset[int]
+    trips: list[tuple[int, int, dt.datetime, int, int, int]]
+    maintenance: list[tuple[int, int, dt.date]]
+    rerouted: list[tuple[int, dt.datetime, int, int]]
+    _trips: dict[dt.date, list[tuple[int, int, dt.datetime, int, int, int]]]
+    _maintenance: dict[dt.date, list[tuple[int, int]]]
+    _days: dict[dt.date, Any]
+    _fleet: Fleet
+    _employees: list[tuple[int, frozenset[int]]]
+    _trucks: dict[int, list[tuple[int, int]]]
+    _facility: dict[int, Optional[int]]
+
+    def __init__(self, snapshot: Snapshot, out_of_service: Iterable[int] = (),
+                 closed: Iterable[int] = ()) -> None:
+        """Initialize a simulation starting from <snapshot>, with the trucks
+        <out_of_service> taken out of service and the facilities <closed>
+        closed.
+        """
+        self.snapshot = snapshot
+        self.out_of_service = frozenset(out_of_service)
+        self.closed = frozenset(closed)
+        self.trips = []
+        self.maintenance = []
+        self.rerouted = []
+        self._trips = {}
+        self._maintenance = {}
+        self._days = {}
+        self._fleet = snapshot.fleet
+        self._employees = [
+            (employee.eid, self._fleet.trucktypes.codes(employee.drives))
+            for employee in self._fleet.preferred
+        ]
+        self._trucks = {}
+        self._facility = {}
+
+    def schedule_trip(self, rid: int, time: dt.datetime) -> bool:
+        """Return whether WasteWrangler.schedule_trip would schedule a trip
+        on route <rid> at <time>, and record the trip if so.
+        """
+        route = self._fleet.routes.get(rid)
+        if route is None:
+            return False
+        trip = _place_trip(rid, time, (
+            route.duration, self._lowest_facility(route.wastetype),
+            self._trucks_carrying(route.wastetype)
+        ), self._day(time.date()))
+        if trip is None:
+            return False
+        self._add_trips([trip])
+        return True
+
+    def schedule_trips(self, tid: int, date: dt.date) -> int:
+        """Return the number of trips WasteWrangler.schedule_trips would
+        schedule for truck <tid> on <date>, and record them.
+        """
+        if isinstance(date, dt.datetime):
+            date = date.date()
+        truck = self._fleet.trucks.get(tid)
+        if truck is None or tid in self.out_of_service:
+            return 0
+        trips = self._day_trips(date)
+        maintained = {other for other, _ in self._day_maintenance(date)}
+        if tid in maintained or any(trip[1] == tid for trip in trips):
+            return 0
+        taken = {trip[0] for trip in trips}
+        plan = _plan_day(date, [
+            (route.rid, route.duration,
+             self._lowest_facility(route.wastetype))
+            for route in self._fleet.routes_carried_by(truck.trucktype)
+            if route.rid not in taken
+        ])
+        if not plan:
+            return 0
+        busy = {trip[3] for trip in trips} | {trip[4] for trip in trips}
+        free = [eid for eid, _ in self._employees if eid not in busy]
+        crew = _pick_crew(free, self._fleet.drivers_of(truck.trucktype))
+        if crew is None:
+            return 0
+        self._add_trips([(rid, tid, start, crew[0], crew[1], fid)
+                         for rid, start, fid in plan])
+        return len(plan)
+
+    def schedule_maintenance(self, date: dt.date) -> int:
+        """Return the number of trucks WasteWrangler.schedule_maintenance
+        would schedule maintenance for after <date>, and record it.
+        """
+        recent = {tid for day in self._dates(date - dt.timedelta(days=90),
+                                             date + dt.timedelta(days=10))
+                  for tid, _ in self._day_maintenance(day)}
+        trucks = [(tid, self._fleet.technicians_for(truck.trucktype))
+                  for tid, truck in sorted(self._fleet.trucks.items())
+                  if tid not in recent and tid not in self.out_of_service]
+        trucks = [(tid, eids) for tid, eids in trucks if eids]
+
+        scheduled = []
+        first = date + dt.timedelta(days=1)
+        while trucks:
+            last = first + dt.timedelta(days=_MAINTENANCE_HORIZON - 1)
+            booked, busy = set(), set()
+            for day in self._dates(first, last):
+                for tid, eid in self._day_maintenance(day):
+                    booked.add((eid, day))
+                    busy.add((tid, day))
+                busy.update((trip[1], day) for trip in self._day_trips(day))
+            trucks = _solve_maintenance(trucks, booked, busy, first, last,
+                                        scheduled)
+            first = last + dt.timedelta(days=1)
+
+        for tid, eid, day in scheduled:
+            self._day_maintenance(day).append((tid, eid))
+            if day in self._days:
+                self._days[day].exclude({tid})
+        self.maintenance.extend(scheduled)
+        return len(scheduled)
+
+    def reroute_waste(self, fid: int, date: dt.date) -> int:
+        """Return the number of trips WasteWrangler.reroute_waste would
+        reroute away from facility <fid> on <date>, and record them.
+        """
+        facility = self._fleet.facilities.get(fid)
+        if facility is None:
+            return 0
+        alternative = next((
+            other.fid
+            for other in self._fleet.facilities_taking(facility.wastetype)
+            if other.fid != fid and other.fid not in self.closed
+        ), None)
+        if alternative is None:
+            return 0
+        trips = self._day_trips(date)
+        rerouted = 0
+        for i, trip in enumerate(trips):
+            if trip[5] == fid:
+                trips[i] = trip[:5] + (alternative,)
+                self.rerouted.append((trip[0], trip[2], fid, alternative))
+                rerouted += 1
+        return rerouted
+
+    def run(self, calls: Iterable[tuple[str, tuple]]) -> list[Any]:
+        """Make each (method name, arguments) call in <calls>, in order, and
+        return what each one returned.
+        """
+        return [getattr(self, method)(*args) for method, args in calls]
+
+    def _day_trips(self, day: dt.date
+                   ) -> list[tuple[int, int, dt.datetime, int, int, int]]:
+        """Return this simulation's own list of the trips starting on <day>.
+        """
+        if day not in self._trips:
+            self._trips[day] = self._fleet.trips.on(day)
+        return self._trips[day]
+
+    def _day_maintenance(self, day: dt.date) -> list[tuple[int, int]]:
+        """Return this simulation's own list of the (tID, eID) maintained on
+        <day>.
+        """
+        if day not in self._maintenance:
+            self._maintenance[day] = self._fleet.maintenance.on(day)
+        return self._maintenance[day]
+
+    def _day(self, day: dt.date) -> Any:
+        """Return the availability of the trucks and employees on <day>, as
+        a DayAvailability, or a _DayTrips if NumPy is not installed.
+        """
+        if day not in self._days:
+            availability = (DayAvailability or _DayTrips)(
+                day, _TRIP_GAP, sorted(self._fleet.trucks), self._employees)
+            routes = self._fleet.routes
+            midnight = dt.datetime.combine(day, dt.time())
+            availability.book_many([
+                (rid, tid, ttime, ttime + routes[rid].duration, eid1, eid2)
+                for before in (day - dt.timedelta(days=1), day)
+                for rid, tid, ttime, eid1, eid2, _ in self._day_trips(before)
+                if ttime + routes[rid].duration >= midnight
+            ])
+            availability.exclude({tid for tid, _
+                                  in self._day_maintenance(day)})
+            self._days[day] = availability
+        return self._days[day]
+
+    def _add_trips(self, trips: list[tuple[int, int, dt.datetime,
+                                           int, int, int]]) -> None:
+        """Record the (rID, tID, tTime, eID, eID, fID) <trips> as scheduled.
+        """
+        for rid, tid, ttime, eid, other, fid in trips:
+            trip = (rid, tid, ttime, max(eid, other), min(eid, other), fid)
+            self._day_trips(ttime.date()).append(trip)
+            self.trips.append(trip)
+            end = ttime + self._fleet.routes[rid].duration
+            for day in self._dates(ttime.date(), end.date()):
+                if day in self._days:
+                    self._days[day].book(rid, tid, ttime, end, trip[3],
+                                         trip[4])
+
+    def _trucks_carrying(self, wastetype: int) -> list[tuple[int, int]]:
+        """Return the (tID, truck type code) of the trucks in service that
+        can carry the waste type coded <wastetype>, by largest capacity and
+        then lowest tID.
+        """
+        if wastetype not in self._trucks:
+            self._trucks[wastetype] = [
+                (truck.tid, truck.trucktype)
+                for truck in self._fleet.trucks_carrying(wastetype)
+                if truck.tid not in self.out_of_service
+            ]
+        return self._trucks[wastetype]
+
+    def _lowest_facility(self, wastetype: int) -> Optional[int]:
+        """Return the lowest fID of the open facilities that take the waste
+        type coded <wastetype>, or None if there is none.
+        """
+        if wastetype not in self._facility:
+            self._facility[wastetype] = next((
+                facility.fid
+                for facility in self._fleet.facilities_taking(wastetype)
+                if facility.fid not in self.closed
+            ), None)
+        return self._facility[wastetype]
+
+    @staticmethod
+    def _dates(first: dt.date, last: dt.date) -> list[dt.date]:
+        """Return the days from <first> to <last> inclusive."""
+        return [first + dt.timedelta(days=i)
+                for i in range((last - first).days + 1)]
+
+
+class Scenario:
+    """An alternative to simulate.
+
+    === Instance Attributes ===
+    name: the name of the scenario.
+    calls: the (method name, arguments) calls to make, in order.
+    out_of_service: the tIDs of the trucks to take out of service.
+    closed: the fIDs of the facilities to close.
+    """
+    name: str
+    calls: list[tuple[str, tuple]]
+    out_of_service: frozenset[int]
+    closed: frozenset[int]
+
+    def __init__(self, name: str, calls: list[tuple[str, tuple]],
+                 out_of_service: Iterable[int] = (),
+                 closed: Iterable[int] = ()) -> None:
+        """Initialize a scenario named <name> making <calls>, with the
+        trucks <out_of_service> out of service and the facilities <closed>
+        closed.
+        """
+        self.name = name
+        self.calls = calls
+        self.out_of_service = frozenset(out_of_service)
+        self.closed = frozenset(closed)
+
+
+class Outcome:
+    """What a Scenario would do to the database.
+
+    === Instance Attributes ===
+    name: the name of the scenario.
+    results: what each call of the scenario returned, in order.
+    trips: the trips the scenario would schedule.
+    maintenance: the maintenance the scenario would schedule.
+    rerouted: the trips the scenario would reroute.
+    seconds: how long the simulation took.
+    """
+    name: str
+    results: list[Any]
+    trips: list[tuple[int, int, dt.datetime, int, int, int]]
+    maintenance: list[tuple[int, int, dt.date]]
+    rerouted: list[tuple[int, dt.datetime, int, int]]
+    seconds: float
+
+    def __init__(self, name: str, results: list[Any], simulation: Simulation,
+                 seconds: float) -> None:
+        """Initialize the outcome of the scenario <name>, whose calls
+        returned <results> in <simulation>, which took <seconds>.
+        """
+        self.name = name
+        self.results = results
+        self.trips = simulation.trips
+        self.maintenance = simulation.maintenance
+        self.rerouted = simulation.rerouted
+        self.seconds = seconds
+
+
+# The snapshot the scenarios run by this worker process start from.
+_WORKER_SNAPSHOT: Optional[Snapshot] = None
+
+
+def take_snapshot(wrangler: WasteWrangler, start: Optional[dt.date] = None
+                  ) -> Optional[Snapshot]:
+    """Return a snapshot of the database of <wrangler>, to be simulated from
+    <start> on, or from any day if <start> is None, or None if it could not
+    be read.
+
+    Only the trips and maintenance that calls on <start> or later can depend
+    on are loaded. They are streamed from server-side cursors,
+    <wrangler.itersize> rows at a time, into the columns of the snapshot.
+    Unless it is taken within a unit_of_work, every table is read in one
+    REPEATABLE READ transaction, so that they are consistent with each other.
+    """
+    try:
+        with wrangler._transaction("REPEATABLE READ, READ ONLY"
+                                   ) as connection:
+            cursor = connection.cursor()
+            wrangler.statements.execute(cursor, _SNAPSHOT)
+            row = cursor.fetchone()
+            maintenance, trips = MaintenanceTable(), TripTable()
+            maintenance.extend(wrangler.statements.stream(
+                connection, _SNAPSHOT_MAINTENANCE, (start,),
+                wrangler.itersize))
+            trips.extend(wrangler.statements.stream(
+                connection, _SNAPSHOT_TRIPS, (start,), wrangler.itersize))
+            return Snapshot(start, row, maintenance, trips)
+    except pg.Error as ex:
+        # You may find it helpful to uncomment this line while debugging,
+        # as it will show you all the details of the error that occurred:
+        # raise ex
+        return None
+
+
+def run_scenario(snapshot: Snapshot, scenario: Scenario) -> Outcome:
+    """Return the outcome of <scenario>, simulated from <snapshot>."""
+    start = perf_counter()
+    simulation = Simulation(snapshot, scenario.out_of_service,
+                            scenario.closed)
+    results = simulation.run(scenario.calls)
+    return Outcome(scenario.name, results, simulation,
+                   perf_counter() - start)
+
+
+def simulate(snapshot: Snapshot, scenarios: list[Scenario],
+             workers: Optional[int] = None) -> list[Outcome]:
+    """Return the outcome of each of <scenarios>, simulated from <snapshot>,
+    in order, on a pool of <workers> processes if <workers> is more than 1.
+    """
+    if workers is None or workers <= 1 or len(scenarios) <= 1:
+        return [run_scenario(snapshot, scenario) for scenario in scenarios]
+    with ProcessPoolExecutor(workers, initializer=_receive_snapshot,
+                             initargs=(snapshot,)) as executor:
+        return list(executor.map(_run_in_worker, scenarios))
+
+
+def _receive_snapshot(snapshot: Snapshot) -> None:
+    """Keep <snapshot> for the scenarios run by this worker process."""
+    global _WORKER_SNAPSHOT
+    _WORKER_SNAPSHOT = snapshot
+
+
+def _run_in_worker(scenario: Scenario) -> Outcome:
+    """Return the outcome of <scenario>, simulated from the snapshot of this
+    worker process.
+    """
+    return run_scenario(_WORKER_SNAPSHOT, scenario)